@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#Helpers shared by the benchmarks to create a throwaway root CA and device CSRs.
+
+#Dependencies
+import uuid
+from pathlib import Path
+from OpenSSL import crypto
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+
+# Key algorithms of the devices and the CA: (key generator, digest), the same choices as device_cert_gen.py
+KEY_ALGORITHMS = {
+    "rsa-2048": (lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048), "sha256"),
+    "rsa-3072": (lambda: rsa.generate_private_key(public_exponent=65537, key_size=3072), "sha256"),
+    "ecdsa-p256": (lambda: ec.generate_private_key(ec.SECP256R1()), "sha256"),
+    "ecdsa-p384": (lambda: ec.generate_private_key(ec.SECP384R1()), "sha384"),
+}
+
+
+#Define function to generate a key with one of KEY_ALGORITHMS, returns the pyOpenSSL key and its digest
+def generate_key(algorithm="rsa-2048"):
+    generate, digest = KEY_ALGORITHMS[algorithm]
+    return crypto.PKey.from_cryptography_key(generate()), digest
+
+
+#Define function to create a self signed root CA (rootCA.key and rootCA.pem) in a directory
+def create_root_ca(directory, algorithm="rsa-2048"):
+    key, digest = generate_key(algorithm)
+
+    cert = crypto.X509()
+    cert.get_subject().O = "AnyCompany"
+    cert.get_subject().CN = "Benchmark Root CA"
+    cert.set_serial_number(uuid.uuid4().int)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(24 * 60 * 60)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, digest)
+
+    key_path = Path(directory) / "rootCA.key"
+    cert_path = Path(directory) / "rootCA.pem"
+    key_path.write_bytes(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+    cert_path.write_bytes(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+    return key_path, cert_path
+
+
+#Define function to sign a device CSR (PEM) with a key, with the same DN fields as the simulated devices
+def sign_csr(common_name, key, digest="sha256"):
+    req = crypto.X509Req()
+    req.get_subject().CN = common_name
+    req.get_subject().O = "AnyCompany"
+    req.get_subject().dnQualifier = "AnyType"
+    req.set_pubkey(key)
+    req.sign(key, digest)
+    return crypto.dump_certificate_request(crypto.FILETYPE_PEM, req).decode("utf-8")
+
+
+#Define function to generate a device key and return its CSR (PEM)
+def create_csr(common_name, algorithm="rsa-2048"):
+    return sign_csr(common_name, *generate_key(algorithm))
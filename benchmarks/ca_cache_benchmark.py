@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This script measures signing requests/sec of the signing service CA handling before and after the CA cache.
+#"before" re-opens and re-parses rootCA.key and rootCA.pem for every CSR (the original sign_csr behaviour),
+#"after" uses the CACache from cert_signing_service/ca_cache.py. A throwaway CA is generated in a temporary
+#directory, so the benchmark runs on any machine without AWS resources.
+
+#Dependencies
+import argparse
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from OpenSSL import crypto
+
+# Define working path
+working_path = Path(__file__).resolve().parent
+repo_path = working_path.parent
+
+#Pass argument into variables using argparse
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--requests", action="store", type=int, default=500, dest="requests", help="Number of CSRs to sign on each run")
+parser.add_argument("-s", "--service-dir", action="store", default=str(repo_path / "just-in-time-provisioning" / "cert_signing_service"), dest="service_dir", help="cert_signing_service directory to benchmark")
+args = parser.parse_args()
+
+sys.path.insert(0, args.service_dir)
+from ca_cache import CACache  # noqa: E402
+from benchmark_pki import create_root_ca, create_csr  # noqa: E402
+
+
+#Define function that signs a CSR the way sign_csr did before the cache
+def sign_uncached(csr_data, key_path, cert_path):
+    ca_key = crypto.load_privatekey(crypto.FILETYPE_PEM, open(key_path).read())
+    ca_cert = crypto.load_certificate(crypto.FILETYPE_PEM, open(cert_path).read())
+    csr = crypto.load_certificate_request(crypto.FILETYPE_PEM, csr_data)
+
+    signed_cert = crypto.X509()
+    signed_cert.set_subject(csr.get_subject())
+    signed_cert.set_pubkey(csr.get_pubkey())
+    signed_cert.set_serial_number(uuid.uuid4().int)
+    signed_cert.gmtime_adj_notBefore(0)
+    signed_cert.gmtime_adj_notAfter(365 * 24 * 60 * 60)
+    signed_cert.set_issuer(ca_cert.get_subject())
+    signed_cert.sign(ca_key, "sha256")
+    return crypto.dump_certificate(crypto.FILETYPE_PEM, signed_cert)
+
+
+#Define function that signs a CSR with the cached CA material
+def sign_cached(csr_data, cache):
+    ca = cache.get()
+    csr = crypto.load_certificate_request(crypto.FILETYPE_PEM, csr_data)
+    signed_cert = ca.build_certificate(csr, uuid.uuid4().int)
+    ca.sign(signed_cert)
+    return crypto.dump_certificate(crypto.FILETYPE_PEM, signed_cert)
+
+
+#Define function to time a signing function over all CSRs and return requests/sec
+def run(name, sign_function, csrs):
+    start = time.perf_counter()
+    for csr_data in csrs:
+        sign_function(csr_data)
+    elapsed = time.perf_counter() - start
+    rate = len(csrs) / elapsed
+    print(f"{name:<28} {len(csrs):>6} requests in {elapsed:7.3f}s  {rate:9.1f} req/s")
+    return rate
+
+
+#Main
+with tempfile.TemporaryDirectory() as tmp_dir:
+    key_path, cert_path = create_root_ca(tmp_dir)
+
+    # A small set of CSRs is reused, CSR generation is not what we are measuring
+    csr_pool = [create_csr(f"HW-{i}") for i in range(min(args.requests, 20))]
+    csrs = [csr_pool[i % len(csr_pool)] for i in range(args.requests)]
+
+    cache = CACache(key_path, cert_path)
+    cache.get()
+
+    before = run("before (reload CA per CSR)", lambda csr: sign_uncached(csr, key_path, cert_path), csrs)
+    after = run("after (CACache)", lambda csr: sign_cached(csr, cache), csrs)
+    print(f"speedup: {after / before:.2f}x")
@@ -0,0 +1,94 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+
+#This script compares the key algorithms the devices and the CA can use (RSA 2048/3072, ECDSA P-256/P-384).
+#For each algorithm it measures on one thread how many device keys per second can be generated, how many CSRs per
+#second can be signed with those keys, and how many certificates per second the signing service signs with a CA
+#key of the same algorithm (or of --ca-algorithm). Keygen and CSRs are what the devices and the bulk simulation pay,
+#signing is what the signing service pays. The pool column is how many keys per second a device or the bulk simulation
+#draws from a key pool filled ahead of time (iot_client/key_pool.py) instead of generating them.
+
+#Dependencies
+import argparse
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+# Define working path
+working_path = Path(__file__).resolve().parent
+repo_path = working_path.parent
+
+#Pass arguments into variables using argparse
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--count", action="store", type=int, default=50, dest="count", help="Number of keys, CSRs and certificates per algorithm")
+parser.add_argument("-a", "--algorithms", action="store", nargs="+", default=None, dest="algorithms", help="Algorithms to compare (default: all)")
+parser.add_argument("--ca-algorithm", action="store", default=None, dest="ca_algorithm", help="Algorithm of the CA key (default: the algorithm of the devices)")
+parser.add_argument("-s", "--service-dir", action="store", default=str(repo_path / "just-in-time-provisioning" / "cert_signing_service"), dest="service_dir", help="cert_signing_service directory to benchmark")
+args = parser.parse_args()
+
+sys.path.insert(0, args.service_dir)
+sys.path.insert(0, str(Path(args.service_dir).parent / "iot_client"))
+from signing_backends import create_backend  # noqa: E402
+from key_pool import KeyPool, load_private_key  # noqa: E402
+from OpenSSL import crypto  # noqa: E402
+from benchmark_pki import KEY_ALGORITHMS, create_root_ca, generate_key, sign_csr  # noqa: E402
+
+
+#Define function to run a function on every item and return the items per second and its results
+def rate(function, items):
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    return len(items) / (time.perf_counter() - start), results
+
+
+#Define function to measure keygen, CSR and signing throughput of an algorithm
+def run(algorithm, ca_algorithm, count, ca_dir):
+    keygen_rate, keys = rate(lambda _: generate_key(algorithm), range(count))
+    csr_rate, csrs = rate(lambda index: sign_csr(f"HW-{index}", *keys[index]), range(count))
+
+    key_pool = KeyPool(ca_dir / "keys.db")
+    key_pool.add(algorithm, [crypto.dump_privatekey(crypto.FILETYPE_ASN1, key) for key, _ in keys])
+    pool_rate, _ = rate(lambda _: load_private_key(key_pool.take(algorithm)[0]), range(count))
+    key_pool.close()
+
+    create_root_ca(ca_dir, ca_algorithm)
+    backend = create_backend("pyopenssl", ca_dir / "rootCA.key", ca_dir / "rootCA.pem")
+    backend.load()
+    backend.sign(csrs[0], uuid.uuid4().int)
+    sign_rate, _ = rate(lambda csr_data: backend.sign(csr_data, uuid.uuid4().int), csrs)
+
+    print(f"{algorithm:<12} {ca_algorithm:<12} {keygen_rate:10.1f} {pool_rate:10.1f} {csr_rate:10.1f} {sign_rate:10.1f}")
+
+
+#Main
+algorithms = args.algorithms or list(KEY_ALGORITHMS)
+for algorithm in algorithms + ([args.ca_algorithm] if args.ca_algorithm else []):
+    if algorithm not in KEY_ALGORITHMS:
+        parser.error(f"Unknown algorithm {algorithm}, use one of {', '.join(KEY_ALGORITHMS)}")
+
+print(f"{'device key':<12} {'CA key':<12} {'keys/s':>10} {'pool/s':>10} {'CSRs/s':>10} {'certs/s':>10}")
+for algorithm in algorithms:
+    # A new CA directory per algorithm, the CA cache reloads on a changed file but the inode may be reused
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run(algorithm, args.ca_algorithm or algorithm, args.count, Path(tmp_dir))
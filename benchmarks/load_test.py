@@ -0,0 +1,265 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This script load tests the CSR signing service on a single machine, without AWS.
+#For every selected variant (jitp uses uuid serial numbers, jitr hands out serial numbers from serial_numbers.json)
+#the cert_signing_service directory is copied to a temporary directory together with a throwaway root CA (and a
+#serial number list for jitr), signing_service.py is started on a free port and driven with a pre-generated
+#corpus of CSRs. Requests are sent back to back by every client (closed loop), or at a fixed arrival rate
+#(open loop, --rate), in which case the latency is measured from the scheduled send time.
+#Throughput, p50/p95/p99 latency and error rate are printed and written to a JSON file for regression tracking.
+
+#Dependencies
+import argparse
+import datetime
+import json
+import os
+import platform
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import requests
+from benchmark_pki import create_root_ca, create_csr
+
+# Define working path
+working_path = Path(__file__).resolve().parent
+repo_path = working_path.parent
+
+# Signing service of each variant
+SERVICE_DIRECTORIES = {
+    "jitp": repo_path / "just-in-time-provisioning" / "cert_signing_service",
+    "jitr": repo_path / "just-in-time-registration" / "cert_signing_service",
+}
+
+
+#Define function to load the CSR corpus from a JSON Lines file, or generate it (and save it) if the file does not exist
+def load_corpus(corpus_path, size):
+    if corpus_path and os.path.exists(corpus_path):
+        with open(corpus_path, "r") as corpus_file:
+            corpus = [json.loads(line)["csr"] for line in corpus_file if line.strip()]
+        print(f"Loaded {len(corpus)} CSRs from {corpus_path}")
+        return corpus
+
+    print(f"Generating {size} CSRs...")
+    with ProcessPoolExecutor() as executor:
+        corpus = list(executor.map(create_csr, [f"HW-{index}" for index in range(size)], chunksize=16))
+    if corpus_path:
+        with open(corpus_path, "w") as corpus_file:
+            for csr in corpus:
+                corpus_file.write(json.dumps({"csr": csr}) + "\n")
+        print(f"Saved CSR corpus to {corpus_path}")
+    return corpus
+
+
+#Define function to find a free local TCP port
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+#Define function to copy a signing service to a temporary directory and start it, returns the process and its URL
+def start_signing_service(variant, directory, workers, serial_numbers, cache_size=0):
+    service_path = Path(directory) / "cert_signing_service"
+    shutil.copytree(
+        SERVICE_DIRECTORIES[variant], service_path,
+        ignore=shutil.ignore_patterns("logs", "crl", "__pycache__", "*.journal", "*.jsonl", "*.db*", "rootCA.*")
+    )
+    create_root_ca(service_path / "certs")
+    if variant == "jitr":
+        with open(service_path / "serial_numbers.json", "w") as serial_file:
+            json.dump({"serial_numbers": [uuid.uuid4().int for _ in range(serial_numbers)]}, serial_file)
+
+    port = find_free_port()
+    # The corpus is sent many times, with the issued certificate cache on most requests would not be signed
+    command = [sys.executable, "signing_service.py", "--port", str(port), "--cache-size", str(cache_size)]
+    if workers:
+        command += ["--workers", str(workers)]
+    process = subprocess.Popen(command, cwd=service_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Wait until the service answers on /metrics
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"Signing service exited with code {process.returncode}, see {service_path}/logs/server.log")
+        try:
+            if requests.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return process, url
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise Exception("Signing service did not start within 60 seconds")
+
+
+#Define function to stop the signing service gracefully
+def stop_signing_service(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+#Define function to send the corpus to the service, returns a list of (latency_seconds, ok) and the elapsed time
+def run_load(url, corpus, total_requests, concurrency, rate):
+    jobs = queue.Queue()
+    results = []
+    results_lock = threading.Lock()
+
+    #Define function that runs on every client thread, each client keeps its own connection open
+    def client():
+        session = requests.Session()
+        local_results = []
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            index, scheduled = job
+            # Open loop requests wait for their send time, latency counts from then (no coordinated omission)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            start = scheduled if rate else time.perf_counter()
+            try:
+                response = session.post(url, data=corpus[index % len(corpus)].encode("utf-8"), headers={"Content-Type": "application/x-pem-file"}, timeout=60)
+                # The single CSR endpoint answers 200 with an empty body when signing fails
+                ok = response.status_code == 200 and response.text.startswith("-----BEGIN CERTIFICATE-----")
+            except requests.exceptions.RequestException:
+                ok = False
+            local_results.append((time.perf_counter() - start, ok))
+        with results_lock:
+            results.extend(local_results)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    begin = time.perf_counter()
+    for index in range(total_requests):
+        jobs.put((index, begin + index / rate if rate else 0.0))
+    for _ in threads:
+        jobs.put(None)
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - begin
+
+
+#Define function to return the value at a percentile of a sorted list (nearest rank)
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(percent / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+#Define function to summarize the results of a run
+def summarize(variant, results, elapsed, config):
+    latencies = sorted(latency for latency, ok in results if ok)
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "variant": variant,
+        "config": config,
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": errors / len(results) if results else 0.0,
+        "duration_seconds": elapsed,
+        "throughput_rps": (len(results) - errors) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": 1000 * percentile(latencies, 50),
+            "p95": 1000 * percentile(latencies, 95),
+            "p99": 1000 * percentile(latencies, 99),
+            "max": 1000 * latencies[-1] if latencies else 0.0,
+        },
+    }
+
+
+if __name__ == "__main__":
+    #Pass arguments into variables using argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--variant", action="store", choices=["jitp", "jitr", "both"], default="both", dest="variant", help="Signing service variant to test")
+    parser.add_argument("-n", "--requests", action="store", type=int, default=1000, dest="requests", help="Number of CSRs to send on each run")
+    parser.add_argument("-c", "--concurrency", action="store", type=int, default=16, dest="concurrency", help="Number of concurrent clients")
+    parser.add_argument("-r", "--rate", action="store", type=float, default=0, dest="rate", help="Arrival rate in requests/sec (default: 0, closed loop)")
+    parser.add_argument("-w", "--workers", action="store", type=int, default=0, dest="workers", help="Signing service --workers (default: the service default)")
+    parser.add_argument("--cache-size", action="store", type=int, default=0, dest="cache_size", help="Signing service --cache-size (default: 0, every CSR is signed)")
+    parser.add_argument("--warmup", action="store", type=int, default=50, dest="warmup", help="Requests sent before measuring")
+    parser.add_argument("--corpus", action="store", default=str(working_path / "csr_corpus.jsonl"), dest="corpus", help="JSON Lines CSR corpus, generated if it does not exist")
+    parser.add_argument("--corpus-size", action="store", type=int, default=200, dest="corpus_size", help="Number of CSRs to generate for a new corpus")
+    parser.add_argument("--url", action="store", default=None, dest="url", help="Test an already running signing service instead of starting one")
+    parser.add_argument("-o", "--output", action="store", default="load_test_results.json", dest="output", help="JSON file the results are written to")
+    args = parser.parse_args()
+
+    # Main
+    corpus = load_corpus(args.corpus, args.corpus_size)
+    variants = ["jitp", "jitr"] if args.variant == "both" else [args.variant]
+    if args.url:
+        variants = [args.variant if args.variant != "both" else "external"]
+
+    config = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "workers": args.workers or None,
+        "cache_size": args.cache_size,
+        "warmup": args.warmup,
+        "corpus_size": len(corpus),
+    }
+    summaries = []
+    for variant in variants:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            process = None
+            url = args.url
+            if url is None:
+                process, url = start_signing_service(variant, tmp_dir, args.workers, args.requests + args.warmup, args.cache_size)
+            try:
+                if args.warmup:
+                    run_load(url, corpus, args.warmup, args.concurrency, 0)
+                results, elapsed = run_load(url, corpus, args.requests, args.concurrency, args.rate)
+            finally:
+                if process is not None:
+                    stop_signing_service(process)
+
+        summary = summarize(variant, results, elapsed, config)
+        summaries.append(summary)
+        latency = summary["latency_ms"]
+        print(f"{variant}: {summary['requests']} requests in {elapsed:.2f}s, {summary['throughput_rps']:.1f} req/s, "
+              f"p50 {latency['p50']:.1f}ms p95 {latency['p95']:.1f}ms p99 {latency['p99']:.1f}ms, "
+              f"error rate {100 * summary['error_rate']:.2f}%")
+
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "results": summaries,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,99 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This script compares the signing backends of the signing service (cert_signing_service/signing_backends.py).
+#Each backend signs the same CSRs on one thread, the script reports certificates/sec and the latency of the whole
+#signature and of the signing step alone. The pyopenssl and cryptography backends use a throwaway CA, the pkcs11
+#backend is only run when --pkcs11-module is given, with the CA of --ca-dir whose key was imported in the token.
+
+#Dependencies
+import argparse
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+# Define working path
+working_path = Path(__file__).resolve().parent
+repo_path = working_path.parent
+
+#Pass arguments into variables using argparse
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--requests", action="store", type=int, default=500, dest="requests", help="Number of CSRs to sign with each backend")
+parser.add_argument("-s", "--service-dir", action="store", default=str(repo_path / "just-in-time-provisioning" / "cert_signing_service"), dest="service_dir", help="cert_signing_service directory to benchmark")
+parser.add_argument("--ca-dir", action="store", default=None, dest="ca_dir", help="Directory with rootCA.key and rootCA.pem (default: a throwaway CA)")
+parser.add_argument("--pkcs11-module", action="store", default=None, dest="pkcs11_module", help="PKCS#11 library, e.g. /usr/lib/softhsm/libsofthsm2.so, the PIN is read from PKCS11_PIN")
+parser.add_argument("--pkcs11-token-label", action="store", default="signing-ca", dest="pkcs11_token_label", help="Label of the token holding the CA key")
+parser.add_argument("--pkcs11-key-label", action="store", default="rootCA", dest="pkcs11_key_label", help="Label of the CA private key on the token")
+args = parser.parse_args()
+
+sys.path.insert(0, args.service_dir)
+from signing_backends import create_backend  # noqa: E402
+from benchmark_pki import create_root_ca, create_csr  # noqa: E402
+
+
+#Define function to return the value at a percentile of a sorted list (nearest rank)
+def percentile(sorted_values, percent):
+    rank = max(1, int(round(percent / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+#Define function to sign every CSR with a backend and print its throughput and latency
+def run(backend, csrs):
+    backend.load()
+    backend.sign(csrs[0], uuid.uuid4().int)
+
+    totals = []
+    signatures = []
+    start = time.perf_counter()
+    for csr_data in csrs:
+        sign_start = time.perf_counter()
+        _, _, timings = backend.sign(csr_data, uuid.uuid4().int)
+        totals.append(time.perf_counter() - sign_start)
+        signatures.append(timings["sign"])
+    elapsed = time.perf_counter() - start
+
+    totals.sort()
+    signatures.sort()
+    print(f"{backend.name:<14} {len(csrs) / elapsed:9.1f} certs/s  "
+          f"p50 {1000 * percentile(totals, 50):6.2f}ms  p99 {1000 * percentile(totals, 99):6.2f}ms  "
+          f"sign p50 {1000 * percentile(signatures, 50):6.2f}ms  sign p99 {1000 * percentile(signatures, 99):6.2f}ms")
+
+
+#Main
+with tempfile.TemporaryDirectory() as tmp_dir:
+    ca_dir = Path(args.ca_dir) if args.ca_dir else Path(tmp_dir)
+    if not args.ca_dir:
+        create_root_ca(ca_dir)
+    key_path = ca_dir / "rootCA.key"
+    cert_path = ca_dir / "rootCA.pem"
+
+    # A small set of CSRs is reused, CSR generation is not what we are measuring
+    csr_pool = [create_csr(f"HW-{i}") for i in range(min(args.requests, 20))]
+    csrs = [csr_pool[i % len(csr_pool)] for i in range(args.requests)]
+
+    backends = ["pyopenssl", "cryptography"]
+    if args.pkcs11_module:
+        backends.append("pkcs11")
+    options = {"module": args.pkcs11_module, "token_label": args.pkcs11_token_label, "key_label": args.pkcs11_key_label}
+    for name in backends:
+        run(create_backend(name, key_path, cert_path, options), csrs)
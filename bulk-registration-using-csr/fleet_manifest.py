@@ -0,0 +1,246 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module generates the manifest of a simulated fleet: one row per device with its serial number, thing name and
+#attributes, in columns (CSV, Parquet or Arrow) that simulation.py -m turns into keys, CSRs and parameters.json.
+#The attributes follow a fleet spec (fleet_spec.json): a weighted distribution of the values of every attribute,
+#the tenants (thing groups) with their weights and their own distributions, and a seed. The rows are generated in
+#batches of columns with numpy, batch i from a generator seeded with (seed, i), so the same spec, seed and number of
+#devices always give the same manifest.
+#   python3 fleet_manifest.py -n <NUMBER-OF-DEVICES> -o manifest.parquet [-s fleet_spec.json] [--seed <SEED>]
+
+#Dependencies
+import os
+import csv
+import json
+import time
+import secrets
+import logging
+import argparse
+import itertools
+import numpy as np
+
+
+# Rows generated and written at a time
+BATCH_SIZE = 65536
+
+# Formats of the manifests by file extension, Parquet and Arrow need pyarrow
+FORMATS = {".csv": "csv", ".parquet": "parquet", ".pq": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+# Columns of a manifest, named as the parameters of bulk_registration_template.json
+COLUMNS = ("ThingName", "SerialNumber", "ThingTypeName", "ThingGroup", "countryOrigin", "licenseType", "businessUnitMaker", "hardwareVersion", "softwareVersion")
+
+# Columns set by the generator, the spec sets the others
+GENERATED_COLUMNS = ("ThingName", "SerialNumber", "ThingGroup")
+
+# Spec of the fleet simulation.py generates without a manifest, every value equally likely
+DEFAULT_SPEC = {
+    "attributes": {
+        "ThingTypeName": {"ThingTypeA": 1, "ThingTypeB": 1, "ThingTypeC": 1, "ThingTypeD": 1},
+        "countryOrigin": {"US": 1, "UK": 1, "IN": 1, "CH": 1},
+        "licenseType": {"premium": 1, "basic": 1},
+    },
+    # "" is the unclaimed devices, without a thing group
+    "tenants": {"CustomerA": {"weight": 1}, "CustomerB": {"weight": 1}, "CustomerC": {"weight": 1}, "": {"weight": 1}},
+    "constants": {"businessUnitMaker": "AnyCompany", "hardwareVersion": "100", "softwareVersion": "100"},
+}
+
+
+#Define function to turn a distribution {value: weight} into the values and their probabilities
+def distribution(name, weights):
+    if not isinstance(weights, dict) or not weights:
+        raise ValueError(f"The distribution of {name} must be an object of values and weights")
+    values = list(weights)
+    probabilities = np.asarray([weights[value] for value in values], dtype=float)
+    if (probabilities < 0).any() or probabilities.sum() <= 0:
+        raise ValueError(f"The weights of {name} must be positive numbers")
+    return np.asarray(values, dtype=object), probabilities / probabilities.sum()
+
+
+#Describe class that holds a validated fleet spec, ready to draw batches of rows from
+class FleetSpec:
+    def __init__(self, spec):
+        unknown = set(spec) - {"seed", "attributes", "tenants", "constants"}
+        if unknown:
+            raise ValueError(f"Unknown fields in the fleet spec: {', '.join(sorted(unknown))}")
+        self.seed = spec.get("seed")
+        self.constants = spec.get("constants", DEFAULT_SPEC["constants"])
+        self.attributes = {name: distribution(name, weights) for name, weights in spec.get("attributes", DEFAULT_SPEC["attributes"]).items()}
+        tenants = spec.get("tenants", DEFAULT_SPEC["tenants"])
+        self.tenants, self.tenant_probabilities = distribution("tenants", {name: tenant.get("weight", 1) for name, tenant in tenants.items()})
+        # Distributions of a tenant replacing the fleet ones for its devices: {tenant index: {attribute: (values, probabilities)}}
+        self.tenant_attributes = {}
+        for index, tenant in enumerate(tenants.values()):
+            overrides = {name: distribution(f"{name} of tenant {self.tenants[index]}", weights) for name, weights in tenant.get("attributes", {}).items()}
+            if overrides:
+                self.tenant_attributes[index] = overrides
+
+        names = set(self.attributes) | set(self.constants) | {name for overrides in self.tenant_attributes.values() for name in overrides}
+        for name in names:
+            if name not in COLUMNS or name in GENERATED_COLUMNS:
+                raise ValueError(f"{name} cannot be set by the fleet spec, the spec sets {', '.join(column for column in COLUMNS if column not in GENERATED_COLUMNS)}")
+        for name in COLUMNS:
+            if name not in GENERATED_COLUMNS and name not in self.attributes and name not in self.constants:
+                raise ValueError(f"The fleet spec has no distribution or constant for {name}")
+        for overrides in self.tenant_attributes.values():
+            for name in overrides:
+                if name not in self.attributes:
+                    raise ValueError(f"{name} is a constant, a tenant cannot give it a distribution")
+
+    #Define function to load a fleet spec from a JSON file, the default spec when path is None
+    @classmethod
+    def load(cls, path=None):
+        if path is None:
+            return cls(DEFAULT_SPEC)
+        with open(path, "r") as spec_file:
+            return cls(json.load(spec_file))
+
+    #Define function to draw a batch of rows with a numpy generator, returns {column: list of values}
+    def batch(self, rng, size):
+        tenant_indexes = rng.choice(len(self.tenants), size=size, p=self.tenant_probabilities)
+        columns = {"ThingGroup": self.tenants[tenant_indexes]}
+        for name, (values, probabilities) in self.attributes.items():
+            column = values[rng.choice(len(values), size=size, p=probabilities)]
+            for tenant_index, overrides in self.tenant_attributes.items():
+                if name in overrides:
+                    mask = tenant_indexes == tenant_index
+                    tenant_values, tenant_probabilities = overrides[name]
+                    column[mask] = tenant_values[rng.choice(len(tenant_values), size=int(mask.sum()), p=tenant_probabilities)]
+            columns[name] = column
+
+        # Serial numbers are random (version 4) UUIDs in hex, as simulation.py generates them
+        serials = np.frombuffer(rng.bytes(16 * size), dtype=np.uint8).reshape(size, 16).copy()
+        serials[:, 6] = (serials[:, 6] & 0x0F) | 0x40
+        serials[:, 8] = (serials[:, 8] & 0x3F) | 0x80
+        serials_hex = serials.tobytes().hex()
+        columns["SerialNumber"] = [serials_hex[i:i + 32] for i in range(0, 32 * size, 32)]
+        columns["ThingName"] = [f"{thing_type}_{serial}" for thing_type, serial in zip(columns["ThingTypeName"].tolist(), columns["SerialNumber"])]
+        for name, value in self.constants.items():
+            columns[name] = [value] * size
+        return {name: column if isinstance(column, list) else column.tolist() for name, column in columns.items()}
+
+
+#Define function to generate the batches of a manifest: {column: list of values}, batch i is drawn from (seed, i)
+def generate_batches(spec, number_of_devices, seed):
+    for index, start in enumerate(range(0, number_of_devices, BATCH_SIZE)):
+        rng = np.random.default_rng([seed, index])
+        yield spec.batch(rng, min(BATCH_SIZE, number_of_devices - start))
+
+
+#Define function to return the format of a manifest from its file extension
+def manifest_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown manifest format {extension or path}, use one of {', '.join(FORMATS)}")
+    return FORMATS[extension]
+
+
+#Define function to write batches of rows to a manifest, returns the number of rows written
+def write_manifest(path, batches):
+    file_format = manifest_format(path)
+    written = 0
+    if file_format == "csv":
+        with open(path, "w", newline="") as manifest_file:
+            writer = csv.writer(manifest_file)
+            writer.writerow(COLUMNS)
+            for batch in batches:
+                writer.writerows(zip(*(batch[name] for name in COLUMNS)))
+                written += len(batch["SerialNumber"])
+        return written
+
+    # pyarrow is only needed for the Parquet and Arrow manifests
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.string()) for name in COLUMNS])
+    writer = pq.ParquetWriter(path, schema) if file_format == "parquet" else pa.ipc.new_file(path, schema)
+    try:
+        for batch in batches:
+            writer.write_table(pa.table({name: batch[name] for name in COLUMNS}, schema=schema))
+            written += len(batch["SerialNumber"])
+    finally:
+        writer.close()
+    return written
+
+
+#Define function to read the rows of a manifest as parameters of simulation.py (with "CSR": None), from row start
+def read_manifest(path, start=0):
+    file_format = manifest_format(path)
+    if file_format == "csv":
+        with open(path, "r", newline="") as manifest_file:
+            for row in itertools.islice(csv.DictReader(manifest_file), start, None):
+                row["CSR"] = None
+                yield row
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if file_format == "parquet":
+        record_batches = pq.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE)
+    else:
+        reader = pa.ipc.open_file(path)
+        record_batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+    skip = start
+    for record_batch in record_batches:
+        if skip >= record_batch.num_rows:
+            skip -= record_batch.num_rows
+            continue
+        for row in record_batch.slice(skip).to_pylist():
+            row["CSR"] = None
+            yield row
+        skip = 0
+
+
+#Define function to return the number of rows of a manifest
+def count_manifest_rows(path):
+    file_format = manifest_format(path)
+    if file_format == "csv":
+        with open(path, "r", newline="") as manifest_file:
+            return max(0, sum(1 for _ in csv.reader(manifest_file)) - 1)
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if file_format == "parquet":
+        return pq.ParquetFile(path).metadata.num_rows
+    reader = pa.ipc.open_file(path)
+    return sum(reader.get_batch(index).num_rows for index in range(reader.num_record_batches))
+
+
+#Main, generate a manifest from the command line
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--fleetsize", action="store", type=int, required=True, dest="fleetsize", help="Numbers of devices in the manifest")
+    parser.add_argument("-o", "--output", action="store", default="manifest.csv", dest="output", help=f"Manifest file, the format follows the extension: {', '.join(FORMATS)} (default: manifest.csv)")
+    parser.add_argument("-s", "--spec", action="store", default=None, dest="spec", help="Fleet spec, a JSON file such as fleet_spec.json (default: the fleet of simulation.py, every value equally likely)")
+    parser.add_argument("--seed", action="store", type=int, default=None, dest="seed", help="Seed of the manifest, overrides the seed of the spec (default: the seed of the spec, or a random seed)")
+    args = parser.parse_args()
+
+    spec = FleetSpec.load(args.spec)
+    seed = args.seed if args.seed is not None else spec.seed
+    if seed is None:
+        seed = secrets.randbits(63)
+    start = time.monotonic()
+    written = write_manifest(args.output, generate_batches(spec, args.fleetsize, seed))
+    elapsed = time.monotonic() - start
+    print(f"INFO - Wrote {written} devices to {args.output} in {elapsed:.1f}s ({written / elapsed if elapsed > 0 else 0:.0f} devices/s), seed {seed}")
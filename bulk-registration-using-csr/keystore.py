@@ -0,0 +1,248 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module stores the device keys and CSRs of the bulk simulation in a SQLite database, instead of keyStore.json
+#and CSRStore.json. The private key (PKCS#8) and the CSR of a device are stored DER encoded in one row keyed by the
+#serial number, so the key of one device is found with an index lookup instead of parsing the whole JSON file, and
+#the rows are iterated in the order the devices were generated. The JSON files can be imported, and the keystore
+#exported back to PEM files:
+#   python3 keystore.py <KEYSTORE> import [--key-store keyStore.json] [--csr-store CSRStore.json]
+#   python3 keystore.py <KEYSTORE> get <SERIAL-NUMBER>
+#   python3 keystore.py <KEYSTORE> export <DIRECTORY> [-s <SERIAL-NUMBER> ...]
+
+#Dependencies
+import os
+import sys
+import json
+import base64
+import sqlite3
+import logging
+import argparse
+
+
+# Labels of the PEM blocks of the device keys and CSRs
+PRIVATE_KEY_LABEL = "PRIVATE KEY"
+CSR_LABEL = "CERTIFICATE REQUEST"
+
+# Number of rows inserted in one transaction when JSON files are imported
+IMPORT_BATCH_SIZE = 10000
+
+# Bytes read at a time when JSON files are imported
+READ_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial_number TEXT NOT NULL UNIQUE,
+    private_key BLOB,
+    csr BLOB
+);
+"""
+
+
+#Define function to return the DER bytes of a PEM block, checking its label
+def pem_to_der(pem, label):
+    lines = pem.strip().splitlines()
+    if lines[0] != f"-----BEGIN {label}-----" or lines[-1] != f"-----END {label}-----":
+        raise ValueError(f"Expected a PEM {label}, got {lines[0]}")
+    return base64.b64decode("".join(lines[1:-1]))
+
+
+#Define function to return the PEM block of DER bytes, with 64 characters per line as OpenSSL writes it
+def der_to_pem(der, label):
+    encoded = base64.b64encode(der).decode("ascii")
+    body = "\n".join(encoded[i:i + 64] for i in range(0, len(encoded), 64))
+    return f"-----BEGIN {label}-----\n{body}\n-----END {label}-----\n"
+
+
+#Define function to read the JSON objects of a file one at a time
+#It reads JSON Lines as well as the concatenated indented objects the simulation used to write
+def read_json_objects(path):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    with open(path, "r") as json_file:
+        while True:
+            data = json_file.read(READ_SIZE)
+            buffer += data
+            position = 0
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position == len(buffer):
+                    break
+                try:
+                    value, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not data:
+                        raise
+                    # The object goes on in the next read
+                    break
+                yield value
+            buffer = buffer[position:]
+            if not data:
+                return
+
+
+#Describe class that stores the DER encoded key and CSR of every device by serial number
+#Rows are written in an open transaction, commit() makes them durable. A device written again (e.g. by a resumed
+#simulation) replaces the row of its serial number.
+class KeyStore:
+    def __init__(self, path):
+        self.path = str(path)
+        self._connection = sqlite3.connect(self.path, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # The simulation checkpoints the devices committed here
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+
+    def __contains__(self, serial_number):
+        return self._connection.execute("SELECT 1 FROM devices WHERE serial_number = ?", (serial_number,)).fetchone() is not None
+
+    #Define function to write the key and CSR of a device, given in PEM
+    def add(self, serial_number, private_key_pem, csr_pem):
+        self.add_der(serial_number, pem_to_der(private_key_pem, PRIVATE_KEY_LABEL), pem_to_der(csr_pem, CSR_LABEL))
+
+    #Define function to write the key and CSR of a device, given DER encoded
+    def add_der(self, serial_number, private_key_der, csr_der):
+        self._connection.execute("INSERT OR REPLACE INTO devices (serial_number, private_key, csr) VALUES (?, ?, ?)", (serial_number, private_key_der, csr_der))
+
+    #Define function to commit the devices written so far
+    def commit(self):
+        self._connection.commit()
+
+    #Define function to return the DER encoded key and CSR of a device, (None, None) when it is not in the keystore
+    def get_der(self, serial_number):
+        row = self._connection.execute("SELECT private_key, csr FROM devices WHERE serial_number = ?", (serial_number,)).fetchone()
+        return row if row is not None else (None, None)
+
+    #Define function to return the key and CSR of a device in PEM, (None, None) when it is not in the keystore
+    def get(self, serial_number):
+        private_key_der, csr_der = self.get_der(serial_number)
+        if private_key_der is None and csr_der is None:
+            return None, None
+        return (der_to_pem(private_key_der, PRIVATE_KEY_LABEL) if private_key_der is not None else None,
+                der_to_pem(csr_der, CSR_LABEL) if csr_der is not None else None)
+
+    #Define function to iterate the devices in the order they were written: (serial_number, private_key, csr)
+    #The key and CSR are DER encoded, or PEM with pem=True
+    def items(self, pem=False):
+        cursor = self._connection.cursor()
+        cursor.arraysize = 1000
+        cursor.execute("SELECT serial_number, private_key, csr FROM devices ORDER BY id")
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                return
+            for serial_number, private_key, csr in rows:
+                if pem:
+                    private_key = der_to_pem(private_key, PRIVATE_KEY_LABEL) if private_key is not None else None
+                    csr = der_to_pem(csr, CSR_LABEL) if csr is not None else None
+                yield serial_number, private_key, csr
+
+    #Define function to import keyStore.json and CSRStore.json, returns the number of keys and CSRs imported
+    #The files are matched by serial number, a device missing from one of them has no key or no CSR
+    def import_json(self, key_store_path="keyStore.json", csr_store_path="CSRStore.json"):
+        imported = []
+        for path, field, column, label in ((key_store_path, "private_key", "private_key", PRIVATE_KEY_LABEL), (csr_store_path, "csr", "csr", CSR_LABEL)):
+            count = 0
+            rows = []
+            for record in read_json_objects(path):
+                rows.append((record["device_serialNumber"], pem_to_der(record[field], label)))
+                if len(rows) >= IMPORT_BATCH_SIZE:
+                    count += self._upsert(column, rows)
+                    rows = []
+            count += self._upsert(column, rows)
+            logging.info(f"Imported {count} rows of {path} into the keystore {self.path}")
+            imported.append(count)
+        return tuple(imported)
+
+    def _upsert(self, column, rows):
+        with self._connection:
+            self._connection.executemany(f"INSERT INTO devices (serial_number, {column}) VALUES (?, ?) ON CONFLICT (serial_number) DO UPDATE SET {column} = excluded.{column}", rows)
+        return len(rows)
+
+    #Define function to export devices to PEM files in a directory, <serial number>.key and <serial number>.csr
+    #Exports every device when serial_numbers is None, returns the number of devices exported
+    def export_pem(self, directory, serial_numbers=None):
+        os.makedirs(directory, exist_ok=True)
+        if serial_numbers is None:
+            devices = self.items(pem=True)
+        else:
+            devices = ((serial_number, *self.get(serial_number)) for serial_number in serial_numbers)
+        exported = 0
+        for serial_number, private_key_pem, csr_pem in devices:
+            if private_key_pem is None and csr_pem is None:
+                logging.warning(f"Device {serial_number} is not in the keystore {self.path}")
+                continue
+            if private_key_pem is not None:
+                key_path = os.path.join(directory, f"{serial_number}.key")
+                with open(os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as key_file:
+                    key_file.write(private_key_pem)
+            if csr_pem is not None:
+                with open(os.path.join(directory, f"{serial_number}.csr"), "w") as csr_file:
+                    csr_file.write(csr_pem)
+            exported += 1
+        return exported
+
+    #Define function to commit and close the keystore
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+#Main, import, look up and export keystores from the command line
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("keystore", action="store", help="Keystore database, created when missing")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Import the keys and CSRs of the JSON files written by the simulation")
+    import_parser.add_argument("--key-store", action="store", default="keyStore.json", dest="key_store", help="Keys file (default: keyStore.json)")
+    import_parser.add_argument("--csr-store", action="store", default="CSRStore.json", dest="csr_store", help="CSRs file (default: CSRStore.json)")
+    get_parser = commands.add_parser("get", help="Print the private key and CSR of a device in PEM")
+    get_parser.add_argument("serial_number", action="store", help="Serial number of the device")
+    export_parser = commands.add_parser("export", help="Write the keys and CSRs to PEM files, <serial number>.key and <serial number>.csr")
+    export_parser.add_argument("directory", action="store", help="Directory of the PEM files, created when missing")
+    export_parser.add_argument("-s", "--serial-number", action="append", default=None, dest="serial_numbers", help="Export only this device, can be repeated (default: every device)")
+    args = parser.parse_args()
+
+    with KeyStore(args.keystore) as keystore:
+        if args.command == "import":
+            keys, csrs = keystore.import_json(args.key_store, args.csr_store)
+            print(f"INFO - Imported {keys} keys and {csrs} CSRs, {len(keystore)} devices in {args.keystore}")
+        elif args.command == "get":
+            private_key_pem, csr_pem = keystore.get(args.serial_number)
+            if private_key_pem is None and csr_pem is None:
+                print(f"ERROR - Device {args.serial_number} is not in {args.keystore}")
+                sys.exit(1)
+            print((private_key_pem or "") + (csr_pem or ""), end="")
+        elif args.command == "export":
+            exported = keystore.export_pem(args.directory, args.serial_numbers)
+            print(f"INFO - Exported {exported} devices to {args.directory}")
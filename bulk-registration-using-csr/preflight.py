@@ -0,0 +1,399 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module checks a parameters file against the provisioning template before it is uploaded, so bad rows are
+#found in seconds instead of after a registration task. The template is read once, the file is streamed in batches
+#of rows checked on a pool of worker processes:
+# * every parameter without a default is present, and every parameter has the type of the template
+# * every CSR parses and its signature is valid
+# * no ThingName or SerialNumber appears twice (a 64 bit hash and the row number of every value are kept)
+# * the thing types and thing groups the rows refer to exist in AWS IoT Core, and the thing types are not deprecated
+#Every error is written with its row number (the line of the file) to preflight_report.jsonl.
+#The rows streamed to S3 without a local file (-s and -c of simulation.py) are checked one by one as they are written
+#by RowValidator, which stops the upload at the first bad row.
+#   python3 preflight.py parameters.json [-t bulk_registration_template.json] [-w <WORKERS>] [--skip-iot]
+
+#Dependencies
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import collections
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from cryptography import x509
+from botocore.exceptions import BotoCoreError, ClientError
+from registration_tasks import create_iot_client
+
+
+# Template the rows are checked against
+TEMPLATE_FILE = "bulk_registration_template.json"
+
+# Report of the errors, one JSON object per line: {"row", "parameter", "error"}
+REPORT_FILE = "preflight_report.jsonl"
+
+# Rows checked at a time by a worker process
+BATCH_SIZE = 2000
+
+# Parameters that must be unique in the file
+UNIQUE_PARAMETERS = ("ThingName", "SerialNumber")
+
+# Errors printed, the report has all of them
+MAX_PRINTED_ERRORS = 20
+
+# Rows listed in the error of a thing type or group that does not exist
+MAX_LISTED_ROWS = 5
+
+# Rules of the template, set in every worker process by set_rules
+RULES = None
+
+
+#Define function to return the parameter names referenced ({"Ref": name}) in a part of a template
+def template_refs(value):
+    if isinstance(value, dict):
+        if set(value) == {"Ref"}:
+            return [value["Ref"]]
+        return [name for item in value.values() for name in template_refs(item)]
+    if isinstance(value, list):
+        return [name for item in value for name in template_refs(item)]
+    return []
+
+
+#Define function to read the rules the rows are checked against from a provisioning template
+#parameters: {name: (type, default)}, the parameters without a default are required
+#csr, thing_type, thing_group: the parameters used as CSR, thing type and thing groups by the template resources
+def load_rules(template_path=TEMPLATE_FILE):
+    with open(template_path, "r") as template_file:
+        template = json.load(template_file)
+    parameters = template.get("Parameters", {})
+    rules = {
+        "parameters": {name: (spec.get("Type", "String"), spec.get("Default")) for name, spec in parameters.items()},
+        "unique": [name for name in UNIQUE_PARAMETERS if name in parameters],
+        "csr": [],
+        "thing_type": [],
+        "thing_group": [],
+    }
+    for resource in template.get("Resources", {}).values():
+        properties = resource.get("Properties", {})
+        if resource.get("Type") == "AWS::IoT::Thing":
+            rules["thing_type"] += template_refs(properties.get("ThingTypeName"))
+            rules["thing_group"] += template_refs(properties.get("ThingGroups"))
+        elif resource.get("Type") == "AWS::IoT::Certificate":
+            rules["csr"] += template_refs(properties.get("CertificateSigningRequest"))
+    for kind in ("csr", "thing_type", "thing_group"):
+        rules[kind] = [name for name in dict.fromkeys(rules[kind]) if name in parameters]
+    return rules
+
+
+#Define function to set the rules in a worker process
+def set_rules(rules):
+    global RULES
+    RULES = rules
+
+
+#Define function to return the 64 bit hash of a value, used to find the duplicates
+def value_hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+#Define function to check the value of a parameter against its type
+def type_error(parameter_type, value):
+    if parameter_type == "String" and not isinstance(value, str):
+        return f"Expected a String, got {type(value).__name__}"
+    if parameter_type == "Number":
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            return f"Expected a Number, got {type(value).__name__}"
+        try:
+            float(value)
+        except ValueError:
+            return f"Expected a Number, got {value!r}"
+    return None
+
+
+#Define function to check one row, returns the errors [(row, parameter, message)] and the row (None if not parsed)
+def check_row(row_number, line, rules):
+    if not line.strip():
+        return [(row_number, None, "Empty line")], None
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        return [(row_number, None, f"Not valid JSON: {e}")], None
+    if not isinstance(row, dict):
+        return [(row_number, None, f"Expected a JSON object, got {type(row).__name__}")], None
+    return check_values(row_number, row, rules), row
+
+
+#Define function to check the parameters and the CSR of a parsed row, returns the errors [(row, parameter, message)]
+def check_values(row_number, row, rules):
+    errors = []
+    for name, (parameter_type, default) in rules["parameters"].items():
+        value = row.get(name)
+        if value is None:
+            if default is None:
+                errors.append((row_number, name, "Missing required parameter"))
+            continue
+        message = type_error(parameter_type, value)
+        if message is None and default is None and value == "":
+            message = "Empty required parameter"
+        if message is not None:
+            errors.append((row_number, name, message))
+    for name in rules["csr"]:
+        value = row.get(name)
+        if not isinstance(value, str) or not value:
+            continue
+        try:
+            csr = x509.load_pem_x509_csr(value.encode("utf-8"))
+            if not csr.is_signature_valid:
+                errors.append((row_number, name, "The signature of the CSR is not valid"))
+        except ValueError as e:
+            errors.append((row_number, name, f"The CSR cannot be parsed: {e}"))
+    return errors
+
+
+#Define function to check a batch of rows in a worker process, returns:
+# * the errors of the rows: [(row, parameter, message)]
+# * the row numbers and hashes of the unique parameters: {name: (rows, hashes)}, as bytes of 64 bit integers
+# * the thing types and groups referenced: {name: {value: (number of rows, first rows)}}
+def check_batch(first_row, lines):
+    errors = []
+    unique = {name: (array("Q"), array("Q")) for name in RULES["unique"]}
+    references = {name: {} for name in RULES["thing_type"] + RULES["thing_group"]}
+    for row_number, line in enumerate(lines, first_row):
+        row_errors, row = check_row(row_number, line, RULES)
+        errors += row_errors
+        if row is None:
+            continue
+        for name, (rows, hashes) in unique.items():
+            value = row.get(name)
+            if isinstance(value, str) and value:
+                rows.append(row_number)
+                hashes.append(value_hash(value))
+        for name, values in references.items():
+            value = row.get(name, RULES["parameters"][name][1])
+            if isinstance(value, str) and value:
+                seen = values.setdefault(value, [0, []])
+                seen[0] += 1
+                if len(seen[1]) < MAX_LISTED_ROWS:
+                    seen[1].append(row_number)
+    return errors, {name: (rows.tobytes(), hashes.tobytes()) for name, (rows, hashes) in unique.items()}, references
+
+
+#Define function to read a parameters file in batches of lines: (number of the first row, lines)
+def read_batches(path):
+    with open(path, "rb") as parameters_file:
+        lines = []
+        first_row = 1
+        for line in parameters_file:
+            lines.append(line)
+            if len(lines) >= BATCH_SIZE:
+                yield first_row, lines
+                first_row += len(lines)
+                lines = []
+        if lines:
+            yield first_row, lines
+
+
+#Describe class that writes the errors to the report and prints the first ones
+class PreflightReport:
+    def __init__(self, path=REPORT_FILE):
+        self.path = path
+        self.rows = 0
+        self.errors = 0
+        self._file = open(path, "w")
+
+    #Define function to record an error of a row
+    def add(self, row_number, parameter, message):
+        self._file.write(json.dumps({"row": row_number, "parameter": parameter, "error": message}) + "\n")
+        self.errors += 1
+        if self.errors <= MAX_PRINTED_ERRORS:
+            print(f"ERROR - Row {row_number}: {parameter + ': ' if parameter else ''}{message}")
+        elif self.errors == MAX_PRINTED_ERRORS + 1:
+            print(f"ERROR - More errors in {self.path}")
+
+    def close(self):
+        self._file.close()
+
+
+#Define function to report the rows whose value of a parameter is already in an earlier row
+def report_duplicates(report, name, rows, hashes):
+    rows = np.frombuffer(rows, dtype=np.uint64)
+    hashes = np.frombuffer(hashes, dtype=np.uint64)
+    # A stable sort keeps the rows of a value in file order, the first one is the original
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    sorted_rows = rows[order]
+    first = np.ones(len(sorted_hashes), dtype=bool)
+    first[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+    first_index = np.maximum.accumulate(np.where(first, np.arange(len(first)), 0))
+    for index in np.flatnonzero(~first):
+        report.add(int(sorted_rows[index]), name, f"Duplicate {name}, already in row {int(sorted_rows[first_index[index]])}")
+
+
+#Define function to check that a thing type (not deprecated) or a thing group exists in AWS IoT Core, returns the error or None
+def resource_error(iot_client, is_thing_type, value):
+    kind = "Thing type" if is_thing_type else "Thing group"
+    try:
+        if is_thing_type:
+            response = iot_client.describe_thing_type(thingTypeName=value)
+            if response.get("thingTypeMetadata", {}).get("deprecated"):
+                return f"{kind} {value} is deprecated"
+        else:
+            iot_client.describe_thing_group(thingGroupName=value)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceNotFoundException":
+            return f"{kind} {value} does not exist"
+        return f"Could not check {kind.lower()} {value}: {e}"
+    except BotoCoreError as e:
+        return f"Could not check {kind.lower()} {value}: {e}"
+    return None
+
+
+#Define function to report the thing types and groups referenced by the rows that do not exist in AWS IoT Core
+def report_missing_resources(report, iot_client, rules, references):
+    for name, values in references.items():
+        is_thing_type = name in rules["thing_type"]
+        for value, (count, rows) in sorted(values.items()):
+            message = resource_error(iot_client, is_thing_type, value)
+            if message is not None:
+                more = ", ..." if count > len(rows) else ""
+                report.add(rows[0], name, f"{message}, used by {count} rows: {', '.join(str(row) for row in rows)}{more}")
+
+
+#Define function to check a parameters file, returns the PreflightReport (closed)
+#Without an IoT client the thing types and groups are not checked
+def validate_parameters(path, template_path=TEMPLATE_FILE, workers=1, iot_client=None, report_path=REPORT_FILE):
+    rules = load_rules(template_path)
+    report = PreflightReport(report_path)
+    unique = {name: (bytearray(), bytearray()) for name in rules["unique"]}
+    references = {name: {} for name in rules["thing_type"] + rules["thing_group"]}
+
+    def merge(result):
+        errors, batch_unique, batch_references = result
+        for error in errors:
+            report.add(*error)
+        for name, (rows, hashes) in batch_unique.items():
+            unique[name][0].extend(rows)
+            unique[name][1].extend(hashes)
+        for name, values in batch_references.items():
+            for value, (count, rows) in values.items():
+                seen = references[name].setdefault(value, [0, []])
+                seen[0] += count
+                seen[1] += rows[:MAX_LISTED_ROWS - len(seen[1])]
+
+    try:
+        # Batches are merged in file order, a few ahead on the workers, so the file is never held in memory
+        if workers <= 1:
+            set_rules(rules)
+            for first_row, lines in read_batches(path):
+                merge(check_batch(first_row, lines))
+                report.rows += len(lines)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=set_rules, initargs=(rules,)) as executor:
+                pending = collections.deque()
+                for first_row, lines in read_batches(path):
+                    pending.append((len(lines), executor.submit(check_batch, first_row, lines)))
+                    if len(pending) >= 2 * workers:
+                        count, future = pending.popleft()
+                        merge(future.result())
+                        report.rows += count
+                while pending:
+                    count, future = pending.popleft()
+                    merge(future.result())
+                    report.rows += count
+
+        for name, (rows, hashes) in unique.items():
+            report_duplicates(report, name, bytes(rows), bytes(hashes))
+        if iot_client is not None:
+            report_missing_resources(report, iot_client, rules, references)
+        else:
+            logging.info("Thing types and groups not checked")
+    finally:
+        report.close()
+    logging.info(f"Checked {report.rows} rows of {path}, {report.errors} errors, see {report.path}")
+    return report
+
+
+#Describe exception raised by RowValidator on a row that has errors
+class PreflightError(Exception):
+    def __init__(self, row_number, errors, report_path):
+        super().__init__(f"Row {row_number} has {errors} errors, see {report_path}")
+        self.row_number = row_number
+
+
+#Describe class that checks rows one by one as they are written, for the parameters streamed to S3
+#The checks are the ones of validate_parameters, a duplicate is found when it is written (the hashes of the unique
+#values are kept) and every thing type and group is looked up once. check raises PreflightError on a bad row.
+class RowValidator:
+    def __init__(self, template_path=TEMPLATE_FILE, iot_client=None, report_path=REPORT_FILE):
+        self.rules = load_rules(template_path)
+        self.iot_client = iot_client
+        self.report = PreflightReport(report_path)
+        self._hashes = {name: set() for name in self.rules["unique"]}
+        # (parameter, value) -> error or None
+        self._resources = {}
+
+    #Define function to check the next row (a dict of parameters)
+    def check(self, row):
+        self.report.rows += 1
+        row_number = self.report.rows
+        errors = check_values(row_number, row, self.rules)
+        for name, hashes in self._hashes.items():
+            value = row.get(name)
+            if isinstance(value, str) and value:
+                value_key = value_hash(value)
+                if value_key in hashes:
+                    errors.append((row_number, name, f"Duplicate {name}, already in an earlier row"))
+                hashes.add(value_key)
+        if self.iot_client is not None:
+            for name in self.rules["thing_type"] + self.rules["thing_group"]:
+                value = row.get(name, self.rules["parameters"][name][1])
+                if isinstance(value, str) and value:
+                    if (name, value) not in self._resources:
+                        self._resources[(name, value)] = resource_error(self.iot_client, name in self.rules["thing_type"], value)
+                    if self._resources[(name, value)] is not None:
+                        errors.append((row_number, name, self._resources[(name, value)]))
+        for error in errors:
+            self.report.add(*error)
+        if errors:
+            raise PreflightError(row_number, len(errors), self.report.path)
+
+    def close(self):
+        self.report.close()
+
+
+#Main, check a parameters file from the command line
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("parameters", action="store", help="Parameters file to check, one JSON object per line")
+    parser.add_argument("-t", "--template", action="store", default=TEMPLATE_FILE, dest="template", help=f"Provisioning template (default: {TEMPLATE_FILE})")
+    parser.add_argument("-w", "--workers", action="store", type=int, default=os.cpu_count() or 1, dest="workers", help="Number of processes checking the rows (default: number of cores)")
+    parser.add_argument("-r", "--report", action="store", default=REPORT_FILE, dest="report", help=f"Report of the errors (default: {REPORT_FILE})")
+    parser.add_argument("--skip-iot", action="store_true", dest="skip_iot", help="Do not check that the thing types and groups exist in AWS IoT Core")
+    parser.add_argument("--iot-endpoint-url", action="store", default=None, dest="iot_endpoint_url", help="IoT endpoint, e.g. a local stand-in for offline runs (default: AWS)")
+    args = parser.parse_args()
+
+    report = validate_parameters(args.parameters, args.template, args.workers, None if args.skip_iot else create_iot_client(args.iot_endpoint_url), args.report)
+    print(f"INFO - Checked {report.rows} rows, {report.errors} errors, see {report.path}")
+    sys.exit(1 if report.errors else 0)
@@ -0,0 +1,312 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module runs the bulk registration of a fleet split into chunks (see s3_upload.ChunkedUpload). Every chunk
+#gets its own registration task, the tasks are started as the chunks are uploaded and at most max_tasks run at
+#the same time. The state of every chunk (uploaded, task started, completed or failed, with the task counts) is
+#kept in registration_chunks.json, so a failed chunk is registered again on its own instead of the whole fleet.
+#Every running task is followed by a TaskMonitor: it prints the things registered per second and the ETA, saves
+#the result and error reports of the task as they appear, and when the task finishes writes the rows that failed
+#to a new parameters file that can be registered again.
+#The IoT endpoint can be overridden (endpoint_url) to run against a local stand-in.
+
+#Dependencies
+import os
+import json
+import queue
+import random
+import threading
+import time
+import logging
+import urllib.parse
+import urllib.request
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+# File keeping the state of every chunk
+CHUNKS_FILE = "registration_chunks.json"
+
+# Seconds between two status checks of the running tasks
+TASK_POLL_INTERVAL = 10
+
+# Attempts to start a task (the API is throttled), with exponential backoff and full jitter between them
+START_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+
+# Task statuses after which a task does not change anymore
+FINAL_STATUSES = ("Completed", "Failed", "Cancelled")
+
+# Statuses of the uploaded files that did not complete, registered again by --retry-chunks
+RETRY_STATUSES = ("Uploaded", "StartFailed", "InProgress", "Failed", "Cancelled")
+
+# Directories of the task reports and of the parameters files with the rows that failed
+REPORTS_DIR = "registration_reports"
+FAILED_ROWS_DIR = "failed_rows"
+
+# Seconds to wait for the download of a report
+REPORT_TIMEOUT = 60
+
+
+#Define function to create the IoT client, endpoint_url points it at a local stand-in for offline runs
+def create_iot_client(endpoint_url=None, region_name=None):
+    return boto3.client("iot", endpoint_url=endpoint_url, region_name=region_name)
+
+
+#Define function to format a number of seconds as 1h02m03s
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+#Describe class that follows a registration task: progress, rate and ETA, reports, and the rows that failed
+#The reports are JSON Lines files, the line of every row has the offset (line number, from 0) of the row in the
+#input file. They are appended to <REPORTS_DIR>/<task id>-results.jsonl and <task id>-errors.jsonl.
+class TaskMonitor:
+    def __init__(self, iot_client, s3_client, bucket, key, task_id, rows=None, reports_dir=REPORTS_DIR):
+        self.iot_client = iot_client
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.task_id = task_id
+        self.rows = rows
+        self.started = time.monotonic()
+        self.failed_offsets = set()
+        # Reports already saved, by the path of their link (the query string of a presigned link changes)
+        self._saved_reports = set()
+        os.makedirs(reports_dir, exist_ok=True)
+        self.report_paths = {"RESULTS": os.path.join(reports_dir, f"{task_id}-results.jsonl"), "ERRORS": os.path.join(reports_dir, f"{task_id}-errors.jsonl")}
+
+    #Define function to return the task description and save its new reports, raises the errors of the API
+    def poll(self):
+        task = self.iot_client.describe_thing_registration_task(taskId=self.task_id)
+        for report_type in ("RESULTS", "ERRORS"):
+            self._save_reports(report_type)
+        return task
+
+    #Define function to download the reports of a type that were not saved yet
+    def _save_reports(self, report_type):
+        next_token = None
+        while True:
+            request = {"taskId": self.task_id, "reportType": report_type}
+            if next_token:
+                request["nextToken"] = next_token
+            response = self.iot_client.list_thing_registration_task_reports(**request)
+            for link in response.get("resourceLinks", []):
+                report_name = urllib.parse.urlsplit(link).path
+                if report_name in self._saved_reports:
+                    continue
+                try:
+                    with urllib.request.urlopen(link, timeout=REPORT_TIMEOUT) as report:
+                        content = report.read()
+                except OSError as e:
+                    # Saved on the next poll
+                    logging.warning(f"Could not download report {report_name} of registration task {self.task_id}: {e}")
+                    continue
+                self._add_report(report_type, content)
+                self._saved_reports.add(report_name)
+            next_token = response.get("nextToken")
+            if not next_token:
+                break
+
+    #Define function to append a report to the reports of its type and remember the offsets of the failed rows
+    def _add_report(self, report_type, content):
+        lines = [line for line in content.splitlines() if line.strip()]
+        with open(self.report_paths[report_type], "ab") as report_file:
+            report_file.write(b"".join(line + b"\n" for line in lines))
+        if report_type == "ERRORS":
+            for line in lines:
+                try:
+                    self.failed_offsets.add(int(json.loads(line)["offset"]))
+                except (ValueError, KeyError, TypeError):
+                    logging.warning(f"Error report line of registration task {self.task_id} without an offset: {line[:200]!r}")
+        logging.info(f"Saved {report_type.lower()} report of registration task {self.task_id} with {len(lines)} rows")
+
+    #Define function to return the progress of the task as one line, with the things per second and the ETA
+    def summary(self, task):
+        succeeded = task.get("successCount", 0)
+        failed = task.get("failureCount", 0)
+        processed = succeeded + failed
+        elapsed = time.monotonic() - self.started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        if self.rows:
+            percent = 100 * processed / self.rows
+            eta = (self.rows - processed) / rate if rate > 0 else None
+        else:
+            percent = task.get("percentageProgress", 0)
+            eta = elapsed * (100 - percent) / percent if percent else None
+        eta_text = format_duration(eta) if eta is not None and task.get("status") not in FINAL_STATUSES else "-"
+        return f"Registration task {self.task_id} ({self.key}) {task.get('status')} {percent:.1f}%, {succeeded} succeeded, {failed} failed, {rate:.1f} things/s, ETA {eta_text}"
+
+    #Define function to write the input rows that failed to a new parameters file, returns the number of rows
+    #The rows are read back from the input object, in their original order
+    def write_failed_rows(self, path):
+        if not self.failed_offsets:
+            return 0
+        written = 0
+        body = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)["Body"]
+        with open(path, "wb") as failed_file:
+            for offset, row in enumerate(body.iter_lines()):
+                if offset in self.failed_offsets:
+                    failed_file.write(row + b"\n")
+                    written += 1
+        logging.info(f"Wrote {written} failed rows of registration task {self.task_id} to {path}")
+        return written
+
+
+#Describe class that keeps the state of every chunk in a JSON file, rewritten on every change
+#A chunk is {"key", "rows", "bytes", "status", "task_id", "success_count", "failure_count", "message"}, status is
+#UploadFailed, Uploaded, StartFailed or a task status (InProgress, Completed, Failed, Cancelled, ...)
+class ChunkTracker:
+    def __init__(self, path=CHUNKS_FILE, reset=False):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._chunks = {}
+        if not reset and os.path.exists(self.path):
+            with open(self.path, "r") as chunks_file:
+                self._chunks = {chunk["key"]: chunk for chunk in json.load(chunks_file)["chunks"]}
+        self._save()
+
+    #Define function to update the fields of a chunk, the chunk is added when it is new
+    def update(self, key, **fields):
+        with self._lock:
+            self._chunks.setdefault(key, {"key": key}).update(fields)
+            self._save()
+
+    def get(self, key):
+        with self._lock:
+            return dict(self._chunks[key])
+
+    #Define function to return the chunks, in key order, optionally only those with one of the statuses
+    def chunks(self, statuses=None):
+        with self._lock:
+            return [dict(chunk) for key, chunk in sorted(self._chunks.items()) if statuses is None or chunk.get("status") in statuses]
+
+    #Define function to write the file, a crash in the middle leaves the previous version
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as tmp_file:
+            json.dump({"chunks": [chunk for _, chunk in sorted(self._chunks.items())]}, tmp_file, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+#Describe class that starts a registration task for every chunk submitted and follows it until it finishes
+class RegistrationScheduler:
+    def __init__(self, iot_client, s3_client, template_body, bucket, role_arn, tracker, max_tasks=1, poll_interval=TASK_POLL_INTERVAL):
+        self.iot_client = iot_client
+        self.s3_client = s3_client
+        self.template_body = template_body
+        self.bucket = bucket
+        self.role_arn = role_arn
+        self.tracker = tracker
+        self.max_tasks = max(1, max_tasks)
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue()
+        # Chunks waiting for a task, and running tasks: key -> TaskMonitor
+        self._waiting = []
+        self._running = {}
+        self._thread = threading.Thread(target=self._run, name="registration-scheduler", daemon=True)
+        self._thread.start()
+
+    #Define function to schedule the registration of an uploaded chunk
+    def submit(self, key):
+        self._queue.put(key)
+
+    #Define function that waits until the tasks of every submitted chunk finished
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    #Define function that runs on the scheduler thread, starts tasks within the limit and polls the running ones
+    def _run(self):
+        closing = False
+        while not closing or self._waiting or self._running:
+            # Take the chunks submitted meanwhile, waiting up to a poll interval when no task can be started now
+            if self._waiting and len(self._running) < self.max_tasks:
+                timeout = 0
+            else:
+                timeout = self.poll_interval if self._running or closing else None
+            try:
+                while True:
+                    key = self._queue.get(timeout=timeout)
+                    timeout = 0
+                    if key is None:
+                        closing = True
+                    else:
+                        self._waiting.append(key)
+            except queue.Empty:
+                pass
+
+            while self._waiting and len(self._running) < self.max_tasks:
+                key = self._waiting.pop(0)
+                task_id = self._start(key)
+                if task_id is not None:
+                    self._running[key] = TaskMonitor(self.iot_client, self.s3_client, self.bucket, key, task_id, self.tracker.get(key).get("rows"))
+            for key, monitor in list(self._running.items()):
+                if self._poll(key, monitor) in FINAL_STATUSES:
+                    del self._running[key]
+
+    #Define function to start the registration task of a chunk, returns the task id or None
+    def _start(self, key):
+        for attempt in range(START_ATTEMPTS):
+            try:
+                response = self.iot_client.start_thing_registration_task(templateBody=self.template_body, inputFileBucket=self.bucket, inputFileKey=key, roleArn=self.role_arn)
+                task_id = response["taskId"]
+                self.tracker.update(key, status="InProgress", task_id=task_id, success_count=0, failure_count=0, message=None)
+                print(f"INFO - Started registration task {task_id} for s3://{self.bucket}/{key}")
+                logging.info(f"Started registration task {task_id} for s3://{self.bucket}/{key}")
+                return task_id
+            except (BotoCoreError, ClientError) as e:
+                if attempt == START_ATTEMPTS - 1:
+                    self.tracker.update(key, status="StartFailed", message=str(e))
+                    print(f"ERROR - Could not start the registration task for s3://{self.bucket}/{key}: {e}")
+                    logging.error(f"Could not start the registration task for s3://{self.bucket}/{key}: {e}")
+                    return None
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                logging.warning(f"Starting the registration task for s3://{self.bucket}/{key} failed ({e}), retrying in {delay:.1f} seconds")
+                time.sleep(delay)
+
+    #Define function to update the state of a chunk from its task, returns the task status (None when unknown)
+    #When the task finished, the rows that failed are written to <FAILED_ROWS_DIR>/failed_<file name of the chunk>
+    def _poll(self, key, monitor):
+        try:
+            task = monitor.poll()
+        except (BotoCoreError, ClientError) as e:
+            logging.warning(f"Could not follow registration task {monitor.task_id}: {e}")
+            return None
+        status = task.get("status")
+        summary = monitor.summary(task)
+        print(f"INFO - {summary}")
+        logging.info(summary)
+        fields = {"status": status, "success_count": task.get("successCount", 0), "failure_count": task.get("failureCount", 0), "message": task.get("message")}
+        if status in FINAL_STATUSES and monitor.failed_offsets:
+            os.makedirs(FAILED_ROWS_DIR, exist_ok=True)
+            failed_rows_path = os.path.join(FAILED_ROWS_DIR, f"failed_{os.path.basename(key)}")
+            try:
+                fields["failed_rows"] = monitor.write_failed_rows(failed_rows_path)
+                fields["failed_rows_file"] = failed_rows_path
+                print(f"INFO - {fields['failed_rows']} failed rows of {key} written to {failed_rows_path}")
+            except (BotoCoreError, ClientError, OSError) as e:
+                logging.error(f"Could not write the failed rows of registration task {monitor.task_id}: {e}")
+        self.tracker.update(key, **fields)
+        return status
@@ -0,0 +1,219 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module uploads a file to S3 while it is being written, with a multipart upload. What is written is buffered
+#into parts (8 MiB by default, S3 needs at least 5 MiB except for the last part), every full part is uploaded on
+#a pool of threads while the writer carries on, and a failed part is retried on its own with backoff. At most two
+#parts per thread are kept in memory, so the writer waits when S3 is slower than the generation. The upload is
+#completed when the writer is closed, and aborted if anything failed, so no partial object is left in the bucket.
+#ChunkedUpload splits what is written into several objects bounded in rows and bytes (split on row boundaries),
+#each streamed with its own multipart upload, the last parts of a chunk are uploaded while the next chunk is written.
+#The S3 endpoint can be overridden (endpoint_url) to run against a local stand-in such as moto_server.
+
+#Dependencies
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+# Part sizes accepted by S3, and the maximum number of parts of an upload
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+
+# Attempts of a part upload, with exponential backoff and full jitter between them
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20
+
+
+#Define function to create the S3 client, endpoint_url points it at a local stand-in for offline runs
+def create_s3_client(endpoint_url=None, region_name=None):
+    return boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+
+
+#Describe class that streams what is written to it into an S3 object with a multipart upload
+class MultipartUpload:
+    def __init__(self, s3_client, bucket, key, part_size=DEFAULT_PART_SIZE, concurrency=4):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="s3-part-upload")
+        # Parts waiting or being uploaded, the writer blocks when all slots are taken
+        self._slots = threading.BoundedSemaphore(2 * max(1, concurrency))
+        self._upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        logging.info(f"Started multipart upload to s3://{bucket}/{key}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    #Define function to write data (str or bytes), every full part is handed to the upload threads
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    #Define function to queue a part for upload, raises the error of a part that failed all its attempts
+    def _submit(self, body):
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        part_number = len(self._futures) + 1
+        if part_number > MAX_PARTS:
+            raise ValueError(f"s3://{self.bucket}/{self.key} needs more than {MAX_PARTS} parts, use a larger part size")
+        self._slots.acquire()
+        future = self._executor.submit(self._upload_part, part_number, body)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    #Define function that runs on the upload threads, uploads a part and retries it when it fails
+    def _upload_part(self, part_number, body):
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=part_number, Body=body)
+                return {"PartNumber": part_number, "ETag": response["ETag"]}
+            except (BotoCoreError, ClientError) as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    logging.error(f"Upload of part {part_number} of s3://{self.bucket}/{self.key} failed after {MAX_ATTEMPTS} attempts: {e}")
+                    raise
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                logging.warning(f"Upload of part {part_number} of s3://{self.bucket}/{self.key} failed ({e}), retrying in {delay:.1f} seconds")
+                time.sleep(delay)
+
+    #Define function to upload the last part and complete the upload, the upload is aborted when a part failed
+    def close(self):
+        try:
+            # An upload needs at least one part, an empty object is uploaded as one empty part
+            if self._buffer or not self._futures:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            parts = [future.result() for future in self._futures]
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={"Parts": parts})
+        except BaseException:
+            self.abort()
+            raise
+        self._executor.shutdown()
+        logging.info(f"Uploaded {self.bytes_written} bytes to s3://{self.bucket}/{self.key} in {len(self._futures)} parts")
+
+    #Define function to abort the upload, S3 drops the parts already uploaded
+    def abort(self):
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            logging.warning(f"Aborted multipart upload to s3://{self.bucket}/{self.key}")
+        except (BotoCoreError, ClientError) as e:
+            logging.error(f"Error aborting multipart upload to s3://{self.bucket}/{self.key}: {e}")
+
+
+#Describe class that streams rows into a sequence of S3 objects of at most max_rows rows and max_bytes bytes
+#The keys are <prefix>00001.json, <prefix>00002.json, ... on_chunk(key, rows, size, error) is called from an
+#upload thread when a chunk is uploaded (error is None) or failed, a failed chunk does not stop the other ones.
+class ChunkedUpload:
+    def __init__(self, s3_client, bucket, prefix, max_rows, max_bytes, on_chunk=None, part_size=DEFAULT_PART_SIZE, concurrency=4):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_rows = max(1, max_rows)
+        self.max_bytes = max(1, max_bytes)
+        self.on_chunk = on_chunk
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.chunk_count = 0
+        self._upload = None
+        self._rows = 0
+        # Chunks being completed, their last parts are uploaded while the next chunk is written
+        self._completing = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="s3-chunk-upload")
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    #Define function to write one row (a line ending with a newline), a row is never split across two chunks
+    def write(self, row):
+        if isinstance(row, str):
+            row = row.encode("utf-8")
+        if self._upload is not None and (self._rows >= self.max_rows or self._upload.bytes_written + len(row) > self.max_bytes):
+            self._finish_chunk()
+        if self._upload is None:
+            self.chunk_count += 1
+            self._upload = MultipartUpload(self.s3_client, self.bucket, f"{self.prefix}{self.chunk_count:05d}.json", self.part_size, self.concurrency)
+            self._rows = 0
+        self._upload.write(row)
+        self._rows += 1
+        return len(row)
+
+    #Define function to complete the current chunk on the upload threads
+    def _finish_chunk(self):
+        self._futures.append(self._completing.submit(self._complete, self._upload, self._rows))
+        self._upload = None
+
+    #Define function that runs on the upload threads, completes a chunk and reports it to on_chunk
+    def _complete(self, upload, rows):
+        error = None
+        try:
+            upload.close()
+        except Exception as e:
+            error = e
+            logging.error(f"Upload of chunk s3://{upload.bucket}/{upload.key} failed: {e}")
+        if self.on_chunk is not None:
+            self.on_chunk(upload.key, rows, upload.bytes_written, error)
+
+    #Define function to complete the last chunk and wait for every chunk to be uploaded
+    def close(self):
+        if self._upload is not None:
+            self._finish_chunk()
+        for future in self._futures:
+            future.result()
+        self._completing.shutdown()
+
+    #Define function to abort the chunk being written, the chunks already written are still completed
+    def abort(self):
+        if self._upload is not None:
+            self._upload.abort()
+            self._upload = None
+        self.close()
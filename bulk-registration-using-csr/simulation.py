@@ -27,28 +27,19 @@ from OpenSSL import crypto
 import json
 import logging
 import argparse
-import subprocess
 import os
-
-#Pass argument into variables usin arparse Lib
-try:
-    # Pass arguments into variables using argparse
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-n", "--fleetsize", action="store", required=True, dest="fleetsize", help="Numbers of devices on the simulated fleet")
-    
-    args = parser.parse_args() 
-    number_of_devices = int(args.fleetsize)
-    
-    print("Number of Devices:", number_of_devices)
-    
-except argparse.MissingArgumentError as e:
-    print("Error:", e)
-    print("Please provide the required arguments.")
-except ValueError as e:
-    print("Error:", e)
-    print("Invalid value provided for fleetsize. Please provide a valid integer.")
-except Exception as e:
-    print("An error occurred:", e)
+import sys
+import time
+import collections
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from key_pool import KEY_ALGORITHMS, KeyPool, load_private_key
+from keystore import KeyStore
+from fleet_manifest import count_manifest_rows, read_manifest
+from preflight import PreflightError, RowValidator, validate_parameters
+from s3_upload import DEFAULT_PART_SIZE, ChunkedUpload, MultipartUpload, create_s3_client
+from registration_tasks import CHUNKS_FILE, RETRY_STATUSES, ChunkTracker, RegistrationScheduler, create_iot_client
+from botocore.exceptions import BotoCoreError, ClientError
 
 # Set up logging
 logging.basicConfig(filename='simulation.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -62,12 +53,37 @@ ThingGroups_list = ["CustomerA","CustomerB","CustomerC",""] #Intentionally left
 countryOrigin_list = ["US","UK","IN","CH"]
 licenseType_list = ["premium","basic"]
 
-#Define function to create simulation keys and CSRs 
-def generate_key_and_csr(serialNumber):
+# Devices generated per task sent to a worker process
+CHUNK_SIZE = 32
+
+# Seconds between two progress lines (on a terminal the line is updated in place more often)
+PROGRESS_INTERVAL = 10
+
+# Buffer size of each output file, and number of devices written between two flushes (with fsync) of the files
+WRITE_BUFFER_SIZE = 1024 * 1024
+SYNC_EVERY = 10000
+
+# File recording how far the generation got, written after every sync of the output files (see --resume)
+CHECKPOINT_FILE = "simulation_checkpoint.json"
+
+# The output files are also synced and checkpointed after at most this many seconds
+CHECKPOINT_INTERVAL = 30
+
+# Random generator of the device attributes and serial numbers, its state is saved in the checkpoints so a resumed
+# run generates the same devices the interrupted run would have
+rng = random.Random()
+
+#Define function to create simulation keys and CSRs, returns the private key and the CSR in PEM
+#It runs in the worker processes, the files are written by the main process in order
+#private_key_der is a key taken from the key pool, a key is generated when it is None
+def generate_key_and_csr(serialNumber, key_algorithm="rsa-2048", private_key_der=None):
     try:
         # Create a key pair
-        key = crypto.PKey()
-        key.generate_key(crypto.TYPE_RSA, 2048)
+        generate_key, digest = KEY_ALGORITHMS[key_algorithm]
+        if private_key_der is not None:
+            key = load_private_key(private_key_der)
+        else:
+            key = crypto.PKey.from_cryptography_key(generate_key())
 
         # Generate a CSR
         req = crypto.X509Req()
@@ -79,88 +95,273 @@ def generate_key_and_csr(serialNumber):
         req.set_pubkey(key)
 
         # Sign the CSR with the private key
-        req.sign(key, 'sha256')
+        req.sign(key, digest)
 
         # Get the private key and CSR in PEM format
         private_key_pem = crypto.dump_privatekey(crypto.FILETYPE_PEM, key).decode('utf-8')
         csr_pem = crypto.dump_certificate_request(crypto.FILETYPE_PEM, req).decode('utf-8')
-
-        # Append private key to file with serial number identification
-        with open('keyStore.json', 'a') as key_file:
-            key_data = {'device_serialNumber': serialNumber, 'private_key': private_key_pem}
-            json.dump(key_data, key_file, indent=2)
-            key_file.write('\n')  # Add a newline for separation
-
-        # Append CSR to file with serial number identification
-        with open('CSRStore.json', 'a') as csr_file:
-            csr_data = {'device_serialNumber': serialNumber, 'csr': csr_pem}
-            json.dump(csr_data, csr_file, indent=2)
-            csr_file.write('\n')  # Add a newline for separation
-
-        # Log success
-        print("INFO - Successfully generated key and CSR for serial number: {}".format(serialNumber))
-        logging.info("Successfully generated key and CSR for serial number: {}".format(serialNumber))
-        # Return the CSR as a string
-        return csr_pem
+        return private_key_pem, csr_pem
     except Exception as e:
         # Log error with more details
-        print(f"ERROR - Error generating key and CSR for serial number {serialNumber}: {str(e)}")
         logging.error(f"Error generating key and CSR for serial number {serialNumber}: {str(e)}", exc_info=True)
-        return None
+        return None, None
+
+#Define function to create the keys and CSRs of a chunk of devices in a worker process
+def generate_keys_and_csrs(serial_numbers, key_algorithm, private_keys):
+    return [generate_key_and_csr(serial_number, key_algorithm, private_key_der) for serial_number, private_key_der in zip(serial_numbers, private_keys)]
 
 # Define function to generate random values and build the parameters.json file.
 def pick_random_string(lst):
     try:
-        return random.choice(lst)
+        return rng.choice(lst)
     except Exception as e:
         logging.error(f"Error picking random string: {e}")
         return None
 
-#Define function which builds the parameters.json file content
-def build_parameters_and_save(ThingTypeName_list, ThingGroups_name, countryOrigin, licenseType):
-    try:
-        # Define random values for the parameters.
-        ThingTypeName = pick_random_string(ThingTypeName_list)
-        ThingGroups = pick_random_string(ThingGroups_name)
-        country_origin = pick_random_string(countryOrigin)  # Renamed variable to avoid conflict
-        license_type = pick_random_string(licenseType)  # Renamed variable to avoid conflict
-
-        # Generate THING Serial number
-        serial_number = str(uuid.uuid4()).replace("-", "") 
-        print(f"Serial Number: {serial_number}")
-
-        # Build Thing Name
-        thing_name = f"{ThingTypeName}_{serial_number}"
-        print(f"Thing Name: {thing_name}")
-
-        # Create Key and CSR
-        csr = generate_key_and_csr(serial_number)
-
-        # Build Object
-        parameters = {
-            "ThingName": thing_name,
-            "businessUnitMaker": "AnyCompany",
-            "SerialNumber": serial_number,
-            "ThingTypeName": ThingTypeName,
-            "ThingGroup": ThingGroups,
-            "countryOrigin": country_origin,
-            "licenseType": license_type,
-            "hardwareVersion": "100",
-            "softwareVersion": "100",
-            "CSR": csr
-        }
-
-        # Save parameters to file with a newline
-        with open('parameters.json', 'a') as parameters_file:
-            parameters_file.write(json.dumps(parameters, indent=None))
-            parameters_file.write('\n')
-        print(f"INFO - Parameters saved to file: {parameters}")
-        logging.info(f"Parameters saved to file: {parameters}")
-        return parameters
-    except Exception as e:
-        print(f"ERROR - Error building parameters and saving to file: {e}")
-        logging.error(f"Error building parameters and saving to file: {e}")
+#Define function which builds the parameters.json content of a new device, the CSR is added once it is generated
+def build_parameters(ThingTypeName_list, ThingGroups_name, countryOrigin, licenseType):
+    # Define random values for the parameters.
+    ThingTypeName = pick_random_string(ThingTypeName_list)
+    ThingGroups = pick_random_string(ThingGroups_name)
+    country_origin = pick_random_string(countryOrigin)  # Renamed variable to avoid conflict
+    license_type = pick_random_string(licenseType)  # Renamed variable to avoid conflict
+
+    # Generate THING Serial number
+    serial_number = uuid.UUID(int=rng.getrandbits(128), version=4).hex
+
+    # Build Thing Name
+    thing_name = f"{ThingTypeName}_{serial_number}"
+
+    # Build Object
+    return {
+        "ThingName": thing_name,
+        "businessUnitMaker": "AnyCompany",
+        "SerialNumber": serial_number,
+        "ThingTypeName": ThingTypeName,
+        "ThingGroup": ThingGroups,
+        "countryOrigin": country_origin,
+        "licenseType": license_type,
+        "hardwareVersion": "100",
+        "softwareVersion": "100",
+        "CSR": None
+    }
+
+#Define function that generates the devices, yields (parameters, private_key_pem, rng_state) in order
+#The parameters are built here, the keys and CSRs on a pool of worker processes, a few chunks ahead of the writer
+#With a key pool the keys are taken from it here, the workers only generate the keys missing when it runs out
+#rng_state is the state of rng after the last device of a chunk (None for the other devices), a checkpoint can
+#only be taken there since rng is already ahead by the chunks being generated
+#manifest_rows (parameters from read_manifest) replaces build_parameters, the generation stops when they run out
+def generate_devices(number_of_devices, workers, key_algorithm, key_pool=None, manifest_rows=None):
+    def chunks():
+        remaining = number_of_devices
+        while remaining > 0:
+            size = min(CHUNK_SIZE, remaining)
+            if manifest_rows is not None:
+                devices = list(itertools.islice(manifest_rows, size))
+                if not devices:
+                    return
+                size = len(devices)
+            else:
+                devices = [build_parameters(ThingTypeName_list, ThingGroups_list, countryOrigin_list, licenseType_list) for _ in range(size)]
+            remaining -= size
+            private_keys = key_pool.take(key_algorithm, size) if key_pool is not None else []
+            yield devices, ([device["SerialNumber"] for device in devices], key_algorithm, private_keys + [None] * (size - len(private_keys))), rng.getstate()
+
+    def complete(devices, keys_and_csrs, rng_state):
+        for index, (parameters, (private_key_pem, csr_pem)) in enumerate(zip(devices, keys_and_csrs)):
+            parameters["CSR"] = csr_pem
+            yield parameters, private_key_pem, rng_state if index == len(devices) - 1 else None
+
+    if workers <= 1:
+        for devices, task, rng_state in chunks():
+            yield from complete(devices, generate_keys_and_csrs(*task), rng_state)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for devices, task, rng_state in chunks():
+            pending.append((devices, executor.submit(generate_keys_and_csrs, *task), rng_state))
+            if len(pending) >= 2 * workers:
+                devices, future, rng_state = pending.popleft()
+                yield from complete(devices, future.result(), rng_state)
+        while pending:
+            devices, future, rng_state = pending.popleft()
+            yield from complete(devices, future.result(), rng_state)
+
+#Describe class that writes the generated devices to keyStore.json, CSRStore.json and parameters.json
+#Each file is opened once with a large buffer and holds one JSON object per line (JSON Lines), in the same order
+#in the three files. The files are synced to disk by the caller (sync) and when the writer closes.
+#parameters_output replaces parameters.json with another writer, e.g. a MultipartUpload streaming it to S3
+#keystore (a KeyStore) replaces keyStore.json and CSRStore.json, the keys and CSRs are committed to it on sync
+#validator (a preflight.RowValidator) checks every device before it is written, it raises PreflightError on a bad one
+#offsets ({path: size}, from a checkpoint) truncates the files first, which drops what was written after the
+#checkpoint, including a record torn by a crash
+class DeviceWriter:
+    def __init__(self, key_store_path="keyStore.json", csr_store_path="CSRStore.json", parameters_path="parameters.json", parameters_output=None, keystore=None, offsets=None, validator=None):
+        for path, offset in (offsets or {}).items():
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < offset:
+                raise ValueError(f"{path} is shorter ({size} bytes) than at the checkpoint ({offset} bytes), it cannot be resumed")
+            if size > offset:
+                os.truncate(path, offset)
+                logging.info(f"Truncated {path} from {size} to {offset} bytes")
+        self._keystore = keystore
+        self._validator = validator
+        if keystore is None:
+            self._key_file = open(key_store_path, "a", buffering=WRITE_BUFFER_SIZE)
+            self._csr_file = open(csr_store_path, "a", buffering=WRITE_BUFFER_SIZE)
+        self._parameters_file = parameters_output or open(parameters_path, "a", buffering=WRITE_BUFFER_SIZE)
+        self._files = (() if keystore is not None else (self._key_file, self._csr_file)) + (() if parameters_output else (self._parameters_file,))
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    #Define function to write a device: private key, CSR and parameters, each identified by the serial number
+    def write(self, parameters, private_key_pem):
+        serialNumber = parameters["SerialNumber"]
+        if self._validator is not None:
+            self._validator.check(parameters)
+        if self._keystore is not None:
+            self._keystore.add(serialNumber, private_key_pem, parameters["CSR"])
+        else:
+            self._key_file.write(json.dumps({'device_serialNumber': serialNumber, 'private_key': private_key_pem}) + '\n')
+            self._csr_file.write(json.dumps({'device_serialNumber': serialNumber, 'csr': parameters["CSR"]}) + '\n')
+        self._parameters_file.write(json.dumps(parameters) + '\n')
+        self.written += 1
+
+    #Define function to flush the buffers and sync the files to disk
+    def sync(self):
+        if self._keystore is not None:
+            self._keystore.commit()
+        for output_file in self._files:
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+    #Define function to return the size of the local files, call it after sync(): {path: size}
+    def offsets(self):
+        return {output_file.name: output_file.tell() for output_file in self._files}
+
+    #Define function to close the files, parameters_output and keystore are closed by their owners
+    def close(self):
+        self.sync()
+        for output_file in self._files:
+            output_file.close()
+
+#Define function to format a number of seconds as 1h02m03s
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+#Define function to return the progress of the generation as one line, resumed devices do not count in the rate
+def progress_summary(done, failed, total, start, resumed=0):
+    elapsed = time.monotonic() - start
+    rate = (done - resumed) / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else 0.0
+    return f"Generated {done}/{total} devices ({100 * done / total:.1f}%), {rate:.1f} devices/s, {failed} failed, elapsed {format_duration(elapsed)}, ETA {format_duration(eta)}"
+
+#Define function to print the progress of the generation, on one line updated in place on a terminal
+def print_progress(line, final=False):
+    if sys.stdout.isatty():
+        print(f"\r{line}", end="\n" if final else "", flush=True)
+    else:
+        print(line, flush=True)
+
+#Define function to write a checkpoint, the previous checkpoint stays in place until the new one is on disk
+def save_checkpoint(fleetsize, key_algorithm, keystore_path, manifest, generated, written, offsets, rng_state):
+    checkpoint = {
+        "fleetsize": fleetsize,
+        "key_algorithm": key_algorithm,
+        "keystore": keystore_path,
+        "manifest": manifest,
+        "generated": generated,
+        "written": written,
+        "offsets": offsets,
+        "rng_state": [rng_state[0], list(rng_state[1]), rng_state[2]],
+    }
+    tmp_path = CHECKPOINT_FILE + ".tmp"
+    with open(tmp_path, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+#Define function to load the checkpoint of an interrupted run, returns None when there is none
+def load_checkpoint():
+    if not os.path.exists(CHECKPOINT_FILE):
         return None
+    with open(CHECKPOINT_FILE, "r") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    version, internal_state, gauss_next = checkpoint["rng_state"]
+    checkpoint["rng_state"] = (version, tuple(internal_state), gauss_next)
+    return checkpoint
+
+#Define function to generate the fleet and save every device, returns the number of devices saved
+#With a checkpoint (--resume) the files are cut back to it and the generation carries on from there. Checkpoints
+#are only written when parameters.json is a local file, a streamed upload cannot be resumed.
+#keystore (a KeyStore) replaces keyStore.json and CSRStore.json, a resumed device replaces its row in the keystore
+#manifest is a fleet manifest (see fleet_manifest.py) giving the serial numbers and attributes of the devices
+#validator (a preflight.RowValidator) checks the devices of a streamed upload as they are written
+def generate_fleet(number_of_devices, workers, key_algorithm, key_pool=None, parameters_output=None, checkpoint=None, keystore=None, manifest=None, validator=None):
+    done = 0
+    failed = 0
+    offsets = None
+    if checkpoint is not None:
+        done = checkpoint["written"]
+        failed = checkpoint["generated"] - done
+        offsets = checkpoint["offsets"]
+        rng.setstate(checkpoint["rng_state"])
+        logging.info(f"Resuming from the checkpoint after {checkpoint['generated']} devices")
+    resumed = done + failed
+    checkpointing = parameters_output is None
+    keystore_path = keystore.path if keystore is not None else None
+    manifest_rows = read_manifest(manifest, start=resumed) if manifest else None
+
+    logging.info(f"Generating {number_of_devices - resumed} devices with {key_algorithm} keys on {workers} worker processes")
+    if key_pool is not None:
+        logging.info(f"Taking the keys from the key pool {key_pool.path}, {key_pool.available(key_algorithm)} {key_algorithm} keys available")
+    start = time.monotonic()
+    # A terminal shows the progress twice a second, the output and the log file get a line every PROGRESS_INTERVAL
+    print_interval = 0.5 if sys.stdout.isatty() else PROGRESS_INTERVAL
+    last_print = last_log = last_sync = start
+    synced = resumed
+    with DeviceWriter(parameters_output=parameters_output, keystore=keystore, offsets=offsets, validator=validator) as writer:
+        if checkpointing and checkpoint is None:
+            # Checkpoint of the start, the files may already hold the devices of earlier runs
+            writer.sync()
+            save_checkpoint(number_of_devices, key_algorithm, keystore_path, manifest, 0, 0, writer.offsets(), rng.getstate())
+        for parameters, private_key_pem, rng_state in generate_devices(number_of_devices - resumed, workers, key_algorithm, key_pool, manifest_rows):
+            if parameters["CSR"] is None:
+                # The error is logged by the worker, the device is left out of the parameters file
+                failed += 1
+            else:
+                writer.write(parameters, private_key_pem)
+                done += 1
+            now = time.monotonic()
+            if rng_state is not None and (done + failed - synced >= SYNC_EVERY or now - last_sync >= CHECKPOINT_INTERVAL):
+                writer.sync()
+                if checkpointing:
+                    save_checkpoint(number_of_devices, key_algorithm, keystore_path, manifest, done + failed, done, writer.offsets(), rng_state)
+                synced = done + failed
+                last_sync = now
+            if now - last_print >= print_interval:
+                print_progress(progress_summary(done + failed, failed, number_of_devices, start, resumed))
+                last_print = now
+            if now - last_log >= PROGRESS_INTERVAL:
+                logging.info(progress_summary(done + failed, failed, number_of_devices, start, resumed))
+                last_log = now
+        writer.sync()
+        if checkpointing:
+            save_checkpoint(number_of_devices, key_algorithm, keystore_path, manifest, done + failed, done, writer.offsets(), rng.getstate())
+    summary = progress_summary(done + failed, failed, number_of_devices, start, resumed)
+    print_progress(summary, final=True)
+    logging.info(summary)
+    return done
         
 #Define function to retrieve values generate during the bootstrap.sh file execution
 def get_simulation_variables():
@@ -183,52 +384,181 @@ def get_simulation_variables():
         return None
 
 
-#Defines function to CP to a S3 bucket
-def put_object_to_s3_bucket(bucket_name, source_file):
+#Defines function to copy a file to a S3 bucket, returns True when it was copied
+def put_object_to_s3_bucket(s3_client, bucket_name, source_file, key=None):
+    key = key or os.path.basename(source_file)
     try:
-        subprocess.run(["aws", "s3", "cp", source_file, f"s3://{bucket_name}/"])
+        s3_client.upload_file(source_file, bucket_name, key)
         print(f"INFO - {source_file} copied to S3 bucket: {bucket_name}")
         logging.info(f"{source_file} copied to S3 bucket: {bucket_name}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-        logging.error(f"Error: {e}")
-        
-
-#Define start registration task function
-def start_thing_registration_task(template_body, input_file_bucket, input_file_key, role_arn):
-    try:
-        command = [
-            "aws iot start-thing-registration-task",
-            "--template-body", template_body,
-            "--input-file-bucket", input_file_bucket,
-            "--input-file-key", input_file_key,
-            "--role-arn", role_arn
-        ]
-
-        subprocess.run(command, check=True)
-        print("Thing registration task started successfully.")
-        logging.info("Thing registration task started successfully.")
-    except subprocess.CalledProcessError as e:
+        return True
+    except (BotoCoreError, ClientError, OSError) as e:
         print(f"Error: {e}")
         logging.error(f"Error: {e}")
-        # Handle the error as needed
-
+        return False
 
-# Main function to run the simulation based on argument input 
-# Change this to the desired number of device to be registered
-for _ in range(number_of_devices):
-    run_result = build_parameters_and_save(ThingTypeName_list, ThingGroups_list, countryOrigin_list, licenseType_list)
-    # Optionally, you can use the 'run_result' for further processing or checks
+#Define function to count the rows of a parameters file
+def count_rows(path):
+    with open(path, "rb") as parameters_file:
+        return sum(1 for line in parameters_file if line.strip())
 
-#retrieve simulation variables from bootstrap.sh execution
-simulation_variables = get_simulation_variables()
-print (f"Bucket name is{simulation_variables['BUCKET_NAME']}")
-print (f"Provisioning role ARN is{simulation_variables['PROVISIONING_ROLE_ARN']}")
 
-# Copy parameters.json to S3 bucket
-send_to_s3 = put_object_to_s3_bucket(simulation_variables["BUCKET_NAME"], "parameters.json")
+if __name__ == "__main__":
+    key_algorithm = "rsa-2048"
+    key_pool_path = None
+    stream_upload = False
+    chunk_size = 0
 
-#Run bulk registration task in AWS IoT Core
-start_bulk_registration = start_thing_registration_task("bulk_registration_template.json", simulation_variables["BUCKET_NAME"], "parameters.json", simulation_variables["PROVISIONING_ROLE_ARN"])
+    #Pass argument into variables usin arparse Lib
+    try:
+        # Pass arguments into variables using argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument("-n", "--fleetsize", action="store", default=0, dest="fleetsize", help="Numbers of devices on the simulated fleet (required unless --resume, -m, --retry-chunks or --register-file is given)")
+        parser.add_argument("-w", "--workers", action="store", type=int, default=os.cpu_count() or 1, dest="workers", help="Number of processes generating the keys and CSRs (default: number of cores)")
+        parser.add_argument("-k", "--key-algorithm", action="store", default="rsa-2048", choices=list(KEY_ALGORITHMS), dest="key_algorithm", help="Algorithm of the device keys (default: rsa-2048)")
+        parser.add_argument("-p", "--key-pool", action="store", default=None, dest="key_pool", help="Key pool to take the device keys from (see key_pool.py), keys are generated when it runs out")
+        parser.add_argument("-m", "--manifest", action="store", default=None, dest="manifest", help="Fleet manifest (see fleet_manifest.py) with the serial numbers and attributes of the devices, -n takes its first rows (default: every row)")
+        parser.add_argument("--keystore", action="store", default=None, dest="keystore", help="Keystore database (see keystore.py) to write the keys and CSRs to, instead of keyStore.json and CSRStore.json")
+        parser.add_argument("-s", "--stream-upload", action="store_true", dest="stream_upload", help="Upload parameters.json to S3 while the devices are generated, instead of writing it to disk first")
+        parser.add_argument("--part-size", action="store", type=int, default=DEFAULT_PART_SIZE // (1024 * 1024), dest="part_size", help="Size in MiB of the parts of the streamed upload (default: 8, minimum 5)")
+        parser.add_argument("--upload-concurrency", action="store", type=int, default=4, dest="upload_concurrency", help="Number of parts of the streamed upload sent at the same time (default: 4)")
+        parser.add_argument("--s3-endpoint-url", action="store", default=None, dest="s3_endpoint_url", help="S3 endpoint, e.g. a local moto_server for offline runs (default: AWS)")
+        parser.add_argument("-c", "--chunk-size", action="store", type=int, default=0, dest="chunk_size", help="Split parameters.json into chunks of this many devices, streamed to S3 and registered by one task each (default: 0, one file)")
+        parser.add_argument("--chunk-mib", action="store", type=int, default=64, dest="chunk_mib", help="Maximum size in MiB of a chunk (default: 64)")
+        parser.add_argument("--max-tasks", action="store", type=int, default=1, dest="max_tasks", help="Number of registration tasks running at the same time (default: 1)")
+        parser.add_argument("--retry-chunks", action="store_true", dest="retry_chunks", help=f"Do not generate devices, register again the uploaded chunks of {CHUNKS_FILE} that did not complete")
+        parser.add_argument("--register-file", action="store", default=None, dest="register_file", help="Do not generate devices, upload and register a parameters file, e.g. the failed rows of a task in failed_rows/")
+        parser.add_argument("--resume", action="store_true", dest="resume", help=f"Continue the generation interrupted after the last checkpoint of {CHECKPOINT_FILE}, with its fleet size and key algorithm")
+        parser.add_argument("--skip-preflight", action="store_true", dest="skip_preflight", help="Upload the parameters file without checking it against the template first (see preflight.py)")
+        parser.add_argument("--iot-endpoint-url", action="store", default=None, dest="iot_endpoint_url", help="IoT endpoint, e.g. a local stand-in for offline runs (default: AWS)")
     
-#end
\ No newline at end of file
+        args = parser.parse_args() 
+        if not args.fleetsize and not (args.resume or args.manifest or args.retry_chunks or args.register_file):
+            parser.error("the following arguments are required: -n/--fleetsize (unless --resume, -m/--manifest, --retry-chunks or --register-file is given)")
+        number_of_devices = int(args.fleetsize)
+        key_algorithm = args.key_algorithm
+        workers = args.workers
+        key_pool_path = args.key_pool
+        stream_upload = args.stream_upload
+        chunk_size = args.chunk_size
+    
+        print("Number of Devices:", number_of_devices)
+    
+    except argparse.ArgumentError as e:
+        print("Error:", e)
+        print("Please provide the required arguments.")
+    except ValueError as e:
+        print("Error:", e)
+        print("Invalid value provided for fleetsize. Please provide a valid integer.")
+    except Exception as e:
+        print("An error occurred:", e)
+
+    # Main function to run the simulation based on argument input 
+    checkpoint = None
+    if args.resume:
+        if stream_upload or chunk_size > 0 or args.retry_chunks or args.register_file:
+            print("ERROR - --resume only applies to a fleet generated to local files, not with -s, -c, --retry-chunks or --register-file")
+            sys.exit(1)
+        checkpoint = load_checkpoint()
+        if checkpoint is None:
+            print(f"ERROR - No checkpoint to resume from, {CHECKPOINT_FILE} not found")
+            sys.exit(1)
+        number_of_devices = checkpoint["fleetsize"]
+        key_algorithm = checkpoint["key_algorithm"]
+        args.keystore = checkpoint.get("keystore")
+        args.manifest = checkpoint.get("manifest")
+        print(f"INFO - Resuming a fleet of {number_of_devices} {key_algorithm} devices, {checkpoint['generated']} generated at the last checkpoint")
+    if args.manifest and not args.resume:
+        manifest_rows = count_manifest_rows(args.manifest)
+        number_of_devices = min(number_of_devices, manifest_rows) if number_of_devices else manifest_rows
+        print(f"INFO - Generating {number_of_devices} devices of the manifest {args.manifest}")
+    key_pool = KeyPool(key_pool_path) if key_pool_path else None
+    keystore = KeyStore(args.keystore) if args.keystore else None
+    s3_client = create_s3_client(args.s3_endpoint_url)
+    # A new fleet starts a new registration_chunks.json, registering again adds to it
+    tracker = ChunkTracker(CHUNKS_FILE, reset=not (args.retry_chunks or args.register_file))
+    if not (stream_upload or chunk_size > 0 or args.retry_chunks or args.register_file):
+        # Generate the keys, CSRs and parameters of the simulated fleet
+        generate_fleet(number_of_devices, workers, key_algorithm, key_pool, checkpoint=checkpoint, keystore=keystore, manifest=args.manifest)
+
+    # Check the parameters file against the template before it is uploaded, the streamed rows are checked as they are
+    # written, and the chunks registered again with --retry-chunks were checked when they were uploaded
+    parameters_file = args.register_file or (None if (stream_upload or chunk_size > 0 or args.retry_chunks) else "parameters.json")
+    if parameters_file and not args.skip_preflight:
+        report = validate_parameters(parameters_file, "bulk_registration_template.json", workers, create_iot_client(args.iot_endpoint_url))
+        if report.errors:
+            print(f"ERROR - {report.errors} errors in {parameters_file}, see {report.path}, nothing was uploaded (--skip-preflight uploads it anyway)")
+            sys.exit(1)
+        print(f"INFO - {parameters_file} checked against the template, {report.rows} rows without errors")
+    validator = None
+    if (stream_upload or chunk_size > 0) and not (args.retry_chunks or args.register_file or args.skip_preflight):
+        validator = RowValidator("bulk_registration_template.json", create_iot_client(args.iot_endpoint_url))
+    preflight_error = None
+
+    #retrieve simulation variables from bootstrap.sh execution
+    simulation_variables = get_simulation_variables()
+    print (f"Bucket name is{simulation_variables['BUCKET_NAME']}")
+    print (f"Provisioning role ARN is{simulation_variables['PROVISIONING_ROLE_ARN']}")
+    with open("bulk_registration_template.json", "r") as template_file:
+        template_body = template_file.read()
+
+    #Run bulk registration tasks in AWS IoT Core, every file uploaded is registered by its own task and followed until it finishes
+    scheduler = RegistrationScheduler(create_iot_client(args.iot_endpoint_url), s3_client, template_body, simulation_variables["BUCKET_NAME"], simulation_variables["PROVISIONING_ROLE_ARN"], tracker, args.max_tasks)
+    if args.retry_chunks:
+        for chunk in tracker.chunks(RETRY_STATUSES):
+            scheduler.submit(chunk["key"])
+    elif args.register_file:
+        key = os.path.basename(args.register_file)
+        if put_object_to_s3_bucket(s3_client, simulation_variables["BUCKET_NAME"], args.register_file, key):
+            tracker.update(key, rows=count_rows(args.register_file), status="Uploaded")
+            scheduler.submit(key)
+    elif chunk_size > 0:
+        # Every chunk is registered by its own task as soon as it is uploaded, while the next chunks are generated
+        def chunk_uploaded(key, rows, size, error):
+            tracker.update(key, rows=rows, bytes=size, status="UploadFailed" if error else "Uploaded", message=str(error) if error else None)
+            if error is None:
+                scheduler.submit(key)
+
+        # A bad row aborts the chunk it would have been written to, the chunks before it are complete and registered
+        try:
+            with ChunkedUpload(s3_client, simulation_variables["BUCKET_NAME"], "parameters/parameters-", chunk_size, args.chunk_mib * 1024 * 1024, chunk_uploaded, args.part_size * 1024 * 1024, args.upload_concurrency) as upload:
+                generate_fleet(number_of_devices, workers, key_algorithm, key_pool, parameters_output=upload, keystore=keystore, manifest=args.manifest, validator=validator)
+        except PreflightError as e:
+            preflight_error = e
+    elif stream_upload:
+        # Stream parameters.json to the S3 bucket while the devices are generated, a bad row aborts the upload
+        try:
+            with MultipartUpload(s3_client, simulation_variables["BUCKET_NAME"], "parameters.json", args.part_size * 1024 * 1024, args.upload_concurrency) as upload:
+                generated = generate_fleet(number_of_devices, workers, key_algorithm, key_pool, parameters_output=upload, keystore=keystore, manifest=args.manifest, validator=validator)
+            print(f"INFO - parameters.json streamed to S3 bucket: {simulation_variables['BUCKET_NAME']}")
+            tracker.update("parameters.json", rows=generated, bytes=upload.bytes_written, status="Uploaded")
+            scheduler.submit("parameters.json")
+        except PreflightError as e:
+            preflight_error = e
+    else:
+        # Copy parameters.json to S3 bucket
+        if put_object_to_s3_bucket(s3_client, simulation_variables["BUCKET_NAME"], "parameters.json"):
+            tracker.update("parameters.json", rows=count_rows("parameters.json"), status="Uploaded")
+            scheduler.submit("parameters.json")
+    scheduler.close()
+    if key_pool is not None:
+        key_pool.close()
+    if keystore is not None:
+        keystore.close()
+    if validator is not None:
+        validator.close()
+
+    # Summary of the files by status, the ones that did not complete can be registered again with --retry-chunks,
+    # the rows that failed in a completed task with --register-file
+    chunks = tracker.chunks()
+    for status in sorted({chunk.get("status") for chunk in chunks}):
+        selected = [chunk for chunk in chunks if chunk.get("status") == status]
+        print(f"INFO - {len(selected)} files {status}, {sum(chunk.get('rows', 0) for chunk in selected)} devices, {sum(chunk.get('failure_count', 0) for chunk in selected)} failed")
+    for chunk in chunks:
+        if chunk.get("failed_rows_file"):
+            print(f"INFO - Register the failed rows of {chunk['key']} again with: python3 simulation.py --register-file {chunk['failed_rows_file']}")
+    logging.info(f"Registration of {len(chunks)} files finished, see {CHUNKS_FILE}")
+    if preflight_error is not None:
+        print(f"ERROR - {preflight_error}, the rows from there on were not uploaded (--skip-preflight uploads them anyway)")
+        sys.exit(1)
+    sys.exit(0 if chunks and all(chunk.get("status") == "Completed" and not chunk.get("failure_count") for chunk in chunks) else 1)
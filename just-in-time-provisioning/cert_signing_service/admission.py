@@ -0,0 +1,120 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module limits how many signing requests the signing service works on at the same time.
+#A request takes one signing slot per CSR it signs (a batch takes up to all of them), the slots match the depth
+#of the worker pool. Requests that do not get a slot wait in a bounded queue with two lanes, renewals are served
+#before first time issuance. When the queue of a lane is full, or a request waited too long, the request is
+#rejected with a Retry-After estimated from the recent signing rate, so a fleet starting at once is spread out
+#instead of piling up on the service.
+
+#Dependencies
+import collections
+import math
+import threading
+import time
+
+
+# Lanes in priority order, the first lane is served first
+LANES = ("renewal", "issuance")
+
+
+#Describe exception raised when a request is not admitted, it carries the seconds the client should wait
+class ServiceBusy(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Signing service busy, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+#Describe class that hands out the signing slots to the waiting requests by lane
+class AdmissionController:
+    def __init__(self, slots, max_queue=256, queue_timeout=10):
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._in_use = 0
+        # Waiting requests of every lane, in arrival order: [weight, admitted]
+        self._queues = {lane: collections.deque() for lane in LANES}
+        self._condition = threading.Condition()
+        # Moving average of the seconds a slot is held, used for Retry-After
+        self._slot_seconds = 0.05
+
+    #Define function to return the number of requests waiting in a lane
+    def queued(self, lane):
+        return len(self._queues[lane])
+
+    #Define function to return the number of signing slots in use
+    def in_use(self):
+        return self._in_use
+
+    #Define function to estimate the seconds until the queued requests are served
+    def retry_after(self):
+        queued = sum(len(queue) for queue in self._queues.values()) + 1
+        return max(1, math.ceil(queued * self._slot_seconds / self.slots))
+
+    #Define function to take slots for a request, raises ServiceBusy when the request is not admitted
+    #Renewals do not count the issuance queue, so they are admitted while first time issuance is rejected
+    def acquire(self, lane, weight=1):
+        weight = min(max(1, weight), self.slots)
+        with self._condition:
+            if self._in_use + weight <= self.slots and not any(self._queues.values()):
+                self._in_use += weight
+                return weight
+
+            queue = self._queues[lane]
+            if len(queue) >= self.max_queue:
+                raise ServiceBusy(self.retry_after())
+            waiter = [weight, False]
+            queue.append(waiter)
+            deadline = time.monotonic() + self.queue_timeout
+            while not waiter[1]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(waiter)
+                    # Requests behind this one may fit in the free slots now
+                    self._admit()
+                    raise ServiceBusy(self.retry_after())
+                self._condition.wait(remaining)
+            return weight
+
+    #Define function to give back the slots of a request that signed a number of CSRs in a number of seconds
+    def release(self, weight, seconds, count=1):
+        with self._condition:
+            self._in_use -= weight
+            if count:
+                self._slot_seconds = 0.9 * self._slot_seconds + 0.1 * seconds * weight / count
+            self._admit()
+
+    #Define function to admit the waiting requests that fit in the free slots, by lane priority then arrival order
+    def _admit(self):
+        admitted = False
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and self._in_use + queue[0][0] <= self.slots:
+                waiter = queue.popleft()
+                waiter[1] = True
+                self._in_use += waiter[0]
+                admitted = True
+            if queue:
+                # Lower priority lanes wait until this lane is served
+                break
+        if admitted:
+            self._condition.notify_all()
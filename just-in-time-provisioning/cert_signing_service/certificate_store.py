@@ -0,0 +1,186 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module records every certificate issued by the signing service in a SQLite database (certificates.db),
+#indexed by serial number, subject common name, expiry date and CSR fingerprint. Requests only put the
+#certificate on a queue, a writer thread parses the certificates and inserts everything queued so far in one
+#transaction (group commit), so recording adds no disk I/O to the signing path. The database runs in WAL mode,
+#queries read it on their own connection while the writer is inserting.
+
+#Dependencies
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from OpenSSL import crypto
+
+
+# Maximum number of certificates inserted in one transaction
+MAX_COMMIT_SIZE = 1000
+
+# Seconds the writer waits for more certificates before a commit, at most one commit per interval
+COMMIT_INTERVAL = 0.1
+
+# Maximum number of certificates returned by a query
+MAX_QUERY_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    serial_number TEXT PRIMARY KEY,
+    csr_fingerprint TEXT,
+    subject TEXT,
+    common_name TEXT,
+    not_before TEXT,
+    not_after TEXT,
+    issued_at TEXT,
+    certificate TEXT
+);
+CREATE INDEX IF NOT EXISTS certificates_common_name ON certificates (common_name);
+CREATE INDEX IF NOT EXISTS certificates_not_after ON certificates (not_after);
+CREATE INDEX IF NOT EXISTS certificates_csr_fingerprint ON certificates (csr_fingerprint);
+"""
+
+COLUMNS = ("serial_number", "csr_fingerprint", "subject", "common_name", "not_before", "not_after", "issued_at", "certificate")
+
+
+#Define function to convert an ASN.1 time of a certificate (YYYYMMDDHHMMSSZ) to ISO 8601, which sorts by date
+def asn1_time_to_iso(value):
+    return datetime.datetime.strptime(value.decode("ascii"), "%Y%m%d%H%M%SZ").strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+#Define function to turn a certificate into the row stored in the database
+def certificate_row(serial_number, certificate_pem, csr_fingerprint, issued_at):
+    cert = crypto.load_certificate(crypto.FILETYPE_PEM, certificate_pem)
+    subject = cert.get_subject()
+    subject_text = "".join(f"/{name.decode('utf-8')}={value.decode('utf-8')}" for name, value in subject.get_components())
+    return (
+        str(serial_number),
+        csr_fingerprint,
+        subject_text,
+        subject.CN,
+        asn1_time_to_iso(cert.get_notBefore()),
+        asn1_time_to_iso(cert.get_notAfter()),
+        issued_at,
+        certificate_pem,
+    )
+
+
+#Describe class that stores the issued certificates in SQLite and answers queries on them
+class CertificateStore:
+    def __init__(self, path):
+        self.path = str(path)
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="certificate-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        # In WAL mode the database stays consistent after a crash without a fsync on every commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    #Define function to return the number of certificates waiting to be written
+    def pending(self):
+        return self._queue.qsize()
+
+    #Define function to queue an issued certificate, the caller does not wait for the database
+    def record(self, serial_number, certificate_pem, csr_fingerprint=None):
+        issued_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self._queue.put((serial_number, certificate_pem, csr_fingerprint, issued_at))
+
+    #Define function that runs on the writer thread, inserts everything queued in one transaction
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            item = self._queue.get()
+            stopping = item is None
+            items = [] if stopping else [item]
+            if not stopping:
+                # Let the certificates signed meanwhile join this commit
+                time.sleep(COMMIT_INTERVAL)
+            while len(items) < MAX_COMMIT_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                items.append(item)
+
+            rows = []
+            for serial_number, certificate_pem, csr_fingerprint, issued_at in items:
+                try:
+                    rows.append(certificate_row(serial_number, certificate_pem, csr_fingerprint, issued_at))
+                except Exception as e:
+                    logging.error(f"Error recording certificate with serial number {serial_number}: {e}")
+            if rows:
+                try:
+                    with connection:
+                        connection.executemany(f"INSERT OR REPLACE INTO certificates ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+                except sqlite3.Error as e:
+                    logging.error(f"Error writing {len(rows)} certificates to {self.path}: {e}")
+            if stopping:
+                break
+        connection.close()
+
+    #Define function to return the certificates matching all the given filters, ordered by expiry date
+    #not_after_from and not_after_to are ISO 8601 dates or times (UTC), e.g. 2025-06-01 or 2025-06-01T12:00:00Z
+    def query(self, serial_number=None, common_name=None, csr_fingerprint=None, not_after_from=None, not_after_to=None, limit=100):
+        conditions = []
+        parameters = []
+        if serial_number is not None:
+            conditions.append("serial_number = ?")
+            parameters.append(str(int(serial_number)))
+        if common_name is not None:
+            conditions.append("common_name = ?")
+            parameters.append(common_name)
+        if csr_fingerprint is not None:
+            conditions.append("csr_fingerprint = ?")
+            parameters.append(csr_fingerprint.lower())
+        if not_after_from is not None:
+            conditions.append("not_after >= ?")
+            parameters.append(not_after_from)
+        if not_after_to is not None:
+            conditions.append("not_after <= ?")
+            # A date without a time covers the whole day
+            parameters.append(not_after_to + "T23:59:59Z" if len(not_after_to) == 10 else not_after_to)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        parameters.append(max(1, min(int(limit), MAX_QUERY_LIMIT)))
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM certificates {where} ORDER BY not_after, serial_number LIMIT ?", parameters).fetchall()
+        finally:
+            connection.close()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    #Define function to write the queued certificates and stop the writer on shutdown
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
@@ -0,0 +1,188 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module adds opt-in profiling to the processes that run for a long time, so a slow process can be looked at
+#without restarting it. SIGUSR1 (or the admin endpoint of the signing service) starts a sampling profiler, the
+#next SIGUSR1 stops it and writes the profile and the stacks of all threads to the logs directory. SIGUSR2 only
+#writes the stacks, e.g. for a process that hangs.
+#cProfile only sees the thread it was enabled on, the signing service works on one thread per connection, so the
+#profiler samples the stacks of every thread instead. Samples are wall clock, threads waiting on a lock or a
+#socket show up in the function they wait in.
+
+#Dependencies
+import collections
+import datetime
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+
+# Seconds between two samples of the thread stacks
+SAMPLE_INTERVAL = 0.005
+
+# Functions listed in the summary of a profile
+TOP_FUNCTIONS = 40
+
+
+#Define function to return the label of a frame in a profile, function (file:line of the function)
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+#Define function to return the name of a thread without its counter, so the request threads add up in a profile
+def thread_group(name):
+    return re.sub(r"-\d+", "", name)
+
+
+#Describe class that samples the stacks of all threads of the process and writes them to the logs directory
+class SamplingProfiler:
+    def __init__(self, logs_folder, name, interval=SAMPLE_INTERVAL):
+        self.logs_folder = Path(logs_folder)
+        self.name = name
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._started = None
+
+    #Define function to return True while a profile is being recorded
+    def running(self):
+        return self._sampler is not None
+
+    #Define function to start recording a profile, returns False when one is already running
+    def start(self):
+        with self._lock:
+            if self._sampler is not None:
+                return False
+            self._stop.clear()
+            self._stacks = collections.Counter()
+            self._samples = 0
+            self._started = time.monotonic()
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._sampler.start()
+        logging.info(f"Profiling {self.name} (pid {os.getpid()}) started")
+        return True
+
+    #Define function to stop recording, writes the profile and the thread stacks, returns the profile path
+    def stop(self):
+        with self._lock:
+            if self._sampler is None:
+                return None
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+            duration = time.monotonic() - self._started
+            profile_path = self._write_profile(duration)
+        stacks_path = self.dump_stacks()
+        logging.info(f"Profiling {self.name} stopped after {duration:.1f}s, profile written to {profile_path} and {stacks_path}")
+        return profile_path
+
+    #Define function to start a profile, or stop the running one
+    def toggle(self):
+        if not self.start():
+            self.stop()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        labels = {}
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread_group(thread.name) for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[tuple(reversed(stack))] += 1
+            self._samples += 1
+
+    #Define function to write the profile: a summary of the busiest functions, then every stack in the folded
+    #format of flamegraph.pl and speedscope (thread;caller;...;function count)
+    def _write_profile(self, duration):
+        own = collections.Counter()
+        cumulative = collections.Counter()
+        total = sum(self._stacks.values()) or 1
+        for stack, count in self._stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                cumulative[label] += count
+
+        path = self.logs_folder / f"profile-{self.name}-{os.getpid()}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+        with open(path, "w") as profile_file:
+            profile_file.write(f"# {self.name} (pid {os.getpid()}): {self._samples} samples in {duration:.1f}s, every {1000 * self.interval:g}ms, all threads\n")
+            profile_file.write(f"# {'own %':>7} {'total %':>7}  function\n")
+            for label, count in own.most_common(TOP_FUNCTIONS):
+                profile_file.write(f"# {100 * count / total:7.2f} {100 * cumulative[label] / total:7.2f}  {label}\n")
+            profile_file.write("\n")
+            for stack, count in self._stacks.most_common():
+                profile_file.write(f"{';'.join(stack)} {count}\n")
+        return path
+
+    #Define function to write the current stack of every thread, returns the file path
+    def dump_stacks(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        path = self.logs_folder / f"stacks-{self.name}-{os.getpid()}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.txt"
+        with open(path, "w") as stacks_file:
+            for thread_id, frame in sys._current_frames().items():
+                stacks_file.write(f"Thread {names.get(thread_id, thread_id)} ({thread_id}):\n")
+                stacks_file.writelines(traceback.format_stack(frame))
+                stacks_file.write("\n")
+        return path
+
+
+#Define function to start or stop the profiler and dump the stacks on SIGUSR1 and SIGUSR2
+#The work runs on a thread of its own, signal handlers interrupt the main thread wherever it is
+#on_signal is called with the signal number as well, e.g. to forward it to child processes
+def install_signal_handlers(profiler, on_signal=None):
+    def handle_signal(signum, frame):
+        action = profiler.toggle if signum == signal.SIGUSR1 else profiler.dump_stacks
+        threading.Thread(target=action, name="profiler-control", daemon=True).start()
+        if on_signal is not None:
+            on_signal(signum)
+
+    signal.signal(signal.SIGUSR1, handle_signal)
+    signal.signal(signal.SIGUSR2, handle_signal)
+
+
+#Run a script with the profiling signal handlers installed: python3 profiling.py <LOGS-DIR> <SCRIPT> [ARGUMENTS]
+if __name__ == "__main__":
+    import runpy
+    logs_folder, script = sys.argv[1], sys.argv[2]
+    # The script sees its own arguments and imports its modules from its directory, as if it was started directly
+    sys.argv = sys.argv[2:]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    logging.basicConfig(filename=os.path.join(logs_folder, "profiling.log"), level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    install_signal_handlers(SamplingProfiler(logs_folder, Path(script).stem))
+    runpy.run_path(script, run_name="__main__")
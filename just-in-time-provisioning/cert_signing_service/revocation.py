@@ -0,0 +1,306 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module keeps the serial numbers revoked through the signing service (revocations.db, SQLite) and publishes
+#them as CRLs signed by the root CA. A full CRL listing every revoked certificate is published every
+#crl_interval seconds, in between a delta CRL listing only the certificates revoked since the last full CRL is
+#published every delta_interval seconds (RFC 5280 5.2.4). Every revoked entry is DER encoded once, when it is
+#revoked or loaded, so publishing a CRL joins the encoded entries and signs them instead of building hundreds of
+#thousands of entries again.
+
+#Dependencies
+import datetime
+import os
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from ca_cache import CACache
+from signing_backends import HASHES, der_length, der_sequence_elements
+
+
+# Revocation reasons accepted by revoke(), with their RFC 5280 CRLReason codes
+REASONS = {
+    "unspecified": 0,
+    "keyCompromise": 1,
+    "cACompromise": 2,
+    "affiliationChanged": 3,
+    "superseded": 4,
+    "cessationOfOperation": 5,
+    "privilegeWithdrawn": 9,
+}
+
+# Serial numbers are positive and at most 20 octets (RFC 5280 4.1.2.2)
+MAX_SERIAL_NUMBER = 2 ** 159 - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revoked (
+    sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial_number TEXT UNIQUE,
+    revoked_at TEXT,
+    reason INTEGER
+);
+CREATE TABLE IF NOT EXISTS crl_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    crl_number INTEGER,
+    base_crl_number INTEGER,
+    base_sequence INTEGER
+);
+"""
+
+
+#Define function to wrap DER content in a SEQUENCE
+def der_sequence(content):
+    return b"\x30" + der_length(len(content)) + content
+
+
+#Define function to encode a non negative DER INTEGER
+def der_integer(value):
+    # One more byte than needed when the high bit is set, so the value stays positive
+    encoded = value.to_bytes(value.bit_length() // 8 + 1, "big")
+    return b"\x02" + der_length(len(encoded)) + encoded
+
+
+#Define function to encode a time as UTCTime until 2049 and GeneralizedTime after (RFC 5280 5.1.2.6)
+def der_time(moment):
+    if moment.year < 2050:
+        encoded = moment.strftime("%y%m%d%H%M%SZ").encode("ascii")
+        return b"\x17" + der_length(len(encoded)) + encoded
+    encoded = moment.strftime("%Y%m%d%H%M%SZ").encode("ascii")
+    return b"\x18" + der_length(len(encoded)) + encoded
+
+
+#Define function to encode the revokedCertificates entry of a serial number
+def revoked_entry(serial_number, revoked_at, reason):
+    content = der_integer(serial_number) + der_time(revoked_at)
+    # The reason code extension is left out for unspecified (RFC 5280 5.3.1)
+    if reason:
+        reason_code = b"\x06\x03\x55\x1d\x15" + b"\x04\x03\x0a\x01" + bytes([reason])
+        content += der_sequence(der_sequence(reason_code))
+    return der_sequence(content)
+
+
+#Define function to sign the to-be-signed bytes of a CRL with the CA key
+def sign_tbs(ca_key, tbs, digest):
+    if isinstance(ca_key, rsa.RSAPrivateKey):
+        return ca_key.sign(tbs, padding.PKCS1v15(), digest)
+    if isinstance(ca_key, ec.EllipticCurvePrivateKey):
+        return ca_key.sign(tbs, ec.ECDSA(digest))
+    raise ValueError(f"Unsupported CA key type {type(ca_key).__name__}")
+
+
+#Describe class that stores the revoked serial numbers and publishes the full and delta CRLs
+class RevocationList:
+    def __init__(self, path, crl_dir, key_path, cert_path, crl_interval=3600, delta_interval=60, generation_duration=None):
+        self.path = str(path)
+        self.crl_dir = Path(crl_dir)
+        self.crl_dir.mkdir(parents=True, exist_ok=True)
+        self.ca_cache = CACache(key_path, cert_path)
+        self.crl_interval = crl_interval
+        self.delta_interval = delta_interval
+        self.generation_duration = generation_duration
+        # Latest published CRLs (DER), served by the signing service
+        self.full_crl = None
+        self.delta_crl = None
+
+        # Guards the revoked entries and the database connection
+        self._lock = threading.Lock()
+        # Only one CRL is built at a time, so CRL numbers are issued in order
+        self._publish_lock = threading.Lock()
+        self._serial_numbers = set()
+        # Encoded entries of every revoked certificate in revocation order, and the sequence of the last one
+        self._entries = bytearray()
+        self._last_sequence = 0
+        # The entries after this offset were revoked since the last full CRL, they make the delta CRL
+        self._base_offset = 0
+        self._base_sequence = 0
+        self._crl_number = 0
+        self._base_crl_number = None
+        self._full_published = 0
+        self._stopping = threading.Event()
+
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._load()
+        logging.info(f"Revocation list ready with {len(self._serial_numbers)} revoked certificates")
+
+    def __len__(self):
+        return len(self._serial_numbers)
+
+    #Define function to load the revoked serial numbers and the CRL numbers issued before a restart
+    def _load(self):
+        state = self._connection.execute("SELECT crl_number, base_crl_number, base_sequence FROM crl_state WHERE id = 1").fetchone()
+        if state is not None:
+            self._crl_number, self._base_crl_number, self._base_sequence = state
+        for sequence, serial_number, revoked_at, reason in self._connection.execute("SELECT sequence, serial_number, revoked_at, reason FROM revoked ORDER BY sequence"):
+            self._append(sequence, int(serial_number), datetime.datetime.strptime(revoked_at, "%Y-%m-%dT%H:%M:%SZ"), reason)
+            if sequence <= self._base_sequence:
+                self._base_offset = len(self._entries)
+
+    def _append(self, sequence, serial_number, revoked_at, reason):
+        self._serial_numbers.add(serial_number)
+        self._entries += revoked_entry(serial_number, revoked_at, reason)
+        self._last_sequence = sequence
+
+    #Define function to return True when a serial number is revoked
+    def is_revoked(self, serial_number):
+        return int(serial_number) in self._serial_numbers
+
+    #Define function to revoke serial numbers, written to the database in one transaction before returning
+    #Returns the serial numbers revoked now, the ones revoked before are left as they were
+    def revoke(self, serial_numbers, reason="unspecified"):
+        if reason not in REASONS:
+            raise ValueError(f"Unknown revocation reason {reason}, use one of {', '.join(REASONS)}")
+        serial_numbers = [int(serial_number) for serial_number in serial_numbers]
+        for serial_number in serial_numbers:
+            if not 0 < serial_number <= MAX_SERIAL_NUMBER:
+                raise ValueError(f"Invalid serial number {serial_number}")
+
+        revoked_at = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0, tzinfo=None)
+        revoked = []
+        with self._lock:
+            with self._connection:
+                for serial_number in dict.fromkeys(serial_numbers):
+                    if serial_number in self._serial_numbers:
+                        continue
+                    cursor = self._connection.execute(
+                        "INSERT INTO revoked (serial_number, revoked_at, reason) VALUES (?, ?, ?)",
+                        (str(serial_number), revoked_at.strftime("%Y-%m-%dT%H:%M:%SZ"), REASONS[reason]),
+                    )
+                    revoked.append((cursor.lastrowid, serial_number))
+            # Only added in memory once the transaction is committed
+            for sequence, serial_number in revoked:
+                self._append(sequence, serial_number, revoked_at, REASONS[reason])
+        for _, serial_number in revoked:
+            logging.info(f"Certificate with serial number {serial_number} revoked ({reason})")
+        return [serial_number for _, serial_number in revoked]
+
+    #Define function to build a CRL (DER) with encoded entries, a delta CRL when base_crl_number is given
+    #The CRL is built without entries by the cryptography builder, then the entries are put in its to-be-signed
+    #part, which is signed again with the CA key
+    def _build_crl(self, entries, crl_number, validity_seconds, base_crl_number=None):
+        ca = self.ca_cache.get()
+        ca_key = ca.ca_key.to_cryptography_key()
+        digest = HASHES[ca.digest]()
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        builder = (
+            x509.CertificateRevocationListBuilder()
+            .issuer_name(ca.ca_cert.to_cryptography().subject)
+            .last_update(now)
+            .next_update(now + datetime.timedelta(seconds=validity_seconds))
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), critical=False)
+            .add_extension(x509.CRLNumber(crl_number), critical=False)
+        )
+        if base_crl_number is not None:
+            builder = builder.add_extension(x509.DeltaCRLIndicator(base_crl_number), critical=True)
+        template = builder.sign(ca_key, digest).public_bytes(serialization.Encoding.DER)
+
+        tbs, signature_algorithm, _ = der_sequence_elements(template)
+        fields = der_sequence_elements(tbs)
+        if entries:
+            # revokedCertificates goes right before the [0] crlExtensions, the last field
+            fields.insert(len(fields) - 1, der_sequence(entries))
+        tbs = der_sequence(b"".join(fields))
+        signature = sign_tbs(ca_key, tbs, digest)
+        return der_sequence(tbs + signature_algorithm + b"\x03" + der_length(len(signature) + 1) + b"\x00" + signature)
+
+    #Define function to write a CRL to the CRL directory, replacing the previous one at once
+    def _write(self, name, crl):
+        tmp_path = self.crl_dir / (name + ".tmp")
+        tmp_path.write_bytes(crl)
+        os.replace(tmp_path, self.crl_dir / name)
+
+    #Define function to publish a full CRL with every revoked certificate, it becomes the base of the delta CRLs
+    def publish_full(self):
+        with self._publish_lock:
+            start = time.perf_counter()
+            with self._lock:
+                entries = bytes(self._entries)
+                count = len(self._serial_numbers)
+                sequence = self._last_sequence
+            crl_number = self._crl_number + 1
+            # Valid for two intervals, relying parties keep a valid CRL if one publication is missed
+            crl = self._build_crl(entries, crl_number, 2 * self.crl_interval)
+            self._write("rootCA.crl", crl)
+            with self._lock:
+                with self._connection:
+                    self._connection.execute("INSERT OR REPLACE INTO crl_state (id, crl_number, base_crl_number, base_sequence) VALUES (1, ?, ?, ?)", (crl_number, crl_number, sequence))
+                self._crl_number = crl_number
+                self._base_crl_number = crl_number
+                self._base_sequence = sequence
+                self._base_offset = len(entries)
+            self.full_crl = crl
+            self.delta_crl = None
+            self._full_published = time.monotonic()
+            if self.generation_duration:
+                self.generation_duration.observe(time.perf_counter() - start, kind="full")
+            logging.info(f"Published full CRL {crl_number} with {count} revoked certificates")
+            return crl
+
+    #Define function to publish a delta CRL with the certificates revoked since the last full CRL
+    def publish_delta(self):
+        with self._publish_lock:
+            if self._base_crl_number is None:
+                raise ValueError("No full CRL published yet, it is the base of the delta CRLs")
+            start = time.perf_counter()
+            with self._lock:
+                entries = bytes(self._entries[self._base_offset:])
+            crl_number = self._crl_number + 1
+            crl = self._build_crl(entries, crl_number, 2 * self.delta_interval, self._base_crl_number)
+            self._write("rootCA-delta.crl", crl)
+            with self._lock:
+                with self._connection:
+                    self._connection.execute("UPDATE crl_state SET crl_number = ? WHERE id = 1", (crl_number,))
+                self._crl_number = crl_number
+            self.delta_crl = crl
+            if self.generation_duration:
+                self.generation_duration.observe(time.perf_counter() - start, kind="delta")
+            return crl
+
+    #Define function to publish a full CRL now and then a full or delta CRL on schedule, on a background thread
+    def start(self):
+        self._publisher = threading.Thread(target=self._publish_loop, name="crl-publisher", daemon=True)
+        self._publisher.start()
+
+    def _publish_loop(self):
+        wait = 0
+        while not self._stopping.wait(wait):
+            wait = self.delta_interval
+            try:
+                if self.full_crl is None or time.monotonic() - self._full_published >= self.crl_interval:
+                    self.publish_full()
+                    # An empty delta CRL on the new base, so a delta CRL is always available
+                    self.publish_delta()
+                else:
+                    self.publish_delta()
+            except Exception as e:
+                logging.error(f"Error publishing CRL: {e}")
+
+    #Define function to stop publishing and close the database on shutdown
+    def close(self):
+        self._stopping.set()
+        with self._publish_lock, self._lock:
+            self._connection.close()
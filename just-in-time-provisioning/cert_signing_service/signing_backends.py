@@ -0,0 +1,260 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module implements the backends the signing service can sign certificates with:
+# * pyopenssl: the CA key is a PEM file, certificates are built and signed with pyOpenSSL (the default)
+# * cryptography: the same PEM key, certificates are built and signed with the cryptography x509 builder
+# * pkcs11: the CA key stays in an HSM (or SoftHSM for local tests), only the signature is computed by the token
+#Every backend returns the signed certificate PEM, the issuer and the time spent in each signing stage.
+
+#Dependencies
+import datetime
+import hashlib
+import os
+import ssl
+import threading
+import time
+from OpenSSL import crypto
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from ca_cache import CACache, CERT_VALIDITY_SECONDS, ca_digest
+
+
+# Names accepted by create_backend
+BACKENDS = ("pyopenssl", "cryptography", "pkcs11")
+
+# cryptography hash of every digest a CA signs with (see ca_cache.ca_digest)
+HASHES = {"sha256": hashes.SHA256, "sha384": hashes.SHA384}
+
+
+#Describe class that signs certificates with pyOpenSSL and the cached CA files
+class PyOpenSSLBackend:
+    name = "pyopenssl"
+
+    def __init__(self, key_path, cert_path):
+        self.ca_cache = CACache(key_path, cert_path)
+
+    #Define function to load the CA ahead of the first request
+    def load(self):
+        self.ca_cache.get()
+
+    #Define function to sign a CSR, returns the signed certificate PEM, the issuer and the stage timings
+    def sign(self, csr_data, serial_number):
+        start = time.perf_counter()
+        ca = self.ca_cache.get()
+        csr = crypto.load_certificate_request(crypto.FILETYPE_PEM, csr_data)
+        signed_cert = ca.build_certificate(csr, serial_number)
+        built = time.perf_counter()
+        ca.sign(signed_cert)
+        signed = time.perf_counter()
+        signed_cert_pem = crypto.dump_certificate(crypto.FILETYPE_PEM, signed_cert).decode('utf-8')
+        serialized = time.perf_counter()
+
+        timings = {"x509_build": built - start, "sign": signed - built, "pem_serialization": serialized - signed}
+        return signed_cert_pem, str(ca.issuer), timings
+
+
+#Define function to start a cryptography certificate builder for a CSR, with the same template as CAMaterial
+def certificate_builder(csr, issuer_name, serial_number):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (
+        x509.CertificateBuilder()
+        .subject_name(csr.subject)
+        .issuer_name(issuer_name)
+        .public_key(csr.public_key())
+        .serial_number(serial_number)
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(seconds=CERT_VALIDITY_SECONDS))
+    )
+
+
+#Describe class that signs certificates with the cryptography x509 builder and the cached CA files
+class CryptographyBackend:
+    name = "cryptography"
+
+    def __init__(self, key_path, cert_path):
+        self.ca_cache = CACache(key_path, cert_path)
+        # CA material converted to cryptography objects, converted again when the CA cache reloads
+        self._ca = None
+        self._ca_key = None
+        self._issuer_name = None
+        self._hash = None
+
+    #Define function to return the CA material, converting it when the CA files changed
+    def _material(self):
+        ca = self.ca_cache.get()
+        if ca is not self._ca:
+            self._ca_key = ca.ca_key.to_cryptography_key()
+            self._issuer_name = ca.ca_cert.to_cryptography().subject
+            self._hash = HASHES[ca.digest]()
+            self._ca = ca
+        return ca, self._ca_key, self._issuer_name, self._hash
+
+    def load(self):
+        self._material()
+
+    def sign(self, csr_data, serial_number):
+        start = time.perf_counter()
+        ca, ca_key, issuer_name, digest = self._material()
+        csr = x509.load_pem_x509_csr(csr_data.encode('utf-8'))
+        builder = certificate_builder(csr, issuer_name, serial_number)
+        built = time.perf_counter()
+        signed_cert = builder.sign(ca_key, digest)
+        signed = time.perf_counter()
+        signed_cert_pem = signed_cert.public_bytes(serialization.Encoding.PEM).decode('utf-8')
+        serialized = time.perf_counter()
+
+        timings = {"x509_build": built - start, "sign": signed - built, "pem_serialization": serialized - signed}
+        return signed_cert_pem, str(ca.issuer), timings
+
+
+#Define function to encode a DER length
+def der_length(length):
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(encoded)]) + encoded
+
+
+#Define function to split a DER SEQUENCE into the encoded elements it contains
+def der_sequence_elements(der):
+    def read_header(offset):
+        length = der[offset + 1]
+        offset += 2
+        if length & 0x80:
+            size = length & 0x7F
+            length = int.from_bytes(der[offset:offset + size], "big")
+            offset += size
+        return offset, length
+
+    offset, length = read_header(0)
+    end = offset + length
+    elements = []
+    while offset < end:
+        content_offset, element_length = read_header(offset)
+        elements.append(der[offset:content_offset + element_length])
+        offset = content_offset + element_length
+    return elements
+
+
+#Describe class that signs certificates with a CA key kept in a PKCS#11 token (HSM, SoftHSM)
+#The certificate is built with the cryptography builder and signed with a throwaway key of the same type, which
+#gives the to-be-signed bytes and the signature algorithm. The token signs those bytes and its signature replaces
+#the throwaway one. The throwaway key is 1024 bit for RSA (cheap to sign with), the algorithm identifier is the same.
+#The digest is the one the file based backends use for the CA key (see ca_cache.ca_digest), it is read from the
+#public key of the CA certificate, which is the public half of the key on the token.
+class PKCS11Backend:
+    name = "pkcs11"
+
+    def __init__(self, cert_path, module_path, token_label, key_label, pin):
+        self.cert_path = str(cert_path)
+        self.module_path = module_path
+        self.token_label = token_label
+        self.key_label = key_label
+        self.pin = pin
+        self._key = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._key is not None:
+            return
+        with self._lock:
+            if self._key is None:
+                self._open_session()
+
+    #Define function to open a session on the token and find the CA key
+    def _open_session(self):
+        # python-pkcs11 is only needed for this backend
+        import pkcs11
+        from pkcs11 import KeyType, ObjectClass
+
+        with open(self.cert_path, "rb") as cert_file:
+            ca_cert = x509.load_pem_x509_certificate(cert_file.read())
+        self.issuer_name = ca_cert.subject
+        ca_openssl_cert = crypto.X509.from_cryptography(ca_cert)
+        self.issuer = str(ca_openssl_cert.get_subject())
+        ca_public_key = ca_cert.public_key()
+        self._digest = ca_digest(ca_openssl_cert.get_pubkey())
+        self._hash = HASHES[self._digest]()
+
+        token = pkcs11.lib(self.module_path).get_token(token_label=self.token_label)
+        self._session = token.open(user_pin=self.pin)
+        key = self._session.get_key(object_class=ObjectClass.PRIVATE_KEY, label=self.key_label)
+        if key.key_type == KeyType.RSA and isinstance(ca_public_key, rsa.RSAPublicKey):
+            self._placeholder_key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+            self._mechanism = getattr(pkcs11.Mechanism, f"{self._digest.upper()}_RSA_PKCS")
+            self._ecdsa = False
+        elif key.key_type == KeyType.EC and isinstance(ca_public_key, ec.EllipticCurvePublicKey):
+            self._placeholder_key = ec.generate_private_key(ca_public_key.curve)
+            # Plain ECDSA over a digest computed here, supported by every token
+            self._mechanism = pkcs11.Mechanism.ECDSA
+            self._ecdsa = True
+        else:
+            raise ValueError(f"PKCS#11 key {self.key_label} ({key.key_type}) does not match the CA certificate {self.cert_path}")
+        self._key = key
+
+    #Define function to sign the to-be-signed bytes of a certificate on the token, returns the DER signature
+    def _token_sign(self, tbs):
+        with self._lock:
+            if self._ecdsa:
+                raw = self._key.sign(hashlib.new(self._digest, tbs).digest(), mechanism=self._mechanism)
+                # Tokens return r || s, certificates carry the DER Ecdsa-Sig-Value
+                half = len(raw) // 2
+                return encode_dss_signature(int.from_bytes(raw[:half], "big"), int.from_bytes(raw[half:], "big"))
+            return self._key.sign(tbs, mechanism=self._mechanism)
+
+    def sign(self, csr_data, serial_number):
+        start = time.perf_counter()
+        self.load()
+        csr = x509.load_pem_x509_csr(csr_data.encode('utf-8'))
+        template = certificate_builder(csr, self.issuer_name, serial_number).sign(self._placeholder_key, self._hash)
+        tbs, signature_algorithm, _ = der_sequence_elements(template.public_bytes(serialization.Encoding.DER))
+        built = time.perf_counter()
+        signature = self._token_sign(tbs)
+        signed = time.perf_counter()
+        signature_bits = b"\x03" + der_length(len(signature) + 1) + b"\x00" + signature
+        content = tbs + signature_algorithm + signature_bits
+        signed_cert_pem = ssl.DER_cert_to_PEM_cert(b"\x30" + der_length(len(content)) + content)
+        serialized = time.perf_counter()
+
+        timings = {"x509_build": built - start, "sign": signed - built, "pem_serialization": serialized - signed}
+        return signed_cert_pem, self.issuer, timings
+
+
+#Define function to create a signing backend by name
+#The pkcs11 options are module (path of the PKCS#11 library), token_label, key_label and pin (default: PKCS11_PIN)
+def create_backend(name, key_path, cert_path, options=None):
+    options = options or {}
+    if name == "pyopenssl":
+        return PyOpenSSLBackend(key_path, cert_path)
+    if name == "cryptography":
+        return CryptographyBackend(key_path, cert_path)
+    if name == "pkcs11":
+        return PKCS11Backend(
+            cert_path,
+            options.get("module") or os.environ.get("PKCS11_MODULE", "/usr/lib/softhsm/libsofthsm2.so"),
+            options.get("token_label", "signing-ca"),
+            options.get("key_label", "rootCA"),
+            options.get("pin") or os.environ.get("PKCS11_PIN"),
+        )
+    raise ValueError(f"Unknown signing backend {name}, use one of {', '.join(BACKENDS)}")
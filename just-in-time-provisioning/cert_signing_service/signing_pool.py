@@ -0,0 +1,221 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module fans the CPU-bound certificate signing out to a pool of worker processes. Every worker keeps its
+#own signing backend (see signing_backends.py), so the CA key is loaded once per process and the signatures use
+#all the cores of the host.
+#The web server threads only parse requests, hand out serial numbers and wait for the signed certificate.
+
+#Dependencies
+import os
+import signal
+import threading
+import logging
+import collections
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from signing_backends import create_backend
+from profiling import SamplingProfiler, install_signal_handlers
+
+
+# Signing backend of the current process, created by init_worker
+worker_backend = None
+
+# The workers are started by a fork server, a single threaded process started before them. Forking the server
+# itself would copy the locks held by its threads (CRL publisher, certificate store writer, profiler, requests)
+# and a worker could hang on one of them, at startup or when the pool is restarted.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+#Define function that runs once in every worker process
+def init_worker(backend, key_path, cert_path, backend_options, profiling_folder=None, pid_queue=None):
+    global worker_backend
+    # Tell the server which process to forward its signals to
+    if pid_queue is not None:
+        pid_queue.put(os.getpid())
+    # Ctrl+C reaches the whole process group, let the server coordinate the shutdown instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if profiling_folder is not None:
+        # The server forwards its SIGUSR1/SIGUSR2, every worker writes its own profile
+        install_signal_handlers(SamplingProfiler(profiling_folder, "signing-worker"))
+    worker_backend = create_backend(backend, key_path, cert_path, backend_options)
+
+
+#Define function to load the CA in a worker ahead of the first request
+def warm_up_worker(_):
+    try:
+        worker_backend.load()
+        return True
+    except Exception as e:
+        logging.error(f"Error loading CA in signing worker: {e}")
+        return False
+
+
+#Define function that signs a CSR inside a worker process
+def sign_certificate(csr_data, serial_number):
+    return worker_backend.sign(csr_data, serial_number)
+
+
+#Describe class that signs certificates inline (1 worker) or on a pool of worker processes
+class SigningPool:
+    def __init__(self, key_path, cert_path, workers, stage_duration=None, backend="pyopenssl", backend_options=None, profiling_folder=None):
+        self.key_path = str(key_path)
+        self.cert_path = str(cert_path)
+        self.workers = max(1, workers)
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        # Logs directory the workers write their profiles to, None when profiling is off
+        self.profiling_folder = profiling_folder
+        # Histogram (labelled by stage) that receives the timings measured in the workers
+        self.stage_duration = stage_duration
+        self._executor = None
+        self._restart_lock = threading.Lock()
+        # Pids of the workers, reported by init_worker through the queue
+        self._pid_queue = None
+        self._worker_pids = set()
+        if self.workers == 1:
+            # No pool, sign in the calling thread
+            self._backend = create_backend(self.backend, self.key_path, self.cert_path, self.backend_options)
+            try:
+                self._backend.load()
+            except Exception as e:
+                logging.error(f"Error loading CA: {e}")
+        else:
+            self._start_executor()
+
+    #Define function to start the worker processes and load the CA in each of them
+    def _start_executor(self):
+        context = multiprocessing.get_context(START_METHOD)
+        self._pid_queue = context.SimpleQueue()
+        self._worker_pids = set()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(self.backend, self.key_path, self.cert_path, self.backend_options, self.profiling_folder, self._pid_queue)
+        )
+        # Spawns the workers now instead of on the first CSR, CA errors are logged by the workers
+        list(self._executor.map(warm_up_worker, range(self.workers)))
+        logging.info(f"Started {self.workers} signing workers with the {self.backend} backend")
+
+    #Define function to replace a broken pool, once for all the signatures that were running on it
+    def _restart_executor(self, executor):
+        with self._restart_lock:
+            if self._executor is executor:
+                # A worker died (e.g. killed by the OOM killer)
+                logging.error("Signing worker pool is broken, restarting it")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._start_executor()
+
+    #Define function to submit a signature to the pool, returns the executor it was submitted to and the future
+    def _submit(self, csr_data, serial_number):
+        executor = self._executor
+        try:
+            return executor, executor.submit(sign_certificate, csr_data, serial_number)
+        except BrokenProcessPool:
+            self._restart_executor(executor)
+            executor = self._executor
+            return executor, executor.submit(sign_certificate, csr_data, serial_number)
+
+    #Define function to record the stage timings of a signature, the rest of the elapsed time was spent waiting for a worker
+    def _record(self, timings, elapsed):
+        if self.stage_duration is None:
+            return
+        for stage, duration in timings.items():
+            self.stage_duration.observe(duration, stage=stage)
+        if self._executor is not None:
+            self.stage_duration.observe(max(0.0, elapsed - sum(timings.values())), stage="pool_wait")
+
+    #Define function to sign a CSR, returns the signed certificate PEM and the issuer
+    def sign(self, csr_data, serial_number):
+        start = time.perf_counter()
+        if self._executor is None:
+            signed_cert_pem, issuer, timings = self._backend.sign(csr_data, serial_number)
+        else:
+            executor, future = self._submit(csr_data, serial_number)
+            try:
+                signed_cert_pem, issuer, timings = future.result()
+            except BrokenProcessPool:
+                # Replace the pool and retry once
+                self._restart_executor(executor)
+                signed_cert_pem, issuer, timings = self._executor.submit(sign_certificate, csr_data, serial_number).result()
+
+        self._record(timings, time.perf_counter() - start)
+        return signed_cert_pem, issuer
+
+    #Define function to sign a list of (csr_data, serial_number), yields (signed_cert_pem, issuer, error) in the same order
+    def sign_many(self, items):
+        if self._executor is None:
+            for csr_data, serial_number in items:
+                try:
+                    start = time.perf_counter()
+                    signed_cert_pem, issuer, timings = self._backend.sign(csr_data, serial_number)
+                    self._record(timings, time.perf_counter() - start)
+                    yield signed_cert_pem, issuer, None
+                except Exception as e:
+                    yield None, None, e
+            return
+
+        # Keep every worker busy, but only a few signatures ahead of the response that is being written
+        window = self.workers * 2
+        pending = collections.deque()
+        for csr_data, serial_number in items:
+            executor, future = self._submit(csr_data, serial_number)
+            pending.append((executor, future, time.perf_counter(), csr_data, serial_number))
+            if len(pending) >= window:
+                yield self._collect(pending.popleft())
+        while pending:
+            yield self._collect(pending.popleft())
+
+    #Define function to wait for a signature submitted to the pool
+    def _collect(self, pending_signature):
+        executor, future, submitted, csr_data, serial_number = pending_signature
+        try:
+            try:
+                signed_cert_pem, issuer, timings = future.result()
+            except BrokenProcessPool:
+                # The signatures pending on the broken pool are retried once on the new one, like in sign()
+                self._restart_executor(executor)
+                signed_cert_pem, issuer, timings = self._executor.submit(sign_certificate, csr_data, serial_number).result()
+            self._record(timings, time.perf_counter() - submitted)
+            return signed_cert_pem, issuer, None
+        except Exception as e:
+            return None, None, e
+
+    #Define function to send a signal to the worker processes, e.g. to profile them together with the server
+    def signal_workers(self, signum):
+        if self._executor is None:
+            return
+        pid_queue, worker_pids = self._pid_queue, self._worker_pids
+        while not pid_queue.empty():
+            worker_pids.add(pid_queue.get())
+        for pid in list(worker_pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    #Define function to wait for pending signatures and stop the workers
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
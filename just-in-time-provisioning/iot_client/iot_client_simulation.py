@@ -24,11 +24,19 @@ opensource-codeofconduct@amazon.com with any additional questions or comments.
 #This script simulates a client that connects to an AWS IoT Core endpoint.
 #Initiates a provisioning flow, and publishes random data to a topic.
 #Runs process on background and restarts it if it fails.
+#With PROFILING=1 the MQTT client and this script are profiled on SIGUSR1 (see profiling.py), the profiles are
+#written to /opt/iot_client/logs.
 
 # Dependencies
 import subprocess
 import time
 import os
+import logging
+from profiling import SamplingProfiler, install_signal_handlers
+
+# Opt-in profiling of the long running MQTT client
+profiling_enabled = os.environ.get("PROFILING", "").lower() in ("1", "true", "yes")
+logs_folder = "/opt/iot_client/logs"
 
 #Define function to create logs 
 def run_command_with_logging(command, log_file_path):
@@ -70,11 +78,19 @@ def run_command():
         "--count", "0"
     ]
 
+    # Run the MQTT client through profiling.py, so it can be profiled with: pkill -USR1 -f pubsub.py
+    if profiling_enabled:
+        command = ["python3", "/opt/iot_client/profiling.py", logs_folder] + command[1:]
+
     # Log file path
-    log_file_path = "/opt/iot_client/logs/mqtt_client.log"
+    log_file_path = f"{logs_folder}/mqtt_client.log"
     
     # Run process in the background with logging
     run_command_with_logging(command, log_file_path)
 
 if __name__ == "__main__":
+    if profiling_enabled:
+        os.makedirs(logs_folder, exist_ok=True)
+        logging.basicConfig(filename=f"{logs_folder}/profiling.log", level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        install_signal_handlers(SamplingProfiler(logs_folder, "iot_client_simulation"))
     run_command()
\ No newline at end of file
@@ -35,9 +35,11 @@ try:
     parser = argparse.ArgumentParser()
     parser.add_argument("-e", "--endpoint", action="store", required=True, dest="endpoint", help="regional AWS IoT Core AT endpoint")
     parser.add_argument("-n", "--fleetsize", action="store", required=True, dest="fleetsize", help="Numbers of devices on the simulated fleet")
+    parser.add_argument("-k", "--key-algorithm", action="store", default="rsa-2048", choices=["rsa-2048", "rsa-3072", "ecdsa-p256", "ecdsa-p384"], dest="key_algorithm", help="Algorithm of the device keys (default: rsa-2048)")
     
     args = parser.parse_args()
     endpoint = args.endpoint
+    key_algorithm = args.key_algorithm
     number_of_devices = int(args.fleetsize)
 
     # Continue with your script logic here
@@ -179,6 +181,9 @@ print(f"Deploying fleet of {number_of_devices} devices")
 #Create IOT_ENDPOINT Variable
 set_environment_variable('IOT_ENDPOINT', endpoint)
 
+#Create KEY_ALGORITHM Variable, the devices generate their keys with it
+set_environment_variable('KEY_ALGORITHM', key_algorithm)
+
 #Copy rootCA.pem and rootCA.key to /cert_signing_service
 copy_file('rootCA.pem', './cert_signing_service/certs', stop_on_error=True)
 copy_file('rootCA.key', './cert_signing_service/certs', stop_on_error=True)
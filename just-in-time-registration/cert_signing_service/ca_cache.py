@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module keeps the root CA key and certificate in memory so the signing service does not re-read and
+#re-parse them on every request. The files are checked with a cheap os.stat() call on each access, if the
+#inode, modification time or size changed (e.g. the CA was rotated on disk) the material is reloaded.
+
+#Dependencies
+import os
+import threading
+import logging
+from OpenSSL import crypto
+
+
+#Default validity for the device certificates (1 year)
+CERT_VALIDITY_SECONDS = 365 * 24 * 60 * 60
+CERT_DIGEST = "sha256"
+
+
+#Define function to return the digest a CA key signs with, a P-384 key signs with SHA-384 to keep its strength
+def ca_digest(ca_key):
+    if ca_key.type() == crypto.TYPE_EC and ca_key.bits() >= 384:
+        return "sha384"
+    return CERT_DIGEST
+
+
+#Describe class that holds the parsed CA material and the values reused on every signature
+class CAMaterial:
+    def __init__(self, ca_key, ca_cert):
+        self.ca_key = ca_key
+        self.ca_cert = ca_cert
+        # Precompute the issuer name once, it is the same for every certificate we sign
+        self.issuer = ca_cert.get_subject()
+        self.validity_seconds = CERT_VALIDITY_SECONDS
+        self.digest = ca_digest(ca_key)
+
+    #Define function to build a new certificate from the template for a CSR and serial number
+    def build_certificate(self, csr, serial_number):
+        cert = crypto.X509()
+        cert.set_subject(csr.get_subject())
+        cert.set_pubkey(csr.get_pubkey())
+        cert.set_serial_number(serial_number)
+        cert.gmtime_adj_notBefore(0)
+        cert.gmtime_adj_notAfter(self.validity_seconds)
+        cert.set_issuer(self.issuer)
+        return cert
+
+    #Define function to sign a certificate with the CA key
+    def sign(self, cert):
+        cert.sign(self.ca_key, self.digest)
+        return cert
+
+
+#Describe class that caches the CA material and reloads it when the files change on disk
+class CACache:
+    def __init__(self, key_path, cert_path):
+        self.key_path = str(key_path)
+        self.cert_path = str(cert_path)
+        self._lock = threading.Lock()
+        self._material = None
+        self._file_state = None
+
+    #Define function to read inode, mtime and size of both CA files
+    def _stat_files(self):
+        key_stat = os.stat(self.key_path)
+        cert_stat = os.stat(self.cert_path)
+        return (key_stat.st_ino, key_stat.st_mtime_ns, key_stat.st_size,
+                cert_stat.st_ino, cert_stat.st_mtime_ns, cert_stat.st_size)
+
+    #Define function to load and parse the CA files
+    def _load(self):
+        with open(self.key_path, "rb") as key_file:
+            ca_key = crypto.load_privatekey(crypto.FILETYPE_PEM, key_file.read())
+        with open(self.cert_path, "rb") as cert_file:
+            ca_cert = crypto.load_certificate(crypto.FILETYPE_PEM, cert_file.read())
+
+        # During a rotation the key and certificate may be replaced one after the other,
+        # never hand out a pair that does not belong together.
+        cert_public_key = ca_cert.get_pubkey().to_cryptography_key().public_numbers()
+        key_public_key = ca_key.to_cryptography_key().public_key().public_numbers()
+        if cert_public_key != key_public_key:
+            raise ValueError(f"CA key {self.key_path} does not match CA certificate {self.cert_path}")
+
+        return CAMaterial(ca_key, ca_cert)
+
+    #Define function to return the cached CA material, reloading it if the files changed
+    def get(self):
+        try:
+            file_state = self._stat_files()
+        except OSError as e:
+            # Files are missing (e.g. mid-rotation), keep serving the last good CA if we have one
+            if self._material is not None:
+                logging.warning(f"Unable to stat CA files, using cached CA: {e}")
+                return self._material
+            raise
+
+        material = self._material
+        if material is not None and file_state == self._file_state:
+            return material
+
+        with self._lock:
+            if self._material is not None and file_state == self._file_state:
+                return self._material
+            try:
+                self._material = self._load()
+                self._file_state = file_state
+                logging.info(f"Loaded CA certificate {self.cert_path} (issuer {self._material.issuer})")
+            except Exception as e:
+                if self._material is None:
+                    raise
+                # Keep the previous CA and try again on the next request
+                logging.error(f"Error reloading CA, using cached CA: {e}")
+            return self._material
@@ -0,0 +1,176 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module remembers the certificates issued by the signing service, keyed by the fingerprint of the CSR
+#(SHA-256 of its DER encoding). When a device retries or a container restarts and sends the same CSR again,
+#the certificate issued the first time is returned instead of signing it again with a new serial number.
+#The most recently used entries are kept in memory (bounded), and every new entry is appended to a JSON Lines
+#file that is replayed when the service starts. The file is rewritten with the live entries when it grows to
+#twice the cache size.
+
+#Dependencies
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from OpenSSL import crypto
+
+
+#Define function to return the fingerprint of a parsed CSR, the hex SHA-256 of its DER encoding
+def csr_fingerprint(csr):
+    return hashlib.sha256(crypto.dump_certificate_request(crypto.FILETYPE_ASN1, csr)).hexdigest()
+
+
+#Describe class that caches the issued certificates by CSR fingerprint and persists them to a file
+class IssuedCertificateCache:
+    def __init__(self, path, max_entries=50000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        # fingerprint -> (serial_number, certificate PEM), least recently used first
+        self._entries = OrderedDict()
+        # Fingerprints being signed right now, requests for the same CSR wait for them instead of signing again
+        self._in_flight = set()
+        self._condition = threading.Condition()
+        self._records = 0
+
+        self._load()
+        self._file = open(self.path, "a")
+        logging.info(f"Issued certificate cache ready with {len(self._entries)} certificates")
+
+    def __len__(self):
+        return len(self._entries)
+
+    #Define function to load the entries written before a restart
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        valid_length = 0
+        with open(self.path, "rb") as cache_file:
+            for line in cache_file:
+                # A torn last line (crash in the middle of a write) has no newline
+                if not line.endswith(b"\n"):
+                    break
+                valid_length += len(line)
+                try:
+                    record = json.loads(line)
+                    self._store(record["fingerprint"], (int(record["serial_number"]), record["certificate"]))
+                except (ValueError, KeyError):
+                    continue
+                self._records += 1
+
+        # Cut the torn line off, so the next record starts on a line of its own
+        if os.path.getsize(self.path) != valid_length:
+            os.truncate(self.path, valid_length)
+
+    #Define function to add an entry in memory, evicting the least recently used one when the cache is full
+    def _store(self, fingerprint, entry):
+        self._entries[fingerprint] = entry
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    #Define function to return the cached (serial_number, certificate PEM) of a fingerprint, or None
+    def get(self, fingerprint):
+        with self._condition:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+            return entry
+
+    #Define function that waits while the fingerprint is being signed by another request, then returns get()
+    def wait(self, fingerprint):
+        with self._condition:
+            while fingerprint in self._in_flight:
+                self._condition.wait()
+        return self.get(fingerprint)
+
+    #Define function that returns the cached entry, or claims the fingerprint for signing and returns None
+    #The caller must put() or release() a claimed fingerprint. Waits while another request has claimed it.
+    def acquire(self, fingerprint):
+        with self._condition:
+            while fingerprint in self._in_flight:
+                self._condition.wait()
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+                return entry
+            self._in_flight.add(fingerprint)
+            return None
+
+    #Define function like acquire() that does not wait, returns (entry, claimed)
+    #Both are empty when another request is signing the fingerprint
+    def try_acquire(self, fingerprint):
+        with self._condition:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+                return entry, False
+            if fingerprint in self._in_flight:
+                return None, False
+            self._in_flight.add(fingerprint)
+            return None, True
+
+    #Define function to store the certificate issued for a fingerprint and release the claim on it
+    def put(self, fingerprint, serial_number, certificate_pem):
+        with self._condition:
+            # A cache size of 0 disables the cache, e.g. for load tests that send the same CSRs many times
+            if self.max_entries > 0:
+                self._store(fingerprint, (serial_number, certificate_pem))
+                # Serial numbers are 128 bit, they are written as strings like in the batch responses
+                record = {"fingerprint": fingerprint, "serial_number": str(serial_number), "certificate": certificate_pem}
+                # Flushed to the OS on every write, an entry lost in a power failure only means the CSR is signed again
+                self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+                self._records += 1
+                if self._records >= 2 * self.max_entries:
+                    self._compact()
+            self._in_flight.discard(fingerprint)
+            self._condition.notify_all()
+
+    #Define function to release the claim on a fingerprint that could not be signed
+    def release(self, fingerprint):
+        with self._condition:
+            self._in_flight.discard(fingerprint)
+            self._condition.notify_all()
+
+    #Define function to rewrite the file with the entries still in memory
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as tmp_file:
+            for fingerprint, (serial_number, certificate_pem) in self._entries.items():
+                tmp_file.write(json.dumps({"fingerprint": fingerprint, "serial_number": str(serial_number), "certificate": certificate_pem}) + "\n")
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a")
+        self._records = len(self._entries)
+        logging.info(f"Compacted {self.path} to {self._records} certificates")
+
+    #Define function to flush the file and close it on shutdown
+    def close(self):
+        with self._condition:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
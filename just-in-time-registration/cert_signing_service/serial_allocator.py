@@ -0,0 +1,306 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module hands out the serial numbers from serial_numbers.json to the JITR signing service.
+#The pool is loaded once, allocated positions are tracked in a bitmap (1 bit per serial number) and a cursor
+#points at the next free position, so every allocation is O(1). Each allocated serial number is appended to a
+#journal file before it is used. Requests running at the same time share a single fsync (group commit), and on
+#restart the journal is replayed so serial numbers are never issued twice.
+#When several replicas of the signing service share one pool, LeasedSerialAllocator is used instead: every
+#replica leases a block of positions from a SQLite store on a shared volume, hands them out from memory, and
+#gives the unused part of its block back when it stops.
+
+#Dependencies
+import os
+import json
+import hashlib
+import socket
+import sqlite3
+import datetime
+import threading
+import logging
+
+
+#Define function to load serialNumbers from file into memory
+def load_serial_numbers_from_file(file_path):
+    try:
+        with open(file_path, "r") as json_file:
+            data = json.load(json_file)
+            logging.info(f"Loaded serial numbers from file: {file_path}")
+            return data
+    except Exception as e:
+        # Handle any exceptions, e.g., file not found or JSON parsing error
+        print(f"Error loading serial numbers: {e}")
+        logging.error(f"Error loading serial numbers: {e}")
+        return {}
+
+
+#Describe class that allocates serial numbers from the pool and journals every allocation
+class SerialAllocator:
+    def __init__(self, serial_numbers_path, journal_path):
+        self.serial_numbers = load_serial_numbers_from_file(serial_numbers_path).get("serial_numbers", [])
+        self.journal_path = str(journal_path)
+        self._allocated = bytearray((len(self.serial_numbers) + 7) // 8)
+        self._allocated_count = 0
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+        # Group commit state, sequence numbers of the journal records written and fsynced so far
+        self._sync_condition = threading.Condition()
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._sync_in_progress = False
+
+        self._replay_journal()
+        self._journal = open(self.journal_path, "a")
+        logging.info(f"Serial number allocator ready, {self.remaining()} of {len(self.serial_numbers)} serial numbers available")
+
+    #Define functions to read and set the allocated bit of a position in the pool
+    def _is_allocated(self, index):
+        return self._allocated[index >> 3] & (1 << (index & 7))
+
+    def _mark_allocated(self, index):
+        self._allocated[index >> 3] |= 1 << (index & 7)
+        self._allocated_count += 1
+
+    #Define function to mark the serial numbers recorded in the journal as allocated
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        # Serial numbers are journaled by value, so a regenerated serial_numbers.json is handled correctly
+        positions = {serial_number: index for index, serial_number in enumerate(self.serial_numbers)}
+        replayed = 0
+        valid_length = 0
+        with open(self.journal_path, "rb") as journal:
+            for line in journal:
+                # A torn last line (crash in the middle of a write) has no newline and was never used
+                if not line.endswith(b"\n"):
+                    break
+                valid_length += len(line)
+                try:
+                    index = positions.get(int(line))
+                except ValueError:
+                    continue
+                if index is not None and not self._is_allocated(index):
+                    self._mark_allocated(index)
+                    replayed += 1
+
+        # Cut the torn line off, so the next record starts on a line of its own
+        if os.path.getsize(self.journal_path) != valid_length:
+            os.truncate(self.journal_path, valid_length)
+
+        while self._cursor < len(self.serial_numbers) and self._is_allocated(self._cursor):
+            self._cursor += 1
+        logging.info(f"Replayed {replayed} allocated serial numbers from {self.journal_path}")
+
+    #Define function to return how many serial numbers are still available
+    def remaining(self):
+        return len(self.serial_numbers) - self._allocated_count
+
+    #Define function to hand out the next serial number, returns None when the pool is exhausted
+    def allocate(self):
+        with self._lock:
+            while self._cursor < len(self.serial_numbers) and self._is_allocated(self._cursor):
+                self._cursor += 1
+            if self._cursor >= len(self.serial_numbers):
+                return None
+
+            index = self._cursor
+            serial_number = self.serial_numbers[index]
+            self._mark_allocated(index)
+            self._cursor += 1
+            self._journal.write(f"{serial_number}\n")
+            self._written_seq += 1
+            seq = self._written_seq
+
+        # Do not return the serial number before it is on disk
+        self._sync(seq)
+        return serial_number
+
+    #Define function that waits until the journal is fsynced up to a record, one fsync covers all waiting requests
+    def _sync(self, seq):
+        with self._sync_condition:
+            while self._synced_seq < seq:
+                if self._sync_in_progress:
+                    self._sync_condition.wait()
+                    continue
+
+                self._sync_in_progress = True
+                with self._lock:
+                    target_seq = self._written_seq
+                    self._journal.flush()
+                try:
+                    # Other requests keep writing records while this one waits on the disk
+                    self._sync_condition.release()
+                    try:
+                        os.fsync(self._journal.fileno())
+                    finally:
+                        self._sync_condition.acquire()
+                    self._synced_seq = max(self._synced_seq, target_seq)
+                finally:
+                    self._sync_in_progress = False
+                    self._sync_condition.notify_all()
+
+    #Define function to flush the journal and close it on shutdown
+    def close(self):
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal.close()
+
+
+#Define function to return the position after the last serial number recorded in a SerialAllocator journal
+def journaled_position(serial_numbers, journal_path):
+    if not journal_path or not os.path.exists(journal_path):
+        return 0
+    positions = {serial_number: index for index, serial_number in enumerate(serial_numbers)}
+    position = 0
+    with open(journal_path, "rb") as journal:
+        for line in journal:
+            try:
+                index = positions.get(int(line))
+            except ValueError:
+                continue
+            if index is not None:
+                position = max(position, index + 1)
+    return position
+
+
+#Describe class that allocates serial numbers from blocks leased from a store shared by signing service replicas
+class LeasedSerialAllocator:
+    def __init__(self, serial_numbers_path, lease_store_path, block_size=64, replica_id=None, journal_path=None):
+        self.serial_numbers = load_serial_numbers_from_file(serial_numbers_path).get("serial_numbers", [])
+        self.lease_store_path = str(lease_store_path)
+        self.block_size = max(1, block_size)
+        self.replica_id = replica_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._lock = threading.Lock()
+        # Leased block, positions [_next, _end) of the pool are still to be handed out
+        self._lease_id = None
+        self._next = 0
+        self._end = 0
+
+        self._connection = sqlite3.connect(self.lease_store_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # A lease must be on disk before its serial numbers are used
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._init_store(journal_path)
+        logging.info(f"Leased serial number allocator ready for replica {self.replica_id}, {self.remaining()} of {len(self.serial_numbers)} serial numbers available")
+
+    #Define function to create the store, or reset it when serial_numbers.json was regenerated
+    def _init_store(self, journal_path):
+        digest = hashlib.sha256(json.dumps(self.serial_numbers).encode("utf-8")).hexdigest()
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("CREATE TABLE IF NOT EXISTS pool (id INTEGER PRIMARY KEY CHECK (id = 1), digest TEXT, size INTEGER, next_index INTEGER)")
+                cursor.execute("CREATE TABLE IF NOT EXISTS free_ranges (start INTEGER, end INTEGER)")
+                cursor.execute("CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY AUTOINCREMENT, replica TEXT, start INTEGER, end INTEGER, claimed_at TEXT)")
+                row = cursor.execute("SELECT digest FROM pool WHERE id = 1").fetchone()
+                if row is None or row[0] != digest:
+                    # Serial numbers already handed out by a single replica (journal) are skipped
+                    start = journaled_position(self.serial_numbers, journal_path)
+                    cursor.execute("DELETE FROM free_ranges")
+                    cursor.execute("DELETE FROM leases")
+                    cursor.execute("INSERT OR REPLACE INTO pool (id, digest, size, next_index) VALUES (1, ?, ?, ?)", (digest, len(self.serial_numbers), start))
+                    logging.info(f"Serial number lease store {self.lease_store_path} initialized, starting at position {start}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    #Define function to lease the next block, returned ranges first, returns False when the pool is exhausted
+    #Blocks are at most an eighth of what is left, so near the end of the pool no replica holds most of it
+    def _lease_block(self):
+        cursor = self._connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            free_range = cursor.execute("SELECT rowid, start, end FROM free_ranges ORDER BY start LIMIT 1").fetchone()
+            if free_range is not None:
+                rowid, start, range_end = free_range
+                end = min(range_end, start + self.block_size)
+                if end < range_end:
+                    cursor.execute("UPDATE free_ranges SET start = ? WHERE rowid = ?", (end, rowid))
+                else:
+                    cursor.execute("DELETE FROM free_ranges WHERE rowid = ?", (rowid,))
+            else:
+                size, start = cursor.execute("SELECT size, next_index FROM pool WHERE id = 1").fetchone()
+                if start >= size:
+                    cursor.execute("COMMIT")
+                    return False
+                end = start + min(self.block_size, max(1, (size - start) // 8))
+                cursor.execute("UPDATE pool SET next_index = ? WHERE id = 1", (end,))
+            claimed_at = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            cursor.execute("INSERT INTO leases (replica, start, end, claimed_at) VALUES (?, ?, ?, ?)", (self.replica_id, start, end, claimed_at))
+            lease_id = cursor.lastrowid
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+        # The previous block is used up, its lease is closed with it
+        self._close_lease()
+        self._lease_id = lease_id
+        self._next = start
+        self._end = end
+        logging.info(f"Leased serial number positions {start} to {end - 1}")
+        return True
+
+    #Define function to give the unused part of the current block back to the store and close its lease
+    def _close_lease(self):
+        if self._lease_id is None:
+            return
+        cursor = self._connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if self._next < self._end:
+                cursor.execute("INSERT INTO free_ranges (start, end) VALUES (?, ?)", (self._next, self._end))
+            cursor.execute("DELETE FROM leases WHERE id = ?", (self._lease_id,))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        self._lease_id = None
+        self._next = self._end
+
+    #Define function to return how many serial numbers are still available to all replicas
+    def remaining(self):
+        with self._lock:
+            size, next_index = self._connection.execute("SELECT size, next_index FROM pool WHERE id = 1").fetchone()
+            returned = self._connection.execute("SELECT COALESCE(SUM(end - start), 0) FROM free_ranges").fetchone()[0]
+            return max(0, size - next_index) + returned + (self._end - self._next)
+
+    #Define function to hand out the next serial number, returns None when the pool is exhausted
+    def allocate(self):
+        with self._lock:
+            if self._next >= self._end and not self._lease_block():
+                return None
+            serial_number = self.serial_numbers[self._next]
+            self._next += 1
+            return serial_number
+
+    #Define function to return the unused serial numbers on shutdown
+    #After a crash the rest of the block is not handed out again, so serial numbers are never issued twice
+    def close(self):
+        with self._lock:
+            self._close_lease()
+            self._connection.close()
@@ -26,10 +26,28 @@
 #Dependencies
 import http.server
 import socketserver
+import socket
 from OpenSSL import crypto
 from pathlib import Path
 import logging
 import json
+import re
+import urllib.parse
+import argparse
+import os
+import signal
+import ipaddress
+import threading
+import time
+from signing_pool import SigningPool
+from signing_backends import BACKENDS
+from metrics import MetricsRegistry
+from issued_cache import IssuedCertificateCache, csr_fingerprint
+from admission import AdmissionController, ServiceBusy, LANES
+from certificate_store import CertificateStore, MAX_QUERY_LIMIT
+from revocation import RevocationList
+from profiling import SamplingProfiler, install_signal_handlers
+from serial_allocator import SerialAllocator, LeasedSerialAllocator
 
 
 # Define working path
@@ -45,91 +63,610 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-#Define function to load serialNumbers from file into memory
-def load_serial_numbers_from_file(file_path):
-    try:
-        with open(file_path, "r") as json_file:
-            data = json.load(json_file)
-            logging.info(f"Loaded serial numbers from file: {file_path}")
-            return data
-    except Exception as e:
-        # Handle any exceptions, e.g., file not found or JSON parsing error
-        print(f"Error loading serial numbers: {e}")
-        logging.error(f"Error loading serial numbers: {e}")
-        return {}
-# Define a global variable to keep track of the used serial numbers
-used_serial_numbers = set()
-
-# Usage example:
-file_path = "serial_numbers.json"
-serial_numbers_data = load_serial_numbers_from_file(file_path)
-print(serial_numbers_data)
+# Serial number allocator, loads serial_numbers.json once and journals every allocation (created at server start)
+serial_allocator = None
 
+# Signing pool, holds the CA key in every worker process (created at server start)
+signer = None
+
+# Certificates issued by CSR fingerprint, a CSR sent again gets the same certificate back (created at server start)
+issued_certificates = None
+
+# Admission control, bounds the signing requests waiting for the workers (created at server start)
+admission = None
+
+# Every issued certificate indexed by serial number, common name and expiry date (created at server start)
+certificate_store = None
+
+# Revoked serial numbers, published as full and delta CRLs (created at server start)
+revocation_list = None
+
+# Sampling profiler of the server process, only created with --profiling
+profiler = None
+
+# Metrics exposed on /metrics in the Prometheus text format
+metrics_registry = MetricsRegistry()
+requests_total = metrics_registry.counter("signing_requests_total", "HTTP requests received by endpoint", ("endpoint",))
+errors_total = metrics_registry.counter("signing_errors_total", "CSRs that could not be signed by endpoint", ("endpoint",))
+certificates_issued_total = metrics_registry.counter("signing_certificates_issued_total", "Certificates signed")
+requests_in_flight = metrics_registry.gauge("signing_requests_in_flight", "HTTP requests being processed")
+request_duration = metrics_registry.histogram("signing_request_duration_seconds", "Time to process an HTTP request by endpoint", ("endpoint",))
+cache_hits_total = metrics_registry.counter("signing_cache_hits_total", "CSRs answered with a certificate issued before, by endpoint", ("endpoint",))
+cached_certificates = metrics_registry.gauge("signing_cached_certificates", "Certificates in the issued certificate cache", function=lambda: len(issued_certificates) if issued_certificates else 0)
+rejected_total = metrics_registry.counter("signing_rejected_total", "Requests rejected with 503 because the signing queue was full, by lane", ("lane",))
+signing_queued = metrics_registry.gauge("signing_queued_requests", "Requests waiting for a signing slot", function=lambda: sum(admission.queued(lane) for lane in LANES) if admission else 0)
+signing_slots_in_use = metrics_registry.gauge("signing_slots_in_use", "Signing slots in use", function=lambda: admission.in_use() if admission else 0)
+certificate_store_pending = metrics_registry.gauge("signing_certificate_store_pending", "Issued certificates waiting to be written to certificates.db", function=lambda: certificate_store.pending() if certificate_store else 0)
+revoked_certificates = metrics_registry.gauge("signing_revoked_certificates", "Certificates revoked", function=lambda: len(revocation_list) if revocation_list else 0)
+crl_generation_duration = metrics_registry.histogram("signing_crl_generation_seconds", "Time to build, sign and write a CRL by kind (full or delta)", ("kind",))
+stage_duration = metrics_registry.histogram("signing_stage_duration_seconds", "Time spent in each stage of signing a CSR", ("stage",))
+serial_numbers_remaining = metrics_registry.gauge("signing_serial_numbers_remaining", "Serial numbers left in serial_numbers.json", function=lambda: serial_allocator.remaining() if serial_allocator else 0)
+
+# Maximum number of CSRs accepted in one batch request
+MAX_BATCH_SIZE = 1000
+
+# Path to re-fetch the certificate issued for a CSR, by the hex SHA-256 of the CSR in DER
+CERTIFICATE_PATH_PATTERN = re.compile(r"^/certificates/([0-9a-fA-F]{64})$")
+
+# PEM blocks of the CSRs in a bundle
+CSR_PEM_PATTERN = re.compile(r"-----BEGIN (?:NEW )?CERTIFICATE REQUEST-----.+?-----END (?:NEW )?CERTIFICATE REQUEST-----", re.DOTALL)
+
+#Define function to split a batch request body into a list of (id, csr_data, error)
+#JSON Lines bodies have one {"id": ..., "csr": "<PEM>"} object per line, any other body is read as a PEM bundle
+def parse_batch_request(body, content_type):
+    items = []
+    if content_type.split(";")[0].strip() in ("application/x-ndjson", "application/jsonl", "application/json-lines"):
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                items.append((item.get("id"), item["csr"], None))
+            except Exception as e:
+                items.append((None, None, f"Invalid JSON Lines item: {e}"))
+    else:
+        for csr_data in CSR_PEM_PATTERN.findall(body):
+            items.append((None, csr_data, None))
+    return items
+
+#Define function to get the next available serial number from the list
+def allocate_serial_number():
+    serial_number = serial_allocator.allocate()
+    if serial_number is None:
+        raise Exception("No more serial numbers available.")
+    return serial_number
 
-# Describe class to handle CSR requests
 # Describe class to handle CSR requests
 class CSRHandler(http.server.BaseHTTPRequestHandler):
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        csr_data = self.rfile.read(content_length).decode('utf-8')
+    # Keep connections open between requests, so devices and gateways do not reconnect for every CSR
+    protocol_version = "HTTP/1.1"
+    # Idle connections are closed after this many seconds
+    timeout = 30
+    # Connections are closed after this many requests
+    max_requests_per_connection = 100
+    # Send the headers and body of small responses without waiting for an ACK (Nagle)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+
+    def end_headers(self):
+        self.requests_served += 1
+        if not self.close_connection:
+            if self.requests_served >= self.max_requests_per_connection or self.server.stopping:
+                self.send_header('Connection', 'close')
+            else:
+                self.send_header('Keep-Alive', f"timeout={self.timeout}, max={self.max_requests_per_connection - self.requests_served}")
+        super().end_headers()
+
+    #Define function to write part of a streamed response, chunked for HTTP/1.1 clients
+    def write_chunk(self, data):
+        if self.request_version == "HTTP/1.0":
+            self.wfile.write(data)
+        else:
+            self.wfile.write(f"{len(data):X}\r\n".encode('utf-8') + data + b"\r\n")
 
-        signed_cert = self.sign_csr(csr_data)
+    #Define function to return the admission lane of the request, devices renewing a certificate send X-Signing-Lane: renewal
+    def signing_lane(self):
+        lane = self.headers.get('X-Signing-Lane', 'issuance').strip().lower()
+        return lane if lane in LANES else "issuance"
 
+    #Define function to reject a request when the signing queue is full, the client should retry after the given seconds
+    def send_busy(self, retry_after):
+        rejected_total.inc(lane=self.signing_lane())
+        body = f"Signing service busy, retry after {retry_after} seconds\n".encode('utf-8')
+        self.send_response(503)
+        self.send_header('Retry-After', str(retry_after))
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        certificate_path = CERTIFICATE_PATH_PATTERN.match(url.path)
+        if certificate_path:
+            self.get_certificate(certificate_path.group(1).lower())
+            return
+        if url.path == "/certificates":
+            self.query_certificates(urllib.parse.parse_qs(url.query))
+            return
+        if url.path in ("/crl", "/crl/delta"):
+            self.send_crl(revocation_list.full_crl if url.path == "/crl" else revocation_list.delta_crl)
+            return
+        if url.path == "/admin/stacks":
+            self.admin_command("stacks")
+            return
+        if url.path != "/metrics":
+            self.send_error(404, "Not found")
+            return
+
+        metrics_text = metrics_registry.render().encode('utf-8')
         self.send_response(200)
-        self.send_header('Content-Type', 'application/x-pem-file')
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(metrics_text)))
         self.end_headers()
-        self.wfile.write(signed_cert.encode('utf-8'))
+        self.wfile.write(metrics_text)
 
-    def sign_csr(self, csr_data):
+    def do_POST(self):
+        if self.path in ("/admin/profile/start", "/admin/profile/stop"):
+            self.admin_command(self.path.rsplit("/", 1)[1])
+            return
+        endpoint = {"/batch": "batch", "/revoke": "revoke"}.get(self.path, "sign")
+        requests_total.inc(endpoint=endpoint)
+        requests_in_flight.inc()
+        start = time.perf_counter()
         try:
-            # Load CA private key and certificate
-            ca_key = crypto.load_privatekey(crypto.FILETYPE_PEM, open(f"{working_path}/certs/rootCA.key").read())
-            ca_cert = crypto.load_certificate(crypto.FILETYPE_PEM, open(f"{working_path}/certs/rootCA.pem").read())
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length).decode('utf-8')
+
+            # Many CSRs in one request, the results are streamed back as JSON Lines
+            if endpoint == "batch":
+                self.sign_batch(body)
+                return
+            if endpoint == "revoke":
+                self.revoke_certificates(body)
+                return
+
+            try:
+                signed_cert = self.sign_csr(body).encode('utf-8')
+            except ServiceBusy as e:
+                self.send_busy(e.retry_after)
+                return
 
-            # Load and parse the incoming CSR
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-pem-file')
+            self.send_header('Content-Length', str(len(signed_cert)))
+            self.end_headers()
+            write_start = time.perf_counter()
+            self.wfile.write(signed_cert)
+            stage_duration.observe(time.perf_counter() - write_start, stage="response_write")
+        finally:
+            requests_in_flight.dec()
+            request_duration.observe(time.perf_counter() - start, endpoint=endpoint)
+
+    def sign_csr(self, csr_data):
+        try:
+            # Load and parse the incoming CSR, so invalid CSRs do not use up a serial number
+            stage_start = time.perf_counter()
             csr = crypto.load_certificate_request(crypto.FILETYPE_PEM, csr_data)
             csr_subject = csr.get_subject()
+            fingerprint = csr_fingerprint(csr)
+            stage_duration.observe(time.perf_counter() - stage_start, stage="csr_parse")
+
+            # Return the certificate issued before for the same CSR (device retries, restarted containers)
+            cached = issued_certificates.acquire(fingerprint)
+            if cached is not None:
+                serial_number, signed_cert_pem = cached
+                cache_hits_total.inc(endpoint="sign")
+                logging.info(f"Certificate for {csr_subject} with serial number {serial_number} returned from the cache")
+                return signed_cert_pem
+
+            try:
+                # Wait for a signing slot, renewals first, or give up with 503 when the service is saturated
+                stage_start = time.perf_counter()
+                weight = admission.acquire(self.signing_lane())
+                admitted = time.perf_counter()
+                stage_duration.observe(admitted - stage_start, stage="admission_wait")
+                try:
+                    # Get the next available serial number from the list
+                    stage_start = time.perf_counter()
+                    serial_number = allocate_serial_number()
+                    stage_duration.observe(time.perf_counter() - stage_start, stage="serial_allocation")
 
-            # Get the next available serial number from the list
-            serial_numbers_data = load_serial_numbers_from_file(f"{working_path}/serial_numbers.json")
-            serial_numbers = serial_numbers_data.get("serial_numbers", [])
-
-            serial_number = None
-            while serial_numbers:
-                potential_serial = serial_numbers[0]
-                if potential_serial not in used_serial_numbers:
-                    serial_number = potential_serial
-                    used_serial_numbers.add(serial_number)
-                    break
-                else:
-                    serial_numbers.pop(0)
-
-            if serial_number is None:
-                raise Exception("No more serial numbers available.")
-
-            # Create a new certificate
-            signed_cert = crypto.X509()
-            signed_cert.set_subject(csr_subject)
-            signed_cert.set_pubkey(csr.get_pubkey())
-            signed_cert.set_serial_number(serial_number)
-            signed_cert.gmtime_adj_notBefore(0)
-            signed_cert.gmtime_adj_notAfter(365 * 24 * 60 * 60)  # 1 year validity
-            signed_cert.set_issuer(ca_cert.get_subject())
-            signed_cert.sign(ca_key, "sha256")
+                    # Create a new certificate from the CA template (1 year validity) and sign it on a worker
+                    signed_cert_pem, issuer = signer.sign(csr_data, serial_number)
+                finally:
+                    admission.release(weight, time.perf_counter() - admitted)
+            except Exception:
+                issued_certificates.release(fingerprint)
+                raise
+            issued_certificates.put(fingerprint, serial_number, signed_cert_pem)
+            certificate_store.record(serial_number, signed_cert_pem, fingerprint)
 
             # Log the certificate signing operation
-            logging.info(f"Certificate for {csr_subject} signed by {ca_cert.get_subject()} with serial number {serial_number}")
+            logging.info(f"Certificate for {csr_subject} signed by {issuer} with serial number {serial_number}")
 
             # Return the signed certificate
-            return crypto.dump_certificate(crypto.FILETYPE_PEM, signed_cert).decode('utf-8')
+            certificates_issued_total.inc()
+            return signed_cert_pem
 
+        except ServiceBusy:
+            raise
         except Exception as e:
             logging.error(f"Error signing CSR: {e}")
+            errors_total.inc(endpoint="sign")
             return ""
 
-# Set up the HTTP server
-handler = CSRHandler
-httpd = socketserver.TCPServer(('0.0.0.0', 8080), handler)
+    #Define function to return the certificate issued for a CSR fingerprint, so devices can fetch it again without signing
+    def get_certificate(self, fingerprint):
+        requests_total.inc(endpoint="certificate")
+        cached = issued_certificates.wait(fingerprint)
+        if cached is not None:
+            cache_hits_total.inc(endpoint="certificate")
+            signed_cert = cached[1].encode('utf-8')
+        else:
+            # Certificates evicted from the cache are still in the certificate store, take the latest one
+            records = certificate_store.query(csr_fingerprint=fingerprint, limit=MAX_QUERY_LIMIT)
+            if not records:
+                self.send_error(404, "No certificate issued for this CSR")
+                return
+            signed_cert = max(records, key=lambda record: record["issued_at"])["certificate"].encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-pem-file')
+        self.send_header('Content-Length', str(len(signed_cert)))
+        self.end_headers()
+        self.wfile.write(signed_cert)
+
+    #Define function to answer a query on the certificate store as JSON
+    #Filters: serial_number, common_name, fingerprint (of the CSR), not_after_from and not_after_to (ISO 8601, UTC), limit
+    def query_certificates(self, parameters):
+        requests_total.inc(endpoint="query")
+        filters = {name: values[-1] for name, values in parameters.items()}
+        try:
+            records = certificate_store.query(
+                serial_number=filters.get("serial_number"),
+                common_name=filters.get("common_name"),
+                csr_fingerprint=filters.get("fingerprint"),
+                not_after_from=filters.get("not_after_from"),
+                not_after_to=filters.get("not_after_to"),
+                limit=filters.get("limit", 100),
+            )
+        except ValueError as e:
+            self.send_error(400, f"Invalid query: {e}")
+            return
+
+        for record in records:
+            record["revoked"] = revocation_list.is_revoked(record["serial_number"])
+        body = json.dumps({"certificates": records}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #Define function to revoke certificates by serial number, the body is JSON:
+    #{"serial_numbers": ["<SERIAL-NUMBER>", ...], "reason": "keyCompromise"} (or "serial_number" for one certificate)
+    def revoke_certificates(self, body):
+        try:
+            request = json.loads(body)
+            serial_numbers = [int(serial_number) for serial_number in request.get("serial_numbers") or [request["serial_number"]]]
+            revoked = set(revocation_list.revoke(serial_numbers, request.get("reason", "unspecified")))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_error(400, f"Invalid revocation request: {e}")
+            return
+        except Exception as e:
+            logging.error(f"Error revoking certificates: {e}")
+            self.send_error(500, "Revocation failed")
+            return
+
+        # Serial numbers are 128 bit, they are written as strings like in the batch responses
+        response = {
+            "revoked": [str(serial_number) for serial_number in dict.fromkeys(serial_numbers) if serial_number in revoked],
+            "already_revoked": [str(serial_number) for serial_number in dict.fromkeys(serial_numbers) if serial_number not in revoked],
+        }
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #Define function to run a profiling command: start, stop (writes the profile and the thread stacks) or stacks
+    #Only available with --profiling and to clients on the same host (docker exec, ssh tunnel)
+    def admin_command(self, command):
+        if profiler is None or not ipaddress.ip_address(self.client_address[0]).is_loopback:
+            self.send_error(404, "Not found")
+            return
+        files = []
+        if command == "start":
+            if profiler.start():
+                signer.signal_workers(signal.SIGUSR1)
+        elif command == "stop":
+            if profiler.running():
+                signer.signal_workers(signal.SIGUSR1)
+                files.append(str(profiler.stop()))
+        else:
+            signer.signal_workers(signal.SIGUSR2)
+            files.append(str(profiler.dump_stacks()))
+
+        # The workers write their own files in the same directory
+        body = json.dumps({"profiling": profiler.running(), "files": files}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #Define function to send the latest full or delta CRL (DER)
+    def send_crl(self, crl):
+        requests_total.inc(endpoint="crl")
+        if crl is None:
+            self.send_error(503, "CRL not published yet")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pkix-crl')
+        self.send_header('Content-Length', str(len(crl)))
+        self.end_headers()
+        self.wfile.write(crl)
+
+    def sign_batch(self, body):
+        items = parse_batch_request(body, self.headers.get('Content-Type', ''))
+        if not items:
+            self.send_error(400, "No CSR found in the request")
+            return
+        if len(items) > MAX_BATCH_SIZE:
+            self.send_error(413, f"Batch has {len(items)} CSRs, the maximum is {MAX_BATCH_SIZE}")
+            return
+
+        # Parse and fingerprint every CSR, failures are reported for the item only
+        entries = []
+        certificates = {}
+        for item_id, csr_data, error in items:
+            fingerprint = None
+            if error is None:
+                try:
+                    stage_start = time.perf_counter()
+                    fingerprint = csr_fingerprint(crypto.load_certificate_request(crypto.FILETYPE_PEM, csr_data))
+                    stage_duration.observe(time.perf_counter() - stage_start, stage="csr_parse")
+                    # A CSR repeated in the batch is signed once, state: [csr_data, serial_number, certificate, error]
+                    certificates.setdefault(fingerprint, [csr_data, None, None, None])
+                except Exception as e:
+                    error = f"Error signing CSR: {e}"
+            entries.append((item_id, fingerprint, error))
+
+        # Claim the CSRs not signed before. The CSRs being signed by another request are answered from the cache once
+        # it is done, like in sign_csr, but waited for without holding any claim so two batches never wait for each other
+        while True:
+            to_sign = []
+            claimed = set()
+            in_flight = []
+            for fingerprint, state in certificates.items():
+                if state[2] is None:
+                    cached, is_claimed = issued_certificates.try_acquire(fingerprint)
+                    if cached is not None:
+                        state[1], state[2] = cached
+                    elif is_claimed:
+                        claimed.add(fingerprint)
+                        to_sign.append(fingerprint)
+                    else:
+                        in_flight.append(fingerprint)
+            if not in_flight:
+                break
+            for fingerprint in claimed:
+                issued_certificates.release(fingerprint)
+            for fingerprint in in_flight:
+                cached = issued_certificates.wait(fingerprint)
+                if cached is not None:
+                    certificates[fingerprint][1], certificates[fingerprint][2] = cached
+
+        # The batch takes a signing slot per CSR (up to all of them), or is rejected with 503 when the service is saturated
+        weight = 0
+        if to_sign:
+            try:
+                stage_start = time.perf_counter()
+                weight = admission.acquire(self.signing_lane(), len(to_sign))
+                stage_duration.observe(time.perf_counter() - stage_start, stage="admission_wait")
+            except ServiceBusy as e:
+                for fingerprint in claimed:
+                    issued_certificates.release(fingerprint)
+                self.send_busy(e.retry_after)
+                return
+        admitted = time.perf_counter()
+
+        # Hand out the serial numbers
+        jobs = []
+        for fingerprint in to_sign:
+            state = certificates[fingerprint]
+            try:
+                stage_start = time.perf_counter()
+                state[1] = allocate_serial_number()
+                stage_duration.observe(time.perf_counter() - stage_start, stage="serial_allocation")
+                jobs.append((state[0], state[1]))
+            except Exception as e:
+                state[3] = f"Error signing CSR: {e}"
+                if fingerprint in claimed:
+                    issued_certificates.release(fingerprint)
+                    claimed.discard(fingerprint)
+
+        try:
+            self.stream_batch(entries, certificates, jobs, claimed)
+        finally:
+            if weight:
+                admission.release(weight, time.perf_counter() - admitted, len(jobs))
+            # Release the claims left if the client went away in the middle of the response
+            for fingerprint in claimed:
+                issued_certificates.release(fingerprint)
+
+    #Define function to stream the batch results back in the request order as the workers sign the CSRs
+    def stream_batch(self, entries, certificates, jobs, claimed):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        if self.request_version == "HTTP/1.0":
+            # No chunked encoding in HTTP/1.0, the end of the response is the end of the connection
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        # Stream the certificates back in the request order as the workers sign them
+        signed = signer.sign_many(jobs)
+        signed_count = 0
+        failed_count = 0
+        for index, (item_id, fingerprint, error) in enumerate(entries):
+            result = {"index": index}
+            if item_id is not None:
+                result["id"] = item_id
+            if error is None:
+                state = certificates[fingerprint]
+                if state[2] is None and state[3] is None:
+                    # First time this CSR shows up in the response, take its certificate from the workers
+                    signed_cert_pem, issuer, sign_error = next(signed)
+                    if sign_error is None:
+                        state[2] = signed_cert_pem
+                        issued_certificates.put(fingerprint, state[1], signed_cert_pem)
+                        certificate_store.record(state[1], signed_cert_pem, fingerprint)
+                        signed_count += 1
+                    else:
+                        state[3] = f"Error signing CSR: {sign_error}"
+                        if fingerprint in claimed:
+                            issued_certificates.release(fingerprint)
+                    claimed.discard(fingerprint)
+                error = state[3]
+                if error is None:
+                    # Serial numbers are 128 bit, send them as strings so every JSON parser keeps them intact
+                    result["serial_number"] = str(state[1])
+                    result["certificate"] = state[2]
+            if error is not None:
+                result["error"] = error
+                failed_count += 1
+            write_start = time.perf_counter()
+            self.write_chunk((json.dumps(result) + "\n").encode('utf-8'))
+            stage_duration.observe(time.perf_counter() - write_start, stage="response_write")
+        if self.request_version != "HTTP/1.0":
+            self.wfile.write(b"0\r\n\r\n")
+
+        # CSRs answered without signing were issued before, or repeated in the batch
+        cached_count = len(entries) - signed_count - failed_count
+        certificates_issued_total.inc(signed_count)
+        cache_hits_total.inc(cached_count, endpoint="batch")
+        errors_total.inc(failed_count, endpoint="batch")
+
+        # Log the batch once instead of every certificate
+        logging.info(f"Batch of {len(entries)} CSRs: {signed_count} certificates signed, {cached_count} returned from the cache, {failed_count} failed")
+
+# Describe the HTTP server, every connection is handled on its own thread and the signing runs on the worker pool
+class SigningHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    allow_reuse_address = True
+    # Wait for in-flight requests when shutting down
+    daemon_threads = False
+    # Room for a burst of devices connecting at the same time
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self.stopping = False
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+
+    def process_request_thread(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.discard(request)
+
+    #Define function to wake up keep-alive connections waiting for their next request, so they close
+    #Requests being processed still send their response (with Connection: close)
+    def close_idle_connections(self):
+        self.stopping = True
+        with self.connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    #Pass arguments into variables using argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", action="store", type=int, default=8080, dest="port", help="Port the signing service listens on")
+    parser.add_argument("--idle-timeout", action="store", type=int, default=30, dest="idle_timeout", help="Seconds before an idle keep-alive connection is closed")
+    parser.add_argument("--max-requests-per-connection", action="store", type=int, default=100, dest="max_requests_per_connection", help="Requests served on a keep-alive connection before it is closed")
+    parser.add_argument("--cache-size", action="store", type=int, default=50000, dest="cache_size", help="Number of issued certificates remembered by CSR fingerprint")
+    parser.add_argument("--max-queue", action="store", type=int, default=256, dest="max_queue", help="Requests waiting for a signing slot in each lane before new ones are rejected with 503")
+    parser.add_argument("--queue-timeout", action="store", type=float, default=10, dest="queue_timeout", help="Seconds a request waits for a signing slot before it is rejected with 503")
+    parser.add_argument("--serial-leases", action="store", default=None, dest="serial_leases", help="SQLite file shared by the signing service replicas to lease blocks of serial numbers (default: single replica with a journal)")
+    parser.add_argument("--serial-block-size", action="store", type=int, default=64, dest="serial_block_size", help="Serial numbers leased by a replica at a time")
+    parser.add_argument("--crl-interval", action="store", type=int, default=3600, dest="crl_interval", help="Seconds between two full CRLs")
+    parser.add_argument("--delta-crl-interval", action="store", type=int, default=60, dest="delta_crl_interval", help="Seconds between two delta CRLs")
+    parser.add_argument("--profiling", action="store_true", dest="profiling", help="Profile the service on SIGUSR1 and the /admin endpoints, see the README")
+    parser.add_argument("-b", "--backend", action="store", choices=BACKENDS, default="pyopenssl", dest="backend", help="Signing backend (default: pyopenssl)")
+    parser.add_argument("--pkcs11-module", action="store", default=None, dest="pkcs11_module", help="PKCS#11 library for the pkcs11 backend (default: PKCS11_MODULE or SoftHSM), the PIN is read from PKCS11_PIN")
+    parser.add_argument("--pkcs11-token-label", action="store", default="signing-ca", dest="pkcs11_token_label", help="Label of the token holding the CA key")
+    parser.add_argument("--pkcs11-key-label", action="store", default="rootCA", dest="pkcs11_key_label", help="Label of the CA private key on the token")
+    parser.add_argument("-w", "--workers", action="store", type=int, default=os.cpu_count() or 1, dest="workers", help="Number of signing worker processes (default: number of cores, 1 signs in the server process)")
+    args = parser.parse_args()
+
+    # Load the serial numbers and replay the allocations made before a restart
+    if args.serial_leases:
+        # Several replicas share the pool, each one leases blocks of serial numbers from the shared store
+        serial_allocator = LeasedSerialAllocator(working_path / "serial_numbers.json", args.serial_leases, args.serial_block_size, journal_path=working_path / "serial_numbers.journal")
+    else:
+        serial_allocator = SerialAllocator(working_path / "serial_numbers.json", working_path / "serial_numbers.journal")
+
+    # Load the certificates issued before a restart
+    issued_certificates = IssuedCertificateCache(working_path / "issued_certificates.jsonl", args.cache_size)
+
+    # Open the issued certificate database
+    certificate_store = CertificateStore(working_path / "certificates.db")
+
+    # Load the revoked serial numbers and start publishing the CRLs to crl/
+    revocation_list = RevocationList(working_path / "revocations.db", working_path / "crl", working_path / "certs" / "rootCA.key", working_path / "certs" / "rootCA.pem", args.crl_interval, args.delta_crl_interval, crl_generation_duration)
+    revocation_list.start()
+
+    # Start the signing workers
+    backend_options = {"module": args.pkcs11_module, "token_label": args.pkcs11_token_label, "key_label": args.pkcs11_key_label}
+    signer = SigningPool(working_path / "certs" / "rootCA.key", working_path / "certs" / "rootCA.pem", args.workers, stage_duration, args.backend, backend_options, logs_folder if args.profiling else None)
+
+    # SIGUSR1 starts and stops a profile of the server and its workers, SIGUSR2 writes the thread stacks
+    if args.profiling:
+        profiler = SamplingProfiler(logs_folder, "signing-service")
+        install_signal_handlers(profiler, signer.signal_workers)
+
+    # Two signing slots per worker keep every worker busy while the next CSR is sent to it
+    admission = AdmissionController(signer.workers * 2, args.max_queue, args.queue_timeout)
+
+    # Set up the HTTP server
+    handler = CSRHandler
+    handler.timeout = args.idle_timeout
+    handler.max_requests_per_connection = args.max_requests_per_connection
+    httpd = SigningHTTPServer(('0.0.0.0', args.port), handler)
+
+    #Define function to stop the server gracefully, in-flight requests are completed first
+    def handle_shutdown_signal(signum, frame):
+        logging.info(f"Received signal {signum}, shutting down")
+        # shutdown() waits for serve_forever() to return, so it cannot run on the main thread
+        threading.Thread(target=httpd.shutdown).start()
+
+    signal.signal(signal.SIGTERM, handle_shutdown_signal)
+    signal.signal(signal.SIGINT, handle_shutdown_signal)
+
+    logging.info(f"Server started at http://0.0.0.0:{args.port} with {signer.workers} signing workers")
+    httpd.serve_forever()
 
-logging.info("Server started at http://0.0.0.0:8080")
-httpd.serve_forever()
\ No newline at end of file
+    # Wait for the request threads and the signing workers to finish
+    httpd.close_idle_connections()
+    httpd.server_close()
+    signer.shutdown()
+    issued_certificates.close()
+    certificate_store.close()
+    revocation_list.close()
+    serial_allocator.close()
+    logging.info("Server stopped")
@@ -31,17 +31,25 @@ opensource-codeofconduct@amazon.com with any additional questions or comments.
 import subprocess
 import random
 from OpenSSL import crypto
-from retrying import retry
 import requests
 from pathlib import Path
 import os
 import logging
 import datetime
+import time
+import email.utils
+from key_pool import KEY_ALGORITHMS, KeyPool, load_private_key
 
 #Define working path 
 working_path= Path(__file__).resolve().parent
 certs_path = working_path /"certs" 
 
+# Algorithm of the device key (see key_pool.KEY_ALGORITHMS), selected with the KEY_ALGORITHM environment variable, RSA 2048 by default
+key_algorithm = os.environ.get("KEY_ALGORITHM", "rsa-2048").lower()
+
+# Optional pool of keys generated ahead of time (see key_pool.py), the key is only generated here when the pool is empty
+key_pool_path = os.environ.get("KEY_POOL")
+
 # Define a logging function
 def custom_log(message):
     timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -133,20 +141,45 @@ def device_cert_gen():
 
 
     
-#Define function to generate Device keys and certificate CSR. 
+#Define function to take the device key from the key pool, returns None when there is no pool or it is empty
+def take_key_from_pool():
+    if not key_pool_path:
+        return None
+    try:
+        key_pool = KeyPool(key_pool_path)
+        try:
+            keys = key_pool.take(key_algorithm)
+        finally:
+            key_pool.close()
+    except Exception as e:
+        custom_log(f"Error taking a key from the key pool {key_pool_path}: {e}")
+        return None
+    if not keys:
+        custom_log(f"Key pool {key_pool_path} has no {key_algorithm} key left")
+        return None
+    custom_log(f"Took {key_algorithm} private key from the key pool {key_pool_path}")
+    return load_private_key(keys[0])
+
+#Define function to generate Device keys and certificate CSR, returns the CSR PEM or None when it could not be generated
 def generate_key_and_csr_with_dn(key_name, common_name, organization, organizational_unit, dnQualifier, path):
     try:
         # Check if deviceCert.csr is already present
         custom_log("Checking if Device Certificate is existing")
         csr_file_path = os.path.join(path, "deviceCert.csr")
         if os.path.exists(csr_file_path):
+            # Generated before a restart, it is sent again and the signing service returns the certificate it issued for it
             custom_log("CSR file already present, skipping CSR generation.")
-            return None  # Return None if CSR file is already present
+            with open(csr_file_path, "r") as csr_file:
+                return csr_file.read()
 
         # Generate a private key
-        custom_log("generating private key")
-        key = crypto.PKey()
-        key.generate_key(crypto.TYPE_RSA, 2048)
+        if key_algorithm not in KEY_ALGORITHMS:
+            raise ValueError(f"Unknown KEY_ALGORITHM {key_algorithm}, use one of {', '.join(KEY_ALGORITHMS)}")
+        generate_key, digest = KEY_ALGORITHMS[key_algorithm]
+        key = take_key_from_pool()
+        if key is None:
+            custom_log(f"generating {key_algorithm} private key")
+            key = crypto.PKey.from_cryptography_key(generate_key())
 
         # Adding exception for organizational unit Example
         if organizational_unit == "":
@@ -157,7 +190,7 @@ def generate_key_and_csr_with_dn(key_name, common_name, organization, organizati
             req.get_subject().dnQualifier = dnQualifier
             req.get_subject().serialNumber 
             req.set_pubkey(key)
-            req.sign(key, "sha256")
+            req.sign(key, digest)
         else:
             # Generate a certificate signing request (CSR) 
             req = crypto.X509Req()
@@ -167,7 +200,7 @@ def generate_key_and_csr_with_dn(key_name, common_name, organization, organizati
             req.get_subject().dnQualifier = dnQualifier
             req.get_subject().serialNumber 
             req.set_pubkey(key)
-            req.sign(key, "sha256")
+            req.sign(key, digest)
         custom_log("Creating CSR")
         # Save the private key in file
         with open(f"{path}/{key_name}.key", "wb") as key_file:
@@ -191,39 +224,90 @@ def generate_key_and_csr_with_dn(key_name, common_name, organization, organizati
         custom_log(e)
 
 
+# Reuse one HTTP connection to the signing service for every CSR and retry (keep-alive)
+http_session = requests.Session()
+http_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+# Retries of the CSR submission, with exponential backoff and full jitter so a fleet started at once does not retry in waves
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+
+#Define function to read the Retry-After header (seconds or HTTP date) of a response, returns seconds or None
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+#Define function to return the seconds to wait before the next attempt
+def retry_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        # Wait at least what the server asked for, the jitter spreads the devices told the same value
+        return retry_after + random.uniform(0, min(retry_after, BACKOFF_MAX_SECONDS) or BACKOFF_BASE_SECONDS)
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
 #Define function to send CSR to server, and get a signed certificate back. 
 # It also will start the MQTT connection and test script
-# Define a retry decorator
-@retry(stop_max_attempt_number=3, wait_fixed=3000)  # Retry 3 times with a fixed delay of 3 seconds
 def send_csr_to_server(csr, server_url, certificate_file_path):
-    try:
-        # Check if deviceCert.crt is already present
-        custom_log("Checking if Device Certificate is existing")
-        crt_file_path = os.path.join(certificate_file_path, "deviceCert.crt")
-        if os.path.exists(crt_file_path):
-            custom_log("Certificate file already present, skipping CSR submission and MQTT connection.")
-            return  # Return without executing further if certificate file is present
-        
-        #Submit CSR to server
-        custom_log("Sending CSR to server")
-        headers = {'Content-Type': 'application/x-pem-file'}
-        response = requests.post(server_url, data=csr.encode('utf-8'), headers=headers)
-
-        if response.status_code == 200:
-            custom_log("CSR successfully sent to the server.")
-            custom_log("Server response:")
-            custom_log(response.text)
-
-            # Save the response as a certificate file
-            with open(f"{certs_path}/deviceCert.crt", "w") as cert_file:
-                cert_file.write(response.text)
-            
-            custom_log(f"Certificate saved to {certificate_file_path}")
-                                     
-        else:
-            raise Exception(f"Error sending CSR to the server. Status code: {response.status_code}\nServer response: {response.text}")
-    except Exception as e:
-        custom_log(e)
+    # Check if deviceCert.crt is already present
+    custom_log("Checking if Device Certificate is existing")
+    crt_file_path = os.path.join(certificate_file_path, "deviceCert.crt")
+    if os.path.exists(crt_file_path):
+        custom_log("Certificate file already present, skipping CSR submission and MQTT connection.")
+        return  # Return without executing further if certificate file is present
+
+    # The key or the CSR could not be generated, the error was logged by generate_key_and_csr_with_dn
+    if csr is None:
+        custom_log("No CSR available, skipping CSR submission.")
+        return
+
+    for attempt in range(MAX_ATTEMPTS):
+        retry_after = None
+        try:
+            #Submit CSR to server
+            custom_log("Sending CSR to server")
+            headers = {'Content-Type': 'application/x-pem-file'}
+            response = http_session.post(server_url, data=csr.encode('utf-8'), headers=headers, timeout=60)
+
+            # The signing service answers 200 with an empty body when it could not sign the CSR
+            if response.status_code == 200 and response.text:
+                custom_log("CSR successfully sent to the server.")
+                custom_log("Server response:")
+                custom_log(response.text)
+
+                # Save the response as a certificate file
+                with open(f"{certs_path}/deviceCert.crt", "w") as cert_file:
+                    cert_file.write(response.text)
+
+                custom_log(f"Certificate saved to {certificate_file_path}")
+                return
+
+            if response.status_code in (429, 503):
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                custom_log(f"Signing service busy. Status code: {response.status_code}, Retry-After: {response.headers.get('Retry-After')}")
+            elif 400 <= response.status_code < 500 and response.status_code != 408:
+                # The request itself is wrong, sending it again does not help
+                custom_log(f"Error sending CSR to the server. Status code: {response.status_code}\nServer response: {response.text}")
+                return
+            else:
+                custom_log(f"Error sending CSR to the server. Status code: {response.status_code}\nServer response: {response.text}")
+        except Exception as e:
+            custom_log(e)
+
+        if attempt + 1 < MAX_ATTEMPTS:
+            delay = retry_delay(attempt, retry_after)
+            custom_log(f"Retrying in {delay:.1f} seconds (attempt {attempt + 2} of {MAX_ATTEMPTS})")
+            time.sleep(delay)
+
+    custom_log(f"Could not get the CSR signed after {MAX_ATTEMPTS} attempts")
 
 #Define a function to extract the Device certificate Serial number from signed Certificate
 def get_serial_number_from_crt(crt_file_path):
@@ -0,0 +1,168 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+## Code of Conduct
+# This project has adopted the [Amazon Open Source Code of Conduct](https://aws.github.io/code-of-conduct).
+# For more information see the [Code of Conduct FAQ](https://aws.github.io/code-of-conduct-faq) or contact
+# opensource-codeofconduct@amazon.com with any additional questions or comments.
+
+
+#This module keeps a pool of device keys generated ahead of time, so the devices and the bulk simulation do not
+#pay the key generation (about 100 ms for an RSA 2048 key) when they need a key. The keys are stored DER encoded
+#in a SQLite database, a key is taken from the pool in a transaction that marks it used and erases it from the
+#store, so a key is never handed out twice, even to processes or containers sharing the database on a volume.
+#The pool is filled ahead of time from the command line:
+#   python3 key_pool.py <POOL> -n <NUMBER-OF-KEYS> -k <KEY-ALGORITHM> [-w <WORKERS>]
+
+#Dependencies
+import os
+import socket
+import sqlite3
+import datetime
+import threading
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from OpenSSL import crypto
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+
+# Key algorithms the device keys can be generated with: (key generator, CSR digest)
+KEY_ALGORITHMS = {
+    "rsa-2048": (lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048), "sha256"),
+    "rsa-3072": (lambda: rsa.generate_private_key(public_exponent=65537, key_size=3072), "sha256"),
+    "ecdsa-p256": (lambda: ec.generate_private_key(ec.SECP256R1()), "sha256"),
+    "ecdsa-p384": (lambda: ec.generate_private_key(ec.SECP384R1()), "sha384"),
+}
+
+# Number of keys generated and inserted in one transaction when the pool is filled
+FILL_BATCH_SIZE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    algorithm TEXT,
+    private_key BLOB,
+    created_at TEXT,
+    used_at TEXT,
+    used_by TEXT
+);
+CREATE INDEX IF NOT EXISTS keys_available ON keys (algorithm, id) WHERE used_at IS NULL;
+"""
+
+
+#Define function to return the current time as stored in the pool
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+#Define function to generate keys, returns them DER encoded (PKCS#8), it runs in the worker processes of fill()
+def generate_keys(algorithm, count):
+    generate_key, _ = KEY_ALGORITHMS[algorithm]
+    return [generate_key().private_bytes(serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()) for _ in range(count)]
+
+
+#Define function to turn a key taken from the pool into a pyOpenSSL key
+#The keys were generated by generate_keys, the RSA key check (which costs as much as signing tens of CSRs) is skipped
+def load_private_key(private_key_der):
+    return crypto.PKey.from_cryptography_key(serialization.load_der_private_key(private_key_der, password=None, unsafe_skip_rsa_key_validation=True))
+
+
+#Describe class that stores pre-generated keys and hands every one of them out once
+class KeyPool:
+    def __init__(self, path, consumer_id=None):
+        self.path = str(path)
+        self.consumer_id = consumer_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # A key must be marked used on disk before it is used
+        self._connection.execute("PRAGMA synchronous=FULL")
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+
+    #Define function to return the number of keys left for an algorithm
+    def available(self, algorithm):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM keys WHERE algorithm = ? AND used_at IS NULL", (algorithm,)).fetchone()[0]
+
+    #Define function to return the number of keys left and used of every algorithm: {algorithm: (available, used)}
+    def stats(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT algorithm, SUM(used_at IS NULL), SUM(used_at IS NOT NULL) FROM keys GROUP BY algorithm ORDER BY algorithm").fetchall()
+        return {algorithm: (available, used) for algorithm, available, used in rows}
+
+    #Define function to add DER encoded keys of an algorithm to the pool, in one transaction
+    def add(self, algorithm, keys):
+        created_at = utc_now()
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                self._connection.executemany("INSERT INTO keys (algorithm, private_key, created_at) VALUES (?, ?, ?)", [(algorithm, key, created_at) for key in keys])
+
+    #Define function to generate keys into the pool, on a number of processes, returns the number of keys added
+    def fill(self, algorithm, count, workers=1):
+        if algorithm not in KEY_ALGORITHMS:
+            raise ValueError(f"Unknown key algorithm {algorithm}, use one of {', '.join(KEY_ALGORITHMS)}")
+        batches = [min(FILL_BATCH_SIZE, count - start) for start in range(0, count, FILL_BATCH_SIZE)]
+        added = 0
+        if workers <= 1:
+            for size in batches:
+                self.add(algorithm, generate_keys(algorithm, size))
+                added += size
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for keys in executor.map(generate_keys, [algorithm] * len(batches), batches):
+                    self.add(algorithm, keys)
+                    added += len(keys)
+        logging.info(f"Added {added} {algorithm} keys to the key pool {self.path}")
+        return added
+
+    #Define function to take keys of an algorithm out of the pool, returns up to count DER encoded keys
+    #The keys are marked used and erased from the store in the same transaction, fewer keys are returned when the
+    #pool runs out and the caller generates the missing ones
+    def take(self, algorithm, count=1):
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                rows = self._connection.execute("SELECT id, private_key FROM keys WHERE algorithm = ? AND used_at IS NULL ORDER BY id LIMIT ?", (algorithm, count)).fetchall()
+                used_at = utc_now()
+                self._connection.executemany("UPDATE keys SET private_key = NULL, used_at = ?, used_by = ? WHERE id = ?", [(used_at, self.consumer_id, key_id) for key_id, _ in rows])
+        return [private_key for _, private_key in rows]
+
+    #Define function to close the pool
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+#Main, fill a pool from the command line and print what it holds
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pool", action="store", help="Key pool database, created when missing")
+    parser.add_argument("-n", "--count", action="store", type=int, default=0, dest="count", help="Number of keys to generate into the pool (default: 0, only print the pool)")
+    parser.add_argument("-k", "--key-algorithm", action="store", default="rsa-2048", choices=list(KEY_ALGORITHMS), dest="key_algorithm", help="Algorithm of the keys (default: rsa-2048)")
+    parser.add_argument("-w", "--workers", action="store", type=int, default=os.cpu_count() or 1, dest="workers", help="Number of processes generating the keys (default: number of cores)")
+    args = parser.parse_args()
+
+    pool = KeyPool(args.pool)
+    if args.count > 0:
+        pool.fill(args.key_algorithm, args.count, args.workers)
+    for algorithm, (available, used) in pool.stats().items():
+        print(f"{algorithm}: {available} available, {used} used")
+    pool.close()
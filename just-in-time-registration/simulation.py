@@ -37,12 +37,14 @@ try:
     parser = argparse.ArgumentParser(description="Simulate a fleet of devices in AWS IoT Core")
     parser.add_argument("-e", "--endpoint", action="store", required=True, dest="endpoint", help="Regional AWS IoT Core endpoint")
     parser.add_argument("-n", "--fleetsize", action="store", required=True, dest="fleetsize", type=int, help="Number of devices in the simulated fleet")
+    parser.add_argument("-k", "--key-algorithm", action="store", default="rsa-2048", choices=["rsa-2048", "rsa-3072", "ecdsa-p256", "ecdsa-p384"], dest="key_algorithm", help="Algorithm of the device keys (default: rsa-2048)")
     parser.add_argument("--aws_access_key_id", action="store", required=True, dest="key_id", help="AWS access key ID")
     parser.add_argument("--aws_secret_access_key", action="store", required=True, dest="secret_key", help="AWS secret access key")
     parser.add_argument("--region_name", action="store", required=True, dest="region", help="AWS region name")
 
     args = parser.parse_args()
     endpoint = args.endpoint
+    key_algorithm = args.key_algorithm
     number_of_devices = args.fleetsize
     # Define your AWS credentials and region (modify as needed)
     aws_access_key_id = args.key_id
@@ -274,6 +276,9 @@ print(f"Deploying fleet of {number_of_devices} devices")
 #Create IOT_ENDPOINT Variable
 set_environment_variable('IOT_ENDPOINT', endpoint)
 
+#Create KEY_ALGORITHM Variable, the devices generate their keys with it
+set_environment_variable('KEY_ALGORITHM', key_algorithm)
+
 #Copy rootCA.pem and rootCA.key to /cert_signing_service
 copy_file('rootCA.pem', './cert_signing_service/certs', stop_on_error=True)
 copy_file('rootCA.key', './cert_signing_service/certs', stop_on_error=True)